@@ -9,10 +9,8 @@ import time
 from queue import Queue
 from threading import Event
 from dart.common.killer import GracefulSignalKiller
-import urllib.parse
-import dart.agent.api
-import platform
-import json
+from dart.common.metrics import MetricsRegistry
+from .telemetry import Telemetry
 
 # import explicitly and specifically like this and NOT as a relative import.
 # this is entirely so that we can check if the version number has changed. if
@@ -38,6 +36,9 @@ class DartAgent(object):
         self.reread_trigger = Event()
         self.rewrite_trigger = Event()
 
+        # when we last checked for new configurations on a TICK event
+        self.rewritten = time.monotonic()
+
         # anything put onto this queue will get sent to the CorkAPI. it should
         # look like a valid CorkAPI message.
         self.events = Queue()
@@ -46,6 +47,18 @@ class DartAgent(object):
         # on the call to run() below
         self.handlers = []
 
+        # keep track of whether we're keeping up with supervisor. this is
+        # sent to the DartAPI by the probe handler.
+        self.telemetry = Telemetry()
+        self.telemetry.queues = lambda: {x.name: x.queued for x in self.handlers}
+
+        # keep track of what supervisor sends us and how long it takes us to
+        # deal with it. handlers keep track of their own work.
+        self.metrics = MetricsRegistry()
+        self.received = self.metrics.counter("agent_supervisor_events_total", "events received from supervisor", ["event"])
+        self.dispatched = self.metrics.histogram("agent_dispatch_seconds", "time taken by handlers to take events from supervisor", ["handler"])
+        self.metrics.collect("agent_telemetry", self.telemetry.report, counters=["gaps", "skipped"], label="handler")
+
     def run(self, *args, **kwargs):
         # initialize the settings manager singleton
         from dart.common.settings import SettingsManager
@@ -53,22 +66,29 @@ class DartAgent(object):
 
         # load configurations immediately on start (onto disk, into memory)
         from .configurations import ConfigurationsWriter
-        ConfigurationsWriter().write()
+        writer = ConfigurationsWriter()
+        self.metrics.collect("agent_configuration", lambda: {"age": writer.age()})
 
         # if we're just writing configurations then exit immediately
         if (kwargs.get("write_configuration")):
+            writer.write()
             self.logger.info("writing configuration files and exiting")
             return 0
 
+        # start from the configurations that we last wrote so that we don't
+        # have to wait for the DartAPI and then get new ones in the
+        # background. if we don't have any then we have to wait.
+        if (writer.load()):
+            self.rewrite_trigger.set()
+        else:
+            writer.write()
+
         # make sure we are an event listener
         supervisor_server_url = os.environ.get("SUPERVISOR_SERVER_URL")
         if (supervisor_server_url is None):
             raise RuntimeError("cannot run from outside of a supervisor eventlistener")
         self.logger.info("connecting to supervisor over {}".format(supervisor_server_url))
 
-        # tell dart about the system
-        self._update_system_configuration()
-
         # this handler listens for TCP/UDP/Unix connections from the local
         # host. those connections send us events that will be forwarded to the
         # CorkAPI. this handler will also listen for events from the agent
@@ -76,6 +96,11 @@ class DartAgent(object):
         from .handlers.events import EventHandler
         self.handlers.append(EventHandler(events=self.events))
 
+        # this handler listens for HTTP connections from the local host and
+        # tells them about everything that we're keeping track of
+        from .handlers.metrics import MetricsHandler
+        self.handlers.append(MetricsHandler(events=self.events))
+
         # this handler listens for TCP connections from the world. those
         # connections will send us messages for actions to perform such as
         # rereading configurations, rewriting configurations, starting or
@@ -267,6 +292,9 @@ class DartAgent(object):
             return
 
     def _handle_event(self, header, event, data):
+        self.received.inc(event=header["eventname"])
+        self.telemetry.received(header, event)
+
         # kick off all housekeeping once per minute
         if (header["eventname"] == "TICK_60"):
             self.logger.debug("received {} event".format(header["eventname"]))
@@ -276,7 +304,8 @@ class DartAgent(object):
         for handler in self.handlers:
             if (handler.can_handle(header["eventname"])):
                 self.logger.debug("sending {} event {} to {} handler".format(header["eventname"], header["serial"], handler.name))
-                handler.handle(header["eventname"], event, data)
+                with self.dispatched.time(handler=handler.name):
+                    handler.handle(header["eventname"], event, data)
                 self.logger.debug("{} handler finished processing {} event {}".format(handler.name, header["eventname"], header["serial"]))
 
         # returning True means process more events. False means we exit. only
@@ -298,6 +327,7 @@ class DartAgent(object):
         event_timestamp = int(event.get("when", 0))  # get the time of the event (only present on TICK events)
         if (timestamp - event_timestamp > interval):
             self.logger.warn("skipping {} from {} because it is older than {} seconds ({} seconds ago)".format(event_type, event_timestamp, interval, (timestamp - event_timestamp)))
+            self.telemetry.skip()
 
             # don't bother checking to see if the version changed, just keep
             # processing things (including tick events) and eventually we'll
@@ -316,37 +346,27 @@ class DartAgent(object):
             }
         })
 
-        # now that we've collapsed the tick events, issue a rewrite command
-        self.logger.debug("tick handler triggering a rewrite")
-        self.rewrite_trigger.set()
+        # now that we've collapsed the tick events, issue a reread command to
+        # keep the DartAPI up to date with what is running
+        self.logger.debug("tick handler triggering a reread")
+        self.reread_trigger.set()
+
+        # the DartAPI tells us when our configurations change so we only need
+        # to check for ourselves every so often in case we missed it
+        if (time.monotonic() - self.rewritten >= float(self.settings.get("agent.configuration.interval", 300))):
+            self.logger.debug("tick handler triggering a rewrite")
+            self.rewrite_trigger.set()
+            self.rewritten = time.monotonic()
 
         # now that we've collapsed the tick events, send it to our handlers
         for handler in self.handlers:
             if (handler.can_handle(event_type)):
-                handler.handle(event_type, event, data)
+                with self.dispatched.time(handler=handler.name):
+                    handler.handle(event_type, event, data)
 
         # finally, we periodically check to see if we need to restart ourselves
         return not self._has_version_changed()
 
-    def _update_system_configuration(self):
-        booted = None
-        try:
-            import psutil
-            booted = int(psutil.boot_time())
-        except ModuleNotFoundError:
-            pass
-
-        # assemble all of the parts
-        configuration = {
-            "booted": booted,               # when the server started
-            "kernel": platform.platform(),  # kernel version
-        }
-
-        # send system information to the DartAPI
-        url = "{}/agent/v1/probe/{}".format(dart.agent.api.DART_API_URL, urllib.parse.quote(self.fqdn))
-        response = dart.agent.api.dart.post(url, data=json.dumps(configuration), timeout=22)
-        response.raise_for_status()
-
     def _has_version_changed(self):
         try:
             old_version = dart.agent.__version__
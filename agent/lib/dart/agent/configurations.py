@@ -2,10 +2,14 @@ import logging
 from dart.common.singleton import Singleton
 from dart.common.settings import SettingsManager
 import dart.agent.api
+import dart.common.blobs
 from threading import RLock
 from copy import deepcopy
 import urllib.parse
 import socket
+import json
+import hashlib
+import time
 import pwd
 import grp
 import os
@@ -32,24 +36,169 @@ class ConfigurationsWriter(metaclass=Singleton):
         # be found under the configuration path.
         self.supervisor_configuration_path = os.path.join(configuration_path, "supervisor.conf")
 
+        # this is where we keep the configurations and monitors for each of
+        # our processes, named by a hash of what is in them
+        self.blob_path = os.path.join(configuration_path, "blobs")
+
+        # if this is set then every program gets its own file in this
+        # directory and supervisor.conf is left empty. supervisord will need
+        # to include {path}/programs/*.conf to load them.
+        self.programs = bool(self.settings.get("agent.configuration.programs", False))
+        self.programs_path = os.path.join(configuration_path, "programs")
+
+        # this is where we keep everything that we last wrote so that we can
+        # start from it without waiting for the DartAPI. put it somewhere that
+        # isn't cleared on boot to be able to start without the DartAPI after
+        # a reboot, too.
+        self.cache_path = self.settings.get("agent.configuration.cache", os.path.join(configuration_path, "assignments.json"))
+
         # try to ensure that our configurations can exist somewhere. this will
         # raise an exception if the directory can't be created. that's ok, let
         # it bubble up to the caller.
         os.makedirs(configuration_path, mode=0o755, exist_ok=True)
 
-    def write(self):
+        # the cache is written after we have dropped permissions so if it is
+        # somewhere else then make sure that we can write there while we still
+        # can. it is written to a temporary file and moved into place so the
+        # directory is what matters.
+        cache_directory = os.path.dirname(os.path.abspath(self.cache_path))
+        if (cache_directory != os.path.abspath(configuration_path)):
+            os.makedirs(cache_directory, mode=0o755, exist_ok=True)
+            self._give_away(cache_directory)
+
+        # the version of the configurations that we last wrote and when, and
+        # when the DartAPI last told us that they were still current
+        self.version = None
+        self.written = None
+        self.confirmed = None
+
+        # the names of every program that we have written since we started,
+        # even ones that aren't assigned anymore, so that we can tell which
+        # programs in supervisord are ours
+        self.names = set()
+
+    def write(self, report=None, wait=None):
+        # sends anything that we have to report about this host to the
+        # DartAPI and gets back our assignments and configurations if they
+        # have changed since we last wrote them. if "wait" is given then the
+        # DartAPI holds on to the request for up to that many seconds until
+        # they change. returns True if the configurations changed and were
+        # written.
+        #
+        # we don't hold the lock while talking to the DartAPI so that waiting
+        # for changes doesn't hold up reporting. if an older response gets
+        # written after a newer one then our version won't match and the next
+        # request will get the newer one again.
+        version, assignments = self._sync(report, wait)
+        self.confirmed = time.time()
+        if (assignments is None):
+            self.logger.debug("assigned processes have not changed since {}".format(self.version))
+
+            # the time on what we last wrote is when it was last current
+            if (version == self.version):
+                try:
+                    os.utime(self.cache_path)
+                except OSError:
+                    pass
+
+            return False
+
         with self.lock:
             # drop permissions if we need to or can
             self._drop_permissions()
 
-            # fetch assignments and configurations from DartAPI. then sort them
-            # by name so that the configuration files can be read by humans.
-            assignments = self._get_assignments()
+            # put the configurations and monitors back into the assignments.
+            # if we can't then something changed while we were asking and we
+            # will get the change the next time that we ask.
+            if (not self._load_blobs(assignments)):
+                return False
+
+            # sort them by name so that the configuration files can be read by
+            # humans and then write them to disk
             assignments.sort(key=lambda x: x["name"])
+            self._load_dart_configurations(assignments)
+            self._write_supervisor_configurations(assignments)
+            self.names.update(x["name"] for x in assignments)
 
-            # now write the configurations to disk
+            # only remember the version once it has been written so that if
+            # writing fails then we try again the next time
+            self.version = version
+            self.written = time.time()
+
+            # keep what we wrote so that we can start from it next time
+            self._write_cache(assignments)
+
+            # don't keep blobs around that we aren't using anymore
+            self._prune_blobs({x["blob"] for x in assignments})
+            return True
+
+    def load(self):
+        # writes the configurations that we last got from the DartAPI without
+        # asking the DartAPI for anything so that we can start even when it
+        # isn't there. returns False if there was nothing to load.
+        with self.lock:
+            # drop permissions if we need to or can
+            self._drop_permissions()
+
+            try:
+                with open(self.cache_path, "r") as f:
+                    cache = json.load(f)
+                version = cache["version"]
+                assignments = cache["assignments"]
+
+                # this is touched every time that the DartAPI tells us that
+                # nothing has changed
+                confirmed = os.path.getmtime(self.cache_path)
+            except FileNotFoundError:
+                self.logger.info("no configurations found in {}".format(self.cache_path))
+                return False
+            except (ValueError, KeyError, TypeError) as e:
+                self.logger.warning("could not read configurations from {}: {}".format(self.cache_path, e))
+                return False
+
+            # the files that we wrote may have been cleared on boot so write
+            # them again. anything that hasn't changed isn't really changed.
             self._load_dart_configurations(assignments)
             self._write_supervisor_configurations(assignments)
+            self.names.update(x["name"] for x in assignments)
+
+            # keep the version so that the DartAPI only sends us something if
+            # it has changed since we wrote this
+            self.version = version
+            self.written = time.time()
+            self.confirmed = confirmed
+            self.logger.info("loaded configurations version {} from {} that are {} seconds old".format(version, self.cache_path, round(self.age())))
+            return True
+
+    def managed(self):
+        # the names of the programs that we have written
+        with self.lock:
+            return set(self.names)
+
+    def forget(self):
+        # the next write will write everything even if nothing has changed
+        self.version = None
+
+    def age(self):
+        # how many seconds it has been since the DartAPI last told us that our
+        # configurations are current or None if it never has
+        if (self.confirmed is None):
+            return
+        return max(time.time() - self.confirmed, 0)
+
+    def _give_away(self, path):
+        # give something that we created as root to the user/group that we
+        # drop permissions to
+        if (os.getuid() != 0):
+            return
+
+        desired_user = self.settings.get("agent.configuration.user")
+        desired_group = self.settings.get("agent.configuration.group")
+        desired_uid = (pwd.getpwnam(desired_user)[2] if desired_user is not None else -1)
+        desired_gid = (grp.getgrnam(desired_group)[2] if desired_group is not None else -1)
+        if (desired_uid != -1 or desired_gid != -1):
+            self.logger.info("giving {} to {}:{}".format(path, desired_user, desired_group))
+            os.chown(path, desired_uid, desired_gid)
 
     def _drop_permissions(self):
         # drop permissions if we're root
@@ -93,12 +242,101 @@ class ConfigurationsWriter(metaclass=Singleton):
                 self.logger.error("could not change to user {}: {}".format(desired_user, e))
                 raise
 
-    def _get_assignments(self):
-        url = "{}/agent/v1/assigned/{}".format(dart.agent.api.DART_API_URL, urllib.parse.quote(self.fqdn))
-        self.logger.debug("fetching assigned processes from '{}'".format(url))
-        response = dart.agent.api.dart.get(url, timeout=10)
+    def _sync(self, report=None, wait=None):
+        url = "{}/agent/v1/sync/{}".format(dart.agent.api.DART_API_URL, urllib.parse.quote(self.fqdn))
+        self.logger.debug("syncing with '{}'".format(url))
+
+        # the report can have any of "probe", "active", and "pending". the
+        # DartAPI will only send us our assignments if they aren't the same
+        # as the version that we already have.
+        data = dict(report or {})
+        data["version"] = self.version
+
+        params = {}
+        timeout = 22
+        if (wait):
+            params["wait"] = wait
+            timeout += wait
+
+        response = dart.agent.api.dart.post(url, params=params, data=json.dumps(data), timeout=timeout)
         response.raise_for_status()
-        return response.json()
+        result = response.json()
+        return result["version"], result["assigned"]
+
+    def _load_blobs(self, assignments):
+        # returns False if the DartAPI didn't have every blob that we asked for
+        names = {x["blob"] for x in assignments}
+        os.makedirs(self.blob_path, mode=0o755, exist_ok=True)
+
+        blobs = {}
+        for name in names:
+            blob = self._read_blob(name)
+            if (blob is not None):
+                blobs[name] = blob
+
+        # get everything that we don't have in one go
+        missing = sorted(names - set(blobs))
+        if (missing):
+            url = "{}/agent/v1/blobs/{}".format(dart.agent.api.DART_API_URL, urllib.parse.quote(self.fqdn))
+            self.logger.debug("fetching {} blobs from '{}'".format(len(missing), url))
+            response = dart.agent.api.dart.post(url, data=json.dumps({"hashes": missing}), timeout=22)
+            response.raise_for_status()
+
+            for name, blob in response.json()["blobs"].items():
+                if (name in missing and dart.common.blobs.get_name(blob) == name):
+                    self._write_blob(name, blob)
+                    blobs[name] = blob
+
+            if (len(blobs) != len(names)):
+                self.logger.warning("could not get {} blobs from the DartAPI".format(len(names) - len(blobs)))
+                return False
+
+        for assignment in assignments:
+            assignment.update(deepcopy(blobs[assignment["blob"]]))
+        return True
+
+    def _write_cache(self, assignments):
+        # write a temporary file and move it into place so that if we stop
+        # halfway through then we still have the last one
+        os.makedirs(os.path.dirname(self.cache_path) or ".", mode=0o755, exist_ok=True)
+        temporary_path = "{}.tmp".format(self.cache_path)
+        with open(temporary_path, "w") as f:
+            json.dump({"version": self.version, "assignments": assignments}, f)
+        os.replace(temporary_path, self.cache_path)
+
+    def _read_blob(self, name):
+        path = os.path.join(self.blob_path, "{}.json".format(name))
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        # if it doesn't match its name then something happened to it
+        if (hashlib.sha256(data).hexdigest() != name):
+            self.logger.warning("removing damaged blob {}".format(path))
+            os.remove(path)
+            return
+
+        return json.loads(data.decode("utf8"))
+
+    def _write_blob(self, name, blob):
+        # write a temporary file and move it into place so that nothing ever
+        # sees half of a blob
+        path = os.path.join(self.blob_path, "{}.json".format(name))
+        temporary_path = "{}.tmp".format(path)
+        with open(temporary_path, "wb") as f:
+            f.write(dart.common.blobs.encode(blob))
+        os.replace(temporary_path, path)
+
+    def _prune_blobs(self, names):
+        for filename in os.listdir(self.blob_path):
+            if (filename[:-len(".json")] not in names):
+                self.logger.debug("removing unused blob {}".format(filename))
+                try:
+                    os.remove(os.path.join(self.blob_path, filename))
+                except OSError:
+                    pass
 
     def _load_dart_configurations(self, assignments):
         # initialize configuration data structure. in all cases the key to the
@@ -139,16 +377,21 @@ class ConfigurationsWriter(metaclass=Singleton):
         ConfigurationsManager().reload(data)
 
     def _write_supervisor_configurations(self, assignments):
+        if (self.programs):
+            self._write_program_configurations(assignments)
+            assignments = []
+
         # take the configurations and write them to a file that supervisord
         # will read. we're going to write a temporary file and then replace the
         # existing file with the temporary file.
         temporary_path = "{}.tmp".format(self.supervisor_configuration_path)
         self.logger.debug("writing new supervisor configuration file: {}".format(temporary_path))
         with open(temporary_path, "w") as f:
+            if (self.programs):
+                print("; programs are configured in {}".format(self.programs_path), file=f)
+
             for assignment in assignments:
-                print("[{}:{}]".format(assignment["type"], assignment["name"]), file=f)
-                print(assignment["configuration"], file=f)
-                print("", file=f)
+                f.write(self._get_program_configuration(assignment))
 
         # move temp file into place. the os.replace function is atomic so
         # we can be sure that nothing will read an empty file while we move
@@ -156,6 +399,42 @@ class ConfigurationsWriter(metaclass=Singleton):
         self.logger.debug("moving {} to {}".format(temporary_path, self.supervisor_configuration_path))
         os.replace(temporary_path, self.supervisor_configuration_path)
 
+    def _write_program_configurations(self, assignments):
+        # every program gets its own file and only the files that changed are
+        # written so that it is easy to see what changed and when
+        os.makedirs(self.programs_path, mode=0o755, exist_ok=True)
+
+        filenames = set()
+        for assignment in assignments:
+            filename = "{}.conf".format(urllib.parse.quote(assignment["name"], safe=""))
+            filenames.add(filename)
+
+            path = os.path.join(self.programs_path, filename)
+            configuration = self._get_program_configuration(assignment)
+            try:
+                with open(path, "r") as f:
+                    if (f.read() == configuration):
+                        continue
+            except FileNotFoundError:
+                pass
+
+            # write a temporary file and move it into place so that supervisord
+            # never reads half of a file
+            self.logger.debug("writing new program configuration file: {}".format(path))
+            temporary_path = "{}.tmp".format(path)
+            with open(temporary_path, "w") as f:
+                f.write(configuration)
+            os.replace(temporary_path, path)
+
+        # programs that aren't assigned anymore go away
+        for filename in os.listdir(self.programs_path):
+            if (filename not in filenames):
+                self.logger.debug("removing program configuration file: {}".format(filename))
+                os.remove(os.path.join(self.programs_path, filename))
+
+    def _get_program_configuration(self, assignment):
+        return "[{}:{}]\n{}\n\n".format(assignment["type"], assignment["name"], assignment["configuration"])
+
 
 class ConfigurationsManager(metaclass=Singleton):
     def __init__(self):
@@ -1,5 +1,6 @@
 import logging
 import socket
+from dart.common.metrics import MetricsRegistry
 
 
 class BaseHandler(object):
@@ -13,10 +14,21 @@ class BaseHandler(object):
         # universal access to our event queue
         self.events = events
 
+        # every handler keeps track of how long its work takes and how often
+        # that work fails
+        registry = MetricsRegistry()
+        self.timings = registry.histogram("agent_handler_seconds", "time taken by handlers to do their work", ["handler"])
+        self.failures = registry.counter("agent_handler_errors_total", "work done by handlers that failed", ["handler"])
+
     @property
     def name(self):
         raise NotImplementedError("property must be implemented in subclass")
 
+    @property
+    def queued(self):
+        # how much work is waiting for this handler
+        return 0
+
     def can_handle(self, event_type):
         raise NotImplementedError("must be implemented in subclass")
 
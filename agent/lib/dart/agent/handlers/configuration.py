@@ -2,11 +2,16 @@
 This handler, when signaled, queries the DartAPI for updated configuration
 information for this host. It then updates the supervisord configuration on
 disk, updates the shared configurations for monitoring and scheduling, and
-triggers a reread of all configurations.
+triggers a reread of all configurations. If the configurations haven't
+changed then nothing is written and nothing is reread. It can also hold a
+request open to the DartAPI that comes back as soon as the configurations
+change for hosts that the DartAPI can't reach to tell about changes.
 """
 
 from . import BaseHandler
 from ..configurations import ConfigurationsWriter
+from dart.common.settings import SettingsManager
+from dart.common.metrics import MetricsRegistry
 from dart.common.killer import GracefulEventKiller
 from threading import Thread
 import requests
@@ -21,6 +26,12 @@ class ConfigurationHandler(BaseHandler):
         self.reread_trigger = reread_trigger
         self.rewrite_trigger = rewrite_trigger
 
+        # how many seconds to hold a request open waiting for changes
+        self.wait = float(SettingsManager().get("agent.configuration.wait", 0))
+
+        # how often we ask for configurations and how often they change
+        self.rewrites = MetricsRegistry().counter("agent_configuration_rewrites_total", "requests for new configurations by whether they changed", ["result"])
+
         # this is how we will trigger the thread so that it knows to exit
         self.killer = GracefulEventKiller()
 
@@ -52,82 +63,112 @@ class ConfigurationHandler(BaseHandler):
     # this runs inside of a thread
     def _run(self):
         # if we haven't received a kill signal then wait for a trigger telling
-        # us to rewrite our configurations. that trigger is set every sixty
-        # seconds by TICK events or when we receive a message from the
-        # coordination handler.
+        # us to rewrite our configurations. that trigger is set every so often
+        # by TICK events or when we receive a message from the coordination
+        # handler. if we're allowed to then in between we hold a request open
+        # to the DartAPI that comes back as soon as our configurations change.
         while (not self.killer.killed()):
             if (self.rewrite_trigger.wait(timeout=1)):
-                try:
-                    ConfigurationsWriter().write()
-
-                    # clear the transient error events
-                    self.events.put({
-                        "data": {
-                            "component": {"name": "agent:{}".format(self.name)},
-                            "severity": "OK",
-                            "message": "clear",
-                        }
-                    })
-                except requests.RequestException as e:
-                    subject = "could not talk to the DartAPI on {}: {}".format(self.fqdn, e)
-                    message = traceback.format_exc()
-                    self.logger.warning("{} handler {}".format(self.name, subject))
-                    self.logger.warning(message)
-
-                    # this is a system error, create a escalating incident.
-                    # this event will automatically clear if we are able to
-                    # successfully write our configurations.
-                    self.events.put({
-                        "data": {
-                            "component": {"name": "agent:{}".format(self.name)},
-                            "severity": 2,  # high severity
-                            "title": subject,
-                            "message": message,
-                        }
-                    })
-                except OSError as e:
-                    subject = "could not write configuration files on {}: {}".format(self.fqdn, e)
-                    message = traceback.format_exc()
-                    self.logger.warning("{} handler {}".format(self.name, subject))
-                    self.logger.warning(message)
-
-                    # this is a system error, create a escalating incident.
-                    # this event will automatically clear if we are able to
-                    # successfully write our configurations.
-                    self.events.put({
-                        "data": {
-                            "component": {"name": "agent:{}".format(self.name)},
-                            "severity": 2,  # high severity
-                            "title": subject,
-                            "message": message,
-                        }
-                    })
-                except Exception as e:
-                    subject = "unexpected error on {}: {}".format(self.fqdn, e)
-                    message = traceback.format_exc()
-                    self.logger.error("{} handler {}".format(self.name, subject))
-                    self.logger.error(message)
-
-                    # problems that we didn't expect should create
-                    # non-escalating incidents. this event will not clear
-                    # automatically.
-                    self.events.put({
-                        "data": {
-                            "component": {"name": "agent:{}:error".format(self.name)},
-                            "severity": 3,  # medium severity
-                            "title": subject,
-                            "message": message,
-                        }
-                    })
-                finally:
-                    # this clears the trigger so that it can be set again
-                    self.rewrite_trigger.clear()
-
-                    # now trigger a reread to pick up the configurations that
-                    # just finished writing. if the trigger is already set then
-                    # we will wait before trying to set it again.
+                with self.timings.time(handler=self.name):
+                    changed = self._rewrite()
+
+                # this clears the trigger so that it can be set again
+                self.rewrite_trigger.clear()
+
+                # now trigger a reread to pick up the configurations that
+                # just finished writing. if something went wrong then reread
+                # anyway. if the trigger is already set then we will wait
+                # before trying to set it again.
+                if (changed is not False):
+                    self.logger.info("{} handler triggering a reread".format(self.name))
+                    self.reread_trigger.set()
+            elif (self.wait > 0):
+                changed = self._rewrite(wait=self.wait)
+                if (changed):
                     self.logger.info("{} handler triggering a reread".format(self.name))
                     self.reread_trigger.set()
 
+                # if the DartAPI isn't working then don't keep asking it
+                if (changed is None):
+                    self.rewrite_trigger.wait(timeout=60)
+
         # tell everything that we're done
         self.logger.info("{} handler exiting".format(self.name))
+
+    def _rewrite(self, wait=None):
+        # returns True if the configurations changed and were written, False
+        # if they didn't change, and None if something went wrong
+        try:
+            changed = ConfigurationsWriter().write(wait=wait)
+            self.rewrites.inc(result=("changed" if changed else "unchanged"))
+
+            # clear the transient error events
+            self.events.put({
+                "data": {
+                    "component": {"name": "agent:{}".format(self.name)},
+                    "severity": "OK",
+                    "message": "clear",
+                }
+            })
+
+            return changed
+        except requests.RequestException as e:
+            self.failures.inc(handler=self.name)
+            subject = "could not talk to the DartAPI on {}: {}".format(self.fqdn, e)
+            message = traceback.format_exc()
+
+            # say how old the configurations that we are still using are
+            age = ConfigurationsWriter().age()
+            if (age is not None):
+                message = "{}\nusing configurations that were last current {} seconds ago".format(message, round(age))
+
+            self.logger.warning("{} handler {}".format(self.name, subject))
+            self.logger.warning(message)
+
+            # this is a system error, create a escalating incident.
+            # this event will automatically clear if we are able to
+            # successfully write our configurations.
+            self.events.put({
+                "data": {
+                    "component": {"name": "agent:{}".format(self.name)},
+                    "severity": 2,  # high severity
+                    "title": subject,
+                    "message": message,
+                }
+            })
+        except OSError as e:
+            self.failures.inc(handler=self.name)
+            subject = "could not write configuration files on {}: {}".format(self.fqdn, e)
+            message = traceback.format_exc()
+            self.logger.warning("{} handler {}".format(self.name, subject))
+            self.logger.warning(message)
+
+            # this is a system error, create a escalating incident.
+            # this event will automatically clear if we are able to
+            # successfully write our configurations.
+            self.events.put({
+                "data": {
+                    "component": {"name": "agent:{}".format(self.name)},
+                    "severity": 2,  # high severity
+                    "title": subject,
+                    "message": message,
+                }
+            })
+        except Exception as e:
+            self.failures.inc(handler=self.name)
+            subject = "unexpected error on {}: {}".format(self.fqdn, e)
+            message = traceback.format_exc()
+            self.logger.error("{} handler {}".format(self.name, subject))
+            self.logger.error(message)
+
+            # problems that we didn't expect should create
+            # non-escalating incidents. this event will not clear
+            # automatically.
+            self.events.put({
+                "data": {
+                    "component": {"name": "agent:{}:error".format(self.name)},
+                    "severity": 3,  # medium severity
+                    "title": subject,
+                    "message": message,
+                }
+            })
@@ -2,18 +2,34 @@
 This handler listens for TCP connections from the world. Those connections will
 send us messages for actions to perform such as rereading configurations,
 rewriting configurations, starting or stopping a process, or updating
-supervisord. All connections must come in with a valid and authorized client
+supervisord. A rewrite that comes with a configuration version was sent
+because the configuration changed and a rewrite without one rewrites the
+configurations even if they haven't changed. All connections must come in with a valid and authorized client
 certificate.
+
+A connection may send any number of commands, one line of JSON each, and may
+stay open between them. Commands run as soon as they arrive. Commands for the
+same process run one at a time in the order that they arrived but otherwise
+they run at the same time. For every command we write back one line of JSON
+with the "id" that came with the command, whether it worked, the error from
+supervisor if it didn't, and how long it took. Results are written as
+commands finish so they may not be in the same order as the commands.
 """
 
 from . import BaseHandler
+from ..configurations import ConfigurationsWriter
 from dart.common.settings import SettingsManager
+from dart.common.metrics import MetricsRegistry
 from dart.common.exceptions import CommandValidationException
 from dart.common.supervisor import SupervisorClient
-from threading import Thread
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
+from concurrent import futures
 import socketserver
+import socket
 import ssl
 import json
+import time
 import xmlrpc.client
 import traceback
 
@@ -27,6 +43,14 @@ class CoordinationHandler(BaseHandler):
         self.listen_address = self.settings.get("agent.coordination.address", "0.0.0.0")
         self.listen_port = int(self.settings.get("agent.coordination.port", 3728))
 
+        # how many commands from one connection can run at the same time and
+        # how long a connection can sit with nothing to say before we hang up
+        self.concurrency = max(int(self.settings.get("agent.coordination.concurrency", 4)), 1)
+        self.idle_timeout = float(self.settings.get("agent.coordination.idle", 300))
+
+        # what we've been asked to do and whether it worked
+        self.commands = MetricsRegistry().counter("agent_coordination_commands_total", "commands received by action and whether they worked", ["action", "success"])
+
         # where are we listening
         self.logger.info("{} handler listening for coordination events on {}:{}".format(
             self.name,
@@ -39,6 +63,11 @@ class CoordinationHandler(BaseHandler):
         self.rewrite_trigger = rewrite_trigger
         self.supervisor_server_url = supervisor_server_url
 
+        # commands for the same process have to happen in order even if they
+        # come in on different connections
+        self.process_locks = {}
+        self.process_locks_lock = Lock()
+
         class RequestServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
             # faster re-binding
             allow_reuse_address = True
@@ -78,24 +107,94 @@ class CoordinationHandler(BaseHandler):
                         self.logger.warning("{} handler rejecting connection from {}".format(self.name, common_name))
                         return
 
-                    # now we're going to listen to what they have to say
-                    data = subself.rfile.readline().strip()
-                    try:
-                        subself._process_command(data)
-                    except CommandValidationException as e:
-                        self.logger.error("{} handler received invalid command: {}".format(self.name, e))
-
-                        # first send it to the CorkAPI
-                        self.events.put({
-                            "data": {
-                                "component": {"name": "agent:{}:command".format(self.name)},
-                                "severity": 4,  # low priority
-                                "message": "received invalid command\n\n{}".format(e),
-                            }
-                        })
-                except BrokenPipeError:
+                    # results from commands running at the same time must not
+                    # get mixed up with each other on the way out
+                    subself.write_lock = Lock()
+
+                    # now we're going to listen to what they have to say until
+                    # they hang up or stop talking to us. a command for a
+                    # process waits for the last command that we got for the
+                    # same process. leaving the executor waits for anything
+                    # still running to write its result.
+                    subself.request.settimeout(self.idle_timeout)
+                    with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                        previous = {}
+                        for data in subself.rfile:
+                            data = data.strip()
+                            if (not data):
+                                continue
+
+                            process = subself._get_process_name(data)
+                            future = executor.submit(subself._run_command, data, previous.get(process))
+                            if (process is not None):
+                                previous[process] = future
+                except socket.timeout:
+                    self.logger.debug("{} handler closing idle connection from {}:{}".format(self.name, subself.client_address[0], subself.client_address[1]))
+                except (BrokenPipeError, ConnectionResetError):
                     self.logger.debug("{} handler broken pipe from {}:{}".format(self.name, subself.client_address[0], subself.client_address[1]))
 
+            def _get_process_name(subself, data):
+                # this is just a peek. the command is properly checked when
+                # it is run.
+                try:
+                    data = json.loads(data.decode("utf8"))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    return None
+
+                if (isinstance(data, dict) and isinstance(data.get("process"), str)):
+                    return data["process"]
+
+            def _run_command(subself, data, after=None):
+                if (after is not None):
+                    futures.wait([after])
+
+                start = time.time()
+                result = {"id": None, "action": None, "process": None, "success": False, "error": None}
+
+                try:
+                    command = subself._validate_command(data)
+                    result.update(id=command.get("id"), action=command["action"], process=command.get("process"))
+
+                    if (command.get("process") is None):
+                        error = subself._process_command(command)
+                    else:
+                        with self._get_process_lock(command["process"]):
+                            error = subself._process_command(command)
+
+                    result.update(success=(error is None), error=error)
+                except CommandValidationException as e:
+                    self.logger.error("{} handler received invalid command: {}".format(self.name, e))
+                    result["error"] = str(e)
+
+                    # first send it to the CorkAPI
+                    self.events.put({
+                        "data": {
+                            "component": {"name": "agent:{}:command".format(self.name)},
+                            "severity": 4,  # low priority
+                            "message": "received invalid command\n\n{}".format(e),
+                        }
+                    })
+                except Exception as e:
+                    self.logger.error("{} handler could not run command: {}".format(self.name, e))
+                    self.logger.debug(traceback.format_exc())
+                    result["error"] = str(e)
+
+                result["duration"] = round(time.time() - start, 3)
+                self.timings.observe(time.time() - start, handler=self.name)
+                self.commands.inc(action=(result["action"] or "invalid"), success=result["success"])
+                if (not result["success"]):
+                    self.failures.inc(handler=self.name)
+
+                subself._write_result(result)
+
+            def _write_result(subself, result):
+                # whoever sent the command might not be waiting for an answer
+                try:
+                    with subself.write_lock:
+                        subself.wfile.write((json.dumps(result) + "\n").encode())
+                except OSError as e:
+                    self.logger.debug("{} handler could not send result to {}:{}: {}".format(self.name, subself.client_address[0], subself.client_address[1], e))
+
             def _get_certificate_common_name(subself, cert):
                 if (cert is None):
                     return None
@@ -105,7 +204,7 @@ class CoordinationHandler(BaseHandler):
                         if (key == "commonName"):
                             return value
 
-            def _process_command(subself, data):
+            def _validate_command(subself, data):
                 # methods we implement on the supervisor xml-rpc api:
                 # - startProcess(name, wait=False)  <- "wait" is True by default, we want false
                 # - stopProcess(name, wait=False)  <- "wait" is True by default, we want false
@@ -118,8 +217,10 @@ class CoordinationHandler(BaseHandler):
 
                 # format is expected to look kind of like this:
                 # {
+                #     id="anything",                                  <- optional, returned with the result
                 #     action="start/stop/add/remove/restart/update",  <- one of the commands above
                 #     process="name",                                 <- the process against which to run the command
+                #     version=1234,                                   <- optional, the configuration version that caused a rewrite
                 # }
 
                 # make sure that it is valid utf8 data and valid json
@@ -135,42 +236,64 @@ class CoordinationHandler(BaseHandler):
                 # some debugging
                 self.logger.debug("{} handler received command '{}'".format(self.name, data))
 
+                if (not isinstance(data, dict)):
+                    raise CommandValidationException("Received a command that was not an object.")
+
                 # make sure we have a valid action
                 action = data.get("action")
-                if (action is None or action.strip() == ""):
+                if (action is None or not isinstance(action, str) or action.strip() == ""):
                     raise CommandValidationException("Received no action to take.")
                 if (action not in ["start", "stop", "add", "remove", "restart", "update", "reread", "rewrite"]):
                     raise CommandValidationException("Received an invalid action to take.")
 
+                # this is the thing we're going to do it to
+                if (action not in ["reread", "rewrite"]):
+                    process = data.get("process")
+                    if (process is None or not isinstance(process, str) or process.strip() == ""):
+                        raise CommandValidationException("Received no process against which to take action.")
+                else:
+                    data.pop("process", None)
+
+                return data
+
+            def _process_command(subself, data):
+                # returns the error from supervisor or None if it worked
+                action = data["action"]
+
                 if (action in ["reread", "rewrite"]):
                     if (action == "reread"):
                         self.logger.info("{} handler triggering a reread".format(self.name))
                         self.reread_trigger.set()
                     if (action == "rewrite"):
-                        self.logger.info("{} handler triggering a rewrite".format(self.name))
+                        if (data.get("version") is not None):
+                            self.logger.info("{} handler triggering a rewrite for configuration version {}".format(self.name, data["version"]))
+                        else:
+                            # somebody asked for this so write everything
+                            # again even if nothing has changed
+                            self.logger.info("{} handler triggering a rewrite".format(self.name))
+                            ConfigurationsWriter().forget()
                         self.rewrite_trigger.set()
-                else:
-                    # this is the thing we're going to do it to
-                    process = data.get("process")
-                    if (process is None or process.strip() == ""):
-                        raise CommandValidationException("Received no process against which to take action.")
+                    return None
 
-                    if (action == "start"):
-                        subself.__start_process(process)
-                    if (action == "stop"):
-                        subself.__stop_process(process)
-                    if (action == "restart"):
-                        subself.__restart_process(process)
-                    if (action == "add"):
-                        subself.__add_process(process)
-                    if (action == "remove"):
-                        subself.__remove_process(process)
-                    if (action == "update"):
-                        subself.__update_process(process)
-
-                    # after all commands we want to reread the system state
-                    self.logger.info("{} handler triggering a reread".format(self.name))
-                    self.reread_trigger.set()
+                process = data["process"]
+                if (action == "start"):
+                    error = subself.__start_process(process)
+                if (action == "stop"):
+                    error = subself.__stop_process(process)
+                if (action == "restart"):
+                    error = subself.__restart_process(process)
+                if (action == "add"):
+                    error = subself.__add_process(process)
+                if (action == "remove"):
+                    error = subself.__remove_process(process)
+                if (action == "update"):
+                    error = subself.__update_process(process)
+
+                # after all commands we want to reread the system state
+                self.logger.info("{} handler triggering a reread".format(self.name))
+                self.reread_trigger.set()
+
+                return error
 
             def __start_process(subself, process, wait=False):
                 self.logger.info("{} handler starting process: {}".format(self.name, process))
@@ -179,6 +302,7 @@ class CoordinationHandler(BaseHandler):
                     client.connection.supervisor.startProcess(process, wait)
                 except xmlrpc.client.Fault as e:
                     self.logger.warning("{} handler could not start process {}: {}".format(self.name, process, e.faultString))
+                    return e.faultString
 
             def __stop_process(subself, process, wait=False):
                 self.logger.info("{} handler stopping process: {}".format(self.name, process))
@@ -187,6 +311,7 @@ class CoordinationHandler(BaseHandler):
                     client.connection.supervisor.stopProcess(process, wait)
                 except xmlrpc.client.Fault as e:
                     self.logger.warning("{} handler could not stop process {}: {}".format(self.name, process, e.faultString))
+                    return e.faultString
 
             def __add_process(subself, process):
                 self.logger.info("{} handler adding process: {}".format(self.name, process))
@@ -195,6 +320,7 @@ class CoordinationHandler(BaseHandler):
                     client.connection.supervisor.addProcessGroup(process)
                 except xmlrpc.client.Fault as e:
                     self.logger.warning("{} handler could not add process {}: {}".format(self.name, process, e.faultString))
+                    return e.faultString
 
             def __remove_process(subself, process):
                 self.logger.info("{} handler removing process: {}".format(self.name, process))
@@ -203,10 +329,13 @@ class CoordinationHandler(BaseHandler):
                     client.connection.supervisor.removeProcessGroup(process)
                 except xmlrpc.client.Fault as e:
                     self.logger.warning("{} handler could not remove process {}: {}".format(self.name, process, e.faultString))
+                    return e.faultString
 
             def __restart_process(subself, process):
+                # it doesn't matter if the process wasn't running, only that it
+                # is running now
                 subself.__stop_process(process, wait=True)
-                subself.__start_process(process)
+                return subself.__start_process(process)
 
             def __update_process(subself, process):
                 # we can't remove a process that is running
@@ -215,8 +344,9 @@ class CoordinationHandler(BaseHandler):
                 # then actually remove it
                 subself.__remove_process(process)
 
-                # if a process is configured to automatically start then it will
-                subself.__add_process(process)
+                # if a process is configured to automatically start then it
+                # will. it only matters that it could be added back.
+                return subself.__add_process(process)
 
         # this is the server. it handles the sockets. it passes requests to the
         # listener (the second argument). the server will run in its own thread
@@ -227,6 +357,10 @@ class CoordinationHandler(BaseHandler):
     def name(self):
         return "coordination"
 
+    def _get_process_lock(self, process):
+        with self.process_locks_lock:
+            return self.process_locks.setdefault(process, Lock())
+
     def start(self):
         self.thread = Thread(target=self._run)
         self.thread.start()
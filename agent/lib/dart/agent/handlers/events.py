@@ -102,6 +102,10 @@ class EventHandler(BaseHandler):
     def name(self):
         return "events"
 
+    @property
+    def queued(self):
+        return self.events.qsize()
+
     def start(self):
         if (self.enabled):
             self.tcp_thread = Thread(target=self._run_tcp)
@@ -260,15 +264,19 @@ class EventHandler(BaseHandler):
 
                 # add an endpoint to the url
                 url = "{}/v1/{}".format(dart.agent.api.CORK_API_URL, event_type)
-                result = dart.agent.api.cork.post(url, data=json.dumps(event_data), stream=False, timeout=10)
+                with self.timings.time(handler=self.name):
+                    result = dart.agent.api.cork.post(url, data=json.dumps(event_data), stream=False, timeout=10)
                 if (result.status_code == 503):
+                    self.failures.inc(handler=self.name)
                     self.logger.warning("{} handler could not talk to CorkAPI -- skipping: 503 error".format(self.name))
                     self.events.put(item)  # reenqueue to try again later
                 elif (result.status_code != 202):
+                    self.failures.inc(handler=self.name)
                     self.logger.warning("{} handler received error talking to CorkAPI: {}".format(self.name, result.text.strip()))
                 else:
                     self.logger.debug("{} handler: {}".format(self.name, result.text.strip()))
             except requests.RequestException as e:
+                self.failures.inc(handler=self.name)
                 self.logger.warning("{} handler could not talk to cork -- skipping: {}".format(self.name, e))
 
                 # if we have an exception we're going to try to put it on the
@@ -35,6 +35,10 @@ class LogHandler(BaseHandler):
     def name(self):
         return "log"
 
+    @property
+    def queued(self):
+        return self.processor.qsize()
+
     def start(self):
         self.thread = Thread(target=self._run)
         self.thread.start()
@@ -80,8 +84,10 @@ class LogHandler(BaseHandler):
                     self.logger.debug("{} handler queue listener cleaning up before exit".format(self.name))
                     finished = True
                 else:
-                    self._check(item["event"], item["data"])
+                    with self.timings.time(handler=self.name):
+                        self._check(item["event"], item["data"])
             except Exception as e:
+                self.failures.inc(handler=self.name)
                 subject = "unexpected error in queue listener on {}: {}".format(self.fqdn, e)
                 message = traceback.format_exc()
                 self.logger.error("{} handler {}".format(self.name, subject))
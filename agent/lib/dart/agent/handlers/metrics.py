@@ -0,0 +1,121 @@
+"""
+This handler serves everything that the agent is keeping track of in the
+Prometheus text format over HTTP on a port on the localhost and on a Unix
+socket. Anything asked for gets the metrics.
+"""
+
+from . import BaseHandler
+from dart.common.settings import SettingsManager
+from dart.common.metrics import MetricsRegistry, CONTENT_TYPE
+from threading import Thread
+import http.server
+import socketserver
+import os
+
+
+class MetricsHandler(BaseHandler):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        # configure settings
+        self.settings = SettingsManager()
+        self.enabled = self.settings.get("agent.metrics.enabled", False)
+
+        # if not enabled then we will not turn on any listeners
+        if (not self.enabled):
+            self.logger.info("{} handler is disabled".format(self.name))
+            return
+
+        self.listen_port = int(self.settings.get("agent.metrics.port", 1338))
+        self.listen_path = self.settings.get("agent.metrics.path")
+
+        # where we are listening
+        self.logger.info("{} handler listening for requests on port {}".format(self.name, self.listen_port))
+        if (self.listen_path):
+            self.logger.info("{} handler listening for requests at path {}".format(self.name, self.listen_path))
+
+        class TCPRequestServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            # faster re-binding
+            allow_reuse_address = True
+
+            # kick connections when we exit
+            daemon_threads = True
+
+        class UnixStreamRequestServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            # faster re-binding
+            allow_reuse_address = True
+
+            # kick connections when we exit
+            daemon_threads = True
+
+        class RequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(subself):
+                data = MetricsRegistry().render().encode("utf8")
+                subself.send_response(200)
+                subself.send_header("Content-Type", CONTENT_TYPE)
+                subself.send_header("Content-Length", str(len(data)))
+                subself.end_headers()
+                subself.wfile.write(data)
+
+            def address_string(subself):
+                # unix sockets don't have an address
+                return (subself.client_address[0] if subself.client_address else "unix")
+
+            def log_message(subself, format, *args):
+                self.logger.debug("{} handler {} {}".format(self.name, subself.address_string(), format % args))
+
+        # this is the server. it handles the sockets. the server will run in
+        # its own thread so that we can kill it when we need to.
+        self.tcp_server = TCPRequestServer(("127.0.0.1", self.listen_port), RequestHandler)
+
+        # note that we're just removing whatever socket is already there just
+        # like the events handler does
+        self.unix_server = None
+        if (self.listen_path):
+            try:
+                os.unlink(self.listen_path)
+            except FileNotFoundError as e:
+                self.logger.debug("{} handler could not remove {}: {}".format(self.name, self.listen_path, e))
+
+            self.unix_server = UnixStreamRequestServer(self.listen_path, RequestHandler)
+            os.chmod(self.listen_path, 0o777)
+
+    @property
+    def name(self):
+        return "metrics"
+
+    def start(self):
+        if (self.enabled):
+            self.tcp_thread = Thread(target=self.tcp_server.serve_forever)
+            self.tcp_thread.start()
+
+            if (self.unix_server is not None):
+                self.unix_thread = Thread(target=self.unix_server.serve_forever)
+                self.unix_thread.start()
+
+    def stop(self):
+        self.logger.info("{} handler received signal to stop".format(self.name))
+
+        if (self.enabled):
+            self.tcp_server.shutdown()
+            self.tcp_server.server_close()
+            self.tcp_thread.join()
+
+            if (self.unix_server is not None):
+                self.unix_server.shutdown()
+                self.unix_server.server_close()
+                self.unix_thread.join()
+
+                # try to clean up our unix socket
+                try:
+                    os.remove(self.listen_path)
+                except OSError as e:
+                    self.logger.warning("{} handler could not remove {}: {}".format(self.name, self.listen_path, e))
+
+    def can_handle(self, event_type):
+        # this handler wants nothing from supervisor
+        return False
+
+    def handle(self, event_type, event, data):
+        # we never get passed anything to handle so we can't handle anything
+        pass
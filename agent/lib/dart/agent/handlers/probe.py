@@ -1,19 +1,32 @@
 """
 This handler, when signaled, gets the active and pending configurations from
-supervisord and posts to the DartAPI.
+supervisord and sends them to the DartAPI in one request along with, the first
+time, information about the host and, every time, whether the agent is keeping
+up with supervisord. If our assigned configurations have changed then the
+DartAPI sends them back, they are written, and another reread is triggered to
+pick them up.
+
+If reconciliation is turned on then the groups that we wrote that supervisord
+says were added, changed, or removed are applied right away, a few at a time,
+rather than waiting for someone to update them. Groups that someone else put
+into supervisord, like the agent itself, are left for them to update. Either way, once supervisord has
+everything that was last written we tell the DartAPI how long that took.
 """
 
 from . import BaseHandler
-from ..configurations import ConfigurationsManager
+from ..configurations import ConfigurationsManager, ConfigurationsWriter
+from ..telemetry import Telemetry
 from dart.common.supervisor import SupervisorClient
+from dart.common.settings import SettingsManager
 from dart.common.killer import GracefulEventKiller
-import dart.agent.api
+from dart.common import PROCESSES_TO_IGNORE
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 import xmlrpc.client
-import urllib.parse
 import requests
 import traceback
-import json
+import platform
+import time
 
 
 class ProbeHandler(BaseHandler):
@@ -33,6 +46,18 @@ class ProbeHandler(BaseHandler):
         # this is how we will trigger the thread so that it knows to exit
         self.killer = GracefulEventKiller()
 
+        # we tell the DartAPI about the host until it has heard about it once
+        self.probed = False
+
+        # the last configuration version that we told the DartAPI that we
+        # finished applying
+        self.converged = None
+
+        # whether to apply changes ourselves and how many at a time
+        settings = SettingsManager()
+        self.reconcile = bool(settings.get("agent.configuration.reconcile", False))
+        self.concurrency = max(int(settings.get("agent.configuration.concurrency", 4)), 1)
+
     @property
     def name(self):
         return "probe"
@@ -63,10 +88,17 @@ class ProbeHandler(BaseHandler):
     def _run(self):
         while (not self.killer.killed()):
             if (self.reread_trigger.wait(timeout=1)):
+                changed = False
+                start = time.monotonic()
                 try:
-                    # probe supervisor configurations
-                    self._probe_active_supervisor_configurations()
-                    self._probe_pending_supervisor_configurations()
+                    # find out what supervisor would change and maybe change
+                    # it. then probe supervisor configurations.
+                    pending = self._get_pending_supervisor_configurations()
+                    if (self.reconcile and self._reconcile(pending)):
+                        pending = self._get_pending_supervisor_configurations()
+                    self._probe_pending_supervisor_configurations(pending)
+                    active = self._probe_active_supervisor_configurations()
+                    changed = self._sync(active, pending)
 
                     self.events.put({
                         "data": {
@@ -77,6 +109,7 @@ class ProbeHandler(BaseHandler):
                     })
                 except xmlrpc.client.Fault as e:
                     # don't want to raise any alarms about this one
+                    self.failures.inc(handler=self.name)
                     subject = "could not probe supervisor on {}: {}".format(self.fqdn, e.faultString)
                     message = traceback.format_exc()
                     self.logger.warning("{} handler {}".format(self.name, subject))
@@ -94,6 +127,7 @@ class ProbeHandler(BaseHandler):
                         }
                     })
                 except Exception as e:
+                    self.failures.inc(handler=self.name)
                     subject = "unexpected error on {}: {}".format(self.fqdn, e)
                     message = traceback.format_exc()
                     self.logger.error("{} handler {}".format(self.name, subject))
@@ -110,9 +144,17 @@ class ProbeHandler(BaseHandler):
                         }
                     })
                 finally:
+                    self.timings.observe(time.monotonic() - start, handler=self.name)
+
                     # this clears the trigger so that it can be pulled again
                     self.reread_trigger.clear()
 
+                    # if we just wrote new configurations then supervisor needs
+                    # to reread them
+                    if (changed):
+                        self.logger.info("{} handler triggering a reread".format(self.name))
+                        self.reread_trigger.set()
+
         # tell everything that we're done
         self.logger.info("{} handler exiting".format(self.name))
 
@@ -123,20 +165,6 @@ class ProbeHandler(BaseHandler):
         client = SupervisorClient(self.supervisor_server_url)
         states = client.connection.supervisor.getAllProcessInfo()
 
-        try:
-            # send active processes to the DartAPI. it's ok if this fails
-            # because we'll just try again in a minute. we still want to update
-            # the CorkAPI so we'll keep going.
-            url = "{}/agent/v1/active/{}".format(dart.agent.api.DART_API_URL, urllib.parse.quote(self.fqdn))
-            response = dart.agent.api.dart.post(url, data=json.dumps(states), timeout=22)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            # do not need to see this one on dash
-            subject = "could not talk to the DartAPI on {}: {}".format(self.fqdn, e)
-            message = traceback.format_exc()
-            self.logger.warning("{} handler {}".format(self.name, subject))
-            self.logger.warning(message)
-
         # if there are any processes that are:
         # - being daemon monitored but not running
         # - being state monitored but are failing
@@ -212,7 +240,9 @@ class ProbeHandler(BaseHandler):
                         }
                     })
 
-    def _probe_pending_supervisor_configurations(self):
+        return states
+
+    def _get_pending_supervisor_configurations(self):
         # get pending process changes
         client = SupervisorClient(self.supervisor_server_url)
         states = client.connection.supervisor.reloadConfig()
@@ -220,26 +250,13 @@ class ProbeHandler(BaseHandler):
         # make the list easier to read. something in the supervisord
         # rpcinterface documentation about not being able to return an
         # array with a length greater than one. so this is what we get.
-        pending = {
+        return {
             "added": states[0][0],
             "changed": states[0][1],
             "removed": states[0][2],
         }
 
-        try:
-            # send pending processes to the DartAPI. it's ok if this fails
-            # because we'll just try again in a minute. we still want to update
-            # the CorkAPI so we'll keep going.
-            url = "{}/agent/v1/pending/{}".format(dart.agent.api.DART_API_URL, urllib.parse.quote(self.fqdn))
-            response = dart.agent.api.dart.post(url, data=json.dumps(pending), timeout=22)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            # do not need to see this one on dash
-            subject = "could not talk to the DartAPI on {}: {}".format(self.fqdn, e)
-            message = traceback.format_exc()
-            self.logger.warning("{} handler {}".format(self.name, subject))
-            self.logger.warning(message)
-
+    def _probe_pending_supervisor_configurations(self, pending):
         # if there are any pending changes then raise an event for that
         if (len(pending["added"]) or len(pending["removed"]) or len(pending["changed"])):
             subject = []
@@ -267,3 +284,94 @@ class ProbeHandler(BaseHandler):
                     "message": "clear",
                 }
             })
+
+    def _reconcile(self, pending):
+        # returns True if there was anything to apply. groups don't depend on
+        # each other so they are applied at the same time, a few at a time.
+        # only the groups that we wrote are ours to apply.
+        managed = ConfigurationsWriter().managed() - set(PROCESSES_TO_IGNORE)
+        groups = [(name, state) for state in ["removed", "changed", "added"] for name in pending[state] if name in managed]
+        if (not groups):
+            return False
+
+        counts = {state: len([x for x in groups if x[1] == state]) for state in ["added", "changed", "removed"]}
+        self.logger.info("{} handler applying {} added, {} changed, and {} removed groups".format(self.name, counts["added"], counts["changed"], counts["removed"]))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for (name, state), error in zip(groups, executor.map(self._reconcile_group, groups)):
+                if (error is not None):
+                    self.logger.warning("{} handler could not apply {} group {}: {}".format(self.name, state, name, error))
+
+        return True
+
+    def _reconcile_group(self, group):
+        # returns the error from supervisor or None if it worked. this is the
+        # same thing that "supervisorctl update" does for one group.
+        name, state = group
+        client = SupervisorClient(self.supervisor_server_url)
+        try:
+            if (state in ["changed", "removed"]):
+                # we can't remove a group that is running. it is fine if it
+                # isn't running.
+                try:
+                    client.connection.supervisor.stopProcessGroup(name, True)
+                except xmlrpc.client.Fault as e:
+                    self.logger.debug("{} handler could not stop group {}: {}".format(self.name, name, e.faultString))
+                client.connection.supervisor.removeProcessGroup(name)
+
+            # if a process is configured to automatically start then it will
+            if (state in ["changed", "added"]):
+                client.connection.supervisor.addProcessGroup(name)
+        except xmlrpc.client.Fault as e:
+            return e.faultString
+
+    def _sync(self, active, pending):
+        # returns True if our configurations changed and were written
+        report = {"active": active, "pending": pending}
+        if (not self.probed):
+            report["probe"] = self._get_system_configuration()
+
+        # once supervisor has everything that we last wrote then tell the
+        # DartAPI how long it took to get there
+        writer = ConfigurationsWriter()
+        version, written = writer.version, writer.written
+        if (version is not None and version != self.converged and not any(pending.values())):
+            report["converged"] = {"version": version, "seconds": round(time.time() - written, 3)}
+
+        # tell the DartAPI whether we're keeping up and how old our
+        # configurations are
+        telemetry = Telemetry()
+        report["telemetry"] = telemetry.report()
+        age = writer.age()
+        report["telemetry"]["age"] = (round(age) if age is not None else None)
+
+        try:
+            # send everything to the DartAPI. it's ok if this fails because
+            # we'll just try again in a minute. we've already updated the
+            # CorkAPI.
+            changed = writer.write(report)
+            telemetry.sent(report["telemetry"])
+            self.probed = True
+            if ("converged" in report):
+                self.converged = version
+            return changed
+        except requests.RequestException as e:
+            # do not need to see this one on dash
+            self.failures.inc(handler=self.name)
+            subject = "could not talk to the DartAPI on {}: {}".format(self.fqdn, e)
+            message = traceback.format_exc()
+            self.logger.warning("{} handler {}".format(self.name, subject))
+            self.logger.warning(message)
+            return False
+
+    def _get_system_configuration(self):
+        booted = None
+        try:
+            import psutil
+            booted = int(psutil.boot_time())
+        except ModuleNotFoundError:
+            pass
+
+        return {
+            "booted": booted,               # when the server started
+            "kernel": platform.platform(),  # kernel version
+        }
@@ -103,6 +103,7 @@ class SchedulerHandler(BaseHandler):
                             }
                         })
                     except xmlrpc.client.Fault as e:
+                        self.failures.inc(handler=self.name)
                         subject = "could not start process {} on {}: {}".format(process_name, self.fqdn, e.faultString)
                         message = traceback.format_exc()
                         self.logger.warning("{} handler {}".format(self.name, subject))
@@ -119,6 +120,7 @@ class SchedulerHandler(BaseHandler):
                             }
                         })
                     except Exception as e:
+                        self.failures.inc(handler=self.name)
                         subject = "could not start process {} on {}: {}".format(process_name, self.fqdn, repr(e))
                         message = traceback.format_exc()
                         self.logger.warning("{} handler {}".format(self.name, subject))
@@ -44,6 +44,10 @@ class StateHandler(BaseHandler):
     def name(self):
         return "state"
 
+    @property
+    def queued(self):
+        return self.processor.qsize()
+
     def start(self):
         self.thread = Thread(target=self._run)
         self.thread.start()
@@ -89,8 +93,10 @@ class StateHandler(BaseHandler):
                     self.logger.debug("{} handler queue listener cleaning up before exit".format(self.name))
                     finished = True
                 else:
-                    self._check(item["type"], item["event"])
+                    with self.timings.time(handler=self.name):
+                        self._check(item["type"], item["event"])
             except Exception as e:
+                self.failures.inc(handler=self.name)
                 subject = "unexpected error in queue listener on {}: {}".format(self.fqdn, e)
                 message = traceback.format_exc()
                 self.logger.error("{} handler {}".format(self.name, subject))
@@ -158,6 +164,7 @@ class StateHandler(BaseHandler):
                 response.raise_for_status()
             except requests.RequestException as e:
                 # don't want to raise any alarms about this one
+                self.failures.inc(handler=self.name)
                 subject = "{} handler could not post to the DartAPI: {}".format(self.name, e)
                 message = traceback.format_exc()
                 self.logger.warning(subject)
@@ -0,0 +1,78 @@
+from dart.common.singleton import Singleton
+from threading import RLock, active_count
+import time
+
+
+class Telemetry(metaclass=Singleton):
+    """
+    Keeps track of whether the agent is keeping up with supervisord so that
+    the DartAPI can show which agents are falling behind. The lag is how old
+    the last TICK event was when we got to it. Supervisord numbers the events
+    that it sends to us so if a number is skipped then it gave up on sending
+    us something. Those and the TICK events that we skip for being too old
+    are dropped events. Dropped events are reported as the number dropped
+    since the last report that got to the DartAPI.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+
+        self.started = time.time()
+        self.lag = None      # how old the last TICK event was when we got it
+        self.serial = None   # the last pool serial that we got
+        self.gaps = 0        # events that supervisord never sent us
+        self.skipped = 0     # TICK events that we skipped for being too old
+        self.reported = 0    # how many were dropped as of the last report
+
+        # returns how much work is waiting for each handler
+        self.queues = dict
+
+    def received(self, header, event):
+        with self.lock:
+            serial = header.get("poolserial")
+            if (serial is not None):
+                serial = int(serial)
+                if (self.serial is not None and serial > self.serial + 1):
+                    self.gaps += serial - self.serial - 1
+                self.serial = serial
+
+            if (header.get("eventname", "").startswith("TICK_") and event):
+                self.lag = max(time.time() - int(event.get("when", 0)), 0)
+
+    def skip(self):
+        with self.lock:
+            self.skipped += 1
+
+    def report(self):
+        with self.lock:
+            return {
+                "lag": (round(self.lag, 3) if self.lag is not None else None),
+                "gaps": self.gaps,
+                "skipped": self.skipped,
+                "dropped": self.gaps + self.skipped - self.reported,
+                "queued": self.queues(),
+                "rss": self._get_rss(),
+                "threads": active_count(),
+                "uptime": round(time.time() - self.started),
+            }
+
+    def sent(self, report):
+        # the dropped events in this report got to the DartAPI so the next
+        # report only has the ones dropped after it
+        with self.lock:
+            self.reported += report["dropped"]
+
+    def _get_rss(self):
+        # how much memory we're using in bytes, if we can find out
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss
+        except ModuleNotFoundError:
+            pass
+
+        try:
+            import resource
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * resource.getpagesize()
+        except (OSError, ValueError, IndexError):
+            return
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# posts synthetic active process lists of different sizes to the DartAPI and
+# prints how long each post takes. run it against a development instance
+# before and after a change to compare. the host used here is created if it
+# does not exist and all of its processes are replaced on every post so do not
+# point this at a host that you care about.
+
+import requests
+import statistics
+import json
+import time
+
+
+endpoint = "https://localhost:274/dart/agent/v1/active/benchmark.lockaby.org"
+cert = "/usr/local/ssl/certs/local/dart.local.lockaby.org.pem"
+ca = "/usr/local/ssl/certs/local-ca.cert"
+sizes = [50, 500, 5000]
+iterations = 10
+
+
+def generate(size, iteration):
+    now = int(time.time())
+    data = []
+    for i in range(0, size):
+        # change the state of a few processes on every iteration so that the
+        # database has something to actually write
+        state = "RUNNING" if (i + iteration) % 10 else "EXITED"
+        data.append({
+            "now": now,
+            "name": "benchmark-{:05d}".format(i),
+            "group": "benchmark-{:05d}".format(i),
+            "description": "pid 1234, uptime 0:00:01",
+            "pid": 1234 if state == "RUNNING" else 0,
+            "start": now - 1,
+            "stop": now if state == "EXITED" else 0,
+            "exitstatus": 0,
+            "spawnerr": "",
+            "statename": state,
+            "state": 20 if state == "RUNNING" else 100,
+            "logfile": "/data/logs/supervisor/benchmark-{:05d}.log".format(i),
+            "stdout_logfile": "/data/logs/supervisor/benchmark-{:05d}.log".format(i),
+            "stderr_logfile": "/data/logs/supervisor/benchmark-{:05d}.err".format(i),
+        })
+    return json.dumps(data)
+
+
+session = requests.Session()
+session.cert = cert
+session.verify = ca
+
+for size in sizes:
+    timings = []
+    for iteration in range(0, iterations):
+        data = generate(size, iteration)
+        start = time.perf_counter()
+        response = session.post(endpoint, data=data)
+        response.raise_for_status()
+        timings.append(time.perf_counter() - start)
+
+    print("{:>5} processes: median {:8.1f}ms, min {:8.1f}ms, max {:8.1f}ms".format(
+        size,
+        statistics.median(timings) * 1000,
+        min(timings) * 1000,
+        max(timings) * 1000,
+    ))
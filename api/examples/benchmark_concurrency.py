@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# posts active process lists for many hosts at the same time to the DartAPI
+# and prints how many posts per second it handled and how long they took. run
+# it against a single gevent worker with and without a slow database to see
+# whether one slow query holds up everything else in the worker, like this:
+#
+#   gunicorn dart.api.loader:app --worker-class=gevent --workers=1 -b 8001
+#
+# the hosts used here are created if they do not exist and all of their
+# processes are replaced on every post so do not point this at hosts that you
+# care about.
+
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import statistics
+import json
+import time
+
+
+endpoint = "https://localhost:274/dart/agent/v1/active/benchmark-{:04d}.lockaby.org"
+cert = "/usr/local/ssl/certs/local/dart.local.lockaby.org.pem"
+ca = "/usr/local/ssl/certs/local-ca.cert"
+concurrency = [1, 10, 50, 100, 200]
+requests_per_client = 20
+processes = 50
+
+
+def generate():
+    now = int(time.time())
+    return json.dumps([{
+        "now": now,
+        "name": "benchmark-{:05d}".format(i),
+        "group": "benchmark-{:05d}".format(i),
+        "description": "pid 1234, uptime 0:00:01",
+        "pid": 1234,
+        "start": now - 1,
+        "stop": 0,
+        "exitstatus": 0,
+        "spawnerr": "",
+        "statename": "RUNNING",
+        "state": 20,
+        "logfile": "/data/logs/supervisor/benchmark-{:05d}.log".format(i),
+        "stdout_logfile": "/data/logs/supervisor/benchmark-{:05d}.log".format(i),
+        "stderr_logfile": "/data/logs/supervisor/benchmark-{:05d}.err".format(i),
+    } for i in range(0, processes)])
+
+
+def client(number):
+    session = requests.Session()
+    session.cert = cert
+    session.verify = ca
+
+    timings = []
+    for _ in range(0, requests_per_client):
+        data = generate()
+        start = time.perf_counter()
+        response = session.post(endpoint.format(number), data=data)
+        response.raise_for_status()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+for clients in concurrency:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        timings = [x for result in executor.map(client, range(0, clients)) for x in result]
+    elapsed = time.perf_counter() - start
+
+    timings.sort()
+    print("{:>4} clients: {:8.1f} posts/second, median {:8.1f}ms, p99 {:8.1f}ms, max {:8.1f}ms".format(
+        clients,
+        len(timings) / elapsed,
+        statistics.median(timings) * 1000,
+        timings[int(len(timings) * 0.99) - 1] * 1000,
+        timings[-1] * 1000,
+    ))
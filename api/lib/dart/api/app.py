@@ -3,7 +3,13 @@ import logging
 from flask import Flask
 from flask_login import LoginManager
 from dart.common.settings import SettingsManager
+from dart.common.metrics import MetricsRegistry
+import dart.common.metrics
 from .database import DatabaseClient
+from .ingest import IngestBuffer
+from .singleflight import SingleFlight
+from .coordination import Coordinator
+from .notifications import Notifier
 from . import login
 from . import errors
 
@@ -15,9 +21,24 @@ logger = logging.getLogger(__name__)
 # get global settings
 settings_manager = SettingsManager(lazy=True)
 
+# everything puts its metrics here
+metrics_registry = MetricsRegistry()
+
 # need a connection to the database
 db_client = DatabaseClient()
 
+# optionally buffer updates from agents
+ingest_buffer = IngestBuffer()
+
+# let concurrent identical reads share one query
+single_flight = SingleFlight()
+
+# send commands to remote hosts
+coordinator = Coordinator()
+
+# tell remote hosts when their configurations change
+notifier = Notifier()
+
 # create a login manager
 login_manager = LoginManager()
 
@@ -52,10 +73,51 @@ def load():
         **({k.split(".")[-1]: v for k, v in settings_manager.items() if (k.startswith("api.database") and k != "api.database.name")})
     )
 
+    # maybe buffer updates from agents and write them in the background
+    ingest_buffer.init_app(
+        app,
+        # get all ingest configuration values and remove the leading parts
+        **({k.split(".")[-1]: v for k, v in settings_manager.items() if (k.startswith("api.ingest."))})
+    )
+
+    # share the results of expensive reads between concurrent requests
+    single_flight.init_app(
+        app,
+        # get all single flight configuration values and remove the leading parts
+        **({k.split(".")[-1]: v for k, v in settings_manager.items() if (k.startswith("api.singleflight."))})
+    )
+
+    # get ready to send commands to remote hosts
+    coordinator.init_app(
+        app,
+        db_client,
+        # get all coordination configuration values and remove the leading parts
+        **({k.split(".")[-1]: v for k, v in settings_manager.items() if (k.startswith("api.coordination."))})
+    )
+
+    # listen for configuration changes and tell hosts about them
+    notifier.init_app(
+        app,
+        db_client,
+        coordinator,
+        # get all notification configuration values and remove the leading parts
+        **({k.split(".")[-1]: v for k, v in settings_manager.items() if (k.startswith("api.notifications."))})
+    )
+
     # initialize the login manager
     login_manager.init_app(app)
     login.register_login_handler(app)
 
+    # time every request and serve everything that we're keeping track of
+    # from /metrics. everything that already keeps its own statistics gets
+    # them read when someone asks for them.
+    metrics_registry.collect("api_database", db_client.pool.stats, counters=["waits", "wait_time", "timeouts"])
+    metrics_registry.collect("api_ingest", ingest_buffer.stats, counters=["received", "coalesced", "rejected", "flushed", "failed", "dropped"])
+    metrics_registry.collect("api_singleflight", single_flight.stats, counters=["executed", "coalesced", "cached", "failed"])
+    metrics_registry.collect("api_coordination", coordinator.stats, counters=["submitted", "sent", "retried", "failed", "rejected", "resumed", "reused"])
+    metrics_registry.collect("api_notifications", notifier.stats, counters=["received", "told", "woken", "errors"])
+    dart.common.metrics.register_flask_app(app, metrics_registry, "{}/metrics".format(app.config.get("APPLICATION_ROOT", "")))
+
     # routes that the agent will query
     from .blueprints.agent.v1 import v1
     prefix = "{}/agent/v1".format(app.config.get("APPLICATION_ROOT", ""))
@@ -1,7 +1,30 @@
 from ....app import db_client
+import psycopg2.extras
 import json
 
 
+# how many rows to send to the database in a single statement when doing
+# bulk inserts. the statement is built in memory so this puts a cap on it.
+PAGE_SIZE = 1000
+
+
+def select_configuration_version(fqdn):
+    # triggers give a host a new configuration version whenever its
+    # assignments or the configurations of the processes assigned to it
+    # change. if nothing has changed since the versions were first recorded
+    # then there won't be a row yet.
+    with db_client.conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT version
+                FROM dart.change
+                WHERE scope = 'configuration'
+                  AND name = %s
+            """, (fqdn,))
+            row = cur.fetchone()
+            return (row["version"] if row else 0)
+
+
 def get_assigned_processes(fqdn):
     with db_client.conn() as conn:
         with conn.cursor() as cur:
@@ -90,30 +113,62 @@ def get_assigned_processes(fqdn):
 def insert_fqdn(fqdn):
     with db_client.conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO dart.host (fqdn, polled)
-                VALUES (%s, transaction_timestamp())
-                ON CONFLICT (fqdn) DO UPDATE
-                SET polled = excluded.polled
-            """, (fqdn,))
+            _insert_fqdn(cur, fqdn)
 
 
-def delete_active(fqdn, active):
-    with db_client.conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                DELETE FROM dart.active_process
-                WHERE fqdn = %s
-                  AND name != ALL(%s)
-            """, (fqdn, active))
+def _insert_fqdn(cur, fqdn, reported=None):
+    # "reported" is when the agent took a full list of active processes that
+    # we are about to write. it is only kept if it is newer than the last one
+    # that we wrote and this returns whether it was. this also locks the host
+    # until the end of the transaction so that nothing else can write its
+    # processes in the meantime.
+    cur.execute("""
+        INSERT INTO dart.host (fqdn, polled, reported)
+        VALUES (%(fqdn)s, transaction_timestamp(), to_timestamp(%(reported)s))
+        ON CONFLICT (fqdn) DO UPDATE
+        SET polled = excluded.polled,
+            reported = GREATEST(host.reported, excluded.reported)
+        RETURNING (%(reported)s IS NULL OR reported = to_timestamp(%(reported)s)) AS current
+    """, {"fqdn": fqdn, "reported": reported})
+    return cur.fetchone()["current"]
+
+
+def _select_reported(cur, fqdn):
+    # when the agent took the newest full list of active processes that we
+    # have written for this host, if any
+    cur.execute("""
+        SELECT extract(epoch FROM reported)::float AS reported
+        FROM dart.host
+        WHERE fqdn = %s
+    """, (fqdn,))
+    row = cur.fetchone()
+    return (row["reported"] if row else None)
 
 
-def insert_active(fqdn, name, state, started, stopped, stdout, stderr, pid, exit_status, description, error):
+def _is_current(reported, newest):
+    # a state change is only written if the agent saw it after it took the
+    # newest full list of active processes that we have written. otherwise
+    # that list already has it or something newer.
+    return (reported is None or newest is None or reported >= newest)
+
+
+def insert_active(fqdn, name, state, started, stopped, stdout, stderr, pid, exit_status, description, error, reported=None):
+    # rows are only rewritten when something about them actually changed. if
+    # we rewrote them on every update then every process on every host would
+    # leave a dead tuple behind every minute. freshness is tracked by the
+    # polled timestamp on the host. supervisord puts the uptime into the
+    # description of running processes so it changes every time and it is
+    # only written along with something else that changed. "reported" is when
+    # the agent saw the change and this returns whether it was written.
     with db_client.conn() as conn:
         with conn.cursor() as cur:
+            _insert_fqdn(cur, fqdn)
+            if (not _is_current(reported, _select_reported(cur, fqdn))):
+                return False
+
             cur.execute("""
-                INSERT INTO dart.active_process (fqdn, name, state, started, stopped, stdout_logfile, stderr_logfile, pid, exit_status, description, error, polled)
-                VALUES (%s, %s, %s, to_timestamp(%s), to_timestamp(%s), %s, %s, %s, %s, %s, %s, transaction_timestamp())
+                INSERT INTO dart.active_process (fqdn, name, state, started, stopped, stdout_logfile, stderr_logfile, pid, exit_status, description, error)
+                VALUES (%s, %s, %s, to_timestamp(%s), to_timestamp(%s), %s, %s, %s, %s, %s, %s)
                 ON CONFLICT (fqdn, name) DO UPDATE
                 SET state = excluded.state,
                     started = excluded.started,
@@ -123,31 +178,189 @@ def insert_active(fqdn, name, state, started, stopped, stdout, stderr, pid, exit
                     pid = excluded.pid,
                     exit_status = excluded.exit_status,
                     description = excluded.description,
-                    error = excluded.error,
-                    polled = excluded.polled
+                    error = excluded.error
+                WHERE (active_process.state, active_process.started, active_process.stopped,
+                       active_process.stdout_logfile, active_process.stderr_logfile, active_process.pid,
+                       active_process.exit_status, active_process.error)
+                      IS DISTINCT FROM
+                      (excluded.state, excluded.started, excluded.stopped,
+                       excluded.stdout_logfile, excluded.stderr_logfile, excluded.pid,
+                       excluded.exit_status, excluded.error)
             """, (fqdn, name, state, started, stopped, stdout, stderr, pid, exit_status, description, error))
+            return True
+
+
+def merge_active(fqdn, processes):
+    # processes is a list of tuples in the same order as the arguments to
+    # insert_active, less the fqdn. everything is merged with one statement
+    # in a single transaction, including making sure that the host exists and
+    # updating its polled timestamp. just like insert_active, unchanged rows
+    # are not rewritten and state changes that are older than the newest full
+    # list of active processes are left out.
+    with db_client.conn() as conn:
+        with conn.cursor() as cur:
+            _insert_fqdn(cur, fqdn)
+            newest = _select_reported(cur, fqdn)
+            processes = [x[:-1] for x in processes if _is_current(x[-1], newest)]
+            if (processes):
+                _merge_active(cur, [(fqdn, *x) for x in processes])
+
+
+def replace_active(fqdn, processes, reported=None):
+    # this works just like merge_active except that anything on this host that
+    # isn't in the list is then removed with one more statement in the same
+    # transaction. "reported" is when the agent took the list. every worker
+    # writes on its own so lists can show up out of order and a list that is
+    # older than the last one that we wrote is skipped. this returns whether
+    # the list was written.
+    with db_client.conn() as conn:
+        with conn.cursor() as cur:
+            if (not _insert_fqdn(cur, fqdn, reported)):
+                return False
+
+            _merge_active(cur, [(fqdn, *x) for x in processes])
+
+            cur.execute("""
+                DELETE FROM dart.active_process
+                WHERE fqdn = %s
+                  AND name != ALL(%s)
+            """, (fqdn, [process[0] for process in processes]))
+            return True
 
 
-def delete_pending(fqdn, pending):
+def _merge_active(cur, processes):
+    # processes is a list of tuples of the fqdn followed by the arguments to
+    # insert_active. the rows are sorted by name so that every host touches
+    # the summary rows for its processes in the same order. that keeps two
+    # hosts that are updating the same processes at the same time from
+    # deadlocking.
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO dart.active_process (fqdn, name, state, started, stopped, stdout_logfile, stderr_logfile, pid, exit_status, description, error)
+        VALUES %s
+        ON CONFLICT (fqdn, name) DO UPDATE
+        SET state = excluded.state,
+            started = excluded.started,
+            stopped = excluded.stopped,
+            stdout_logfile = excluded.stdout_logfile,
+            stderr_logfile = excluded.stderr_logfile,
+            pid = excluded.pid,
+            exit_status = excluded.exit_status,
+            description = excluded.description,
+            error = excluded.error
+        WHERE (active_process.state, active_process.started, active_process.stopped,
+               active_process.stdout_logfile, active_process.stderr_logfile, active_process.pid,
+               active_process.exit_status, active_process.error)
+              IS DISTINCT FROM
+              (excluded.state, excluded.started, excluded.stopped,
+               excluded.stdout_logfile, excluded.stderr_logfile, excluded.pid,
+               excluded.exit_status, excluded.error)
+    """, sorted(processes, key=lambda x: (x[1], x[0])), template="(%s, %s, %s, to_timestamp(%s), to_timestamp(%s), %s, %s, %s, %s, %s, %s)", page_size=PAGE_SIZE)
+
+
+def replace_pending(fqdn, processes):
+    # processes is a list of tuples of process name and pending state. this
+    # works the same way as replace_active, including sorting by name.
     with db_client.conn() as conn:
         with conn.cursor() as cur:
+            _insert_fqdn(cur, fqdn)
+            _merge_pending(cur, [(fqdn, *x) for x in processes])
+
             cur.execute("""
                 DELETE FROM dart.pending_process
                 WHERE fqdn = %s
                   AND name != ALL(%s)
-            """, (fqdn, pending))
+            """, (fqdn, [process[0] for process in processes]))
+
 
+def _merge_pending(cur, processes):
+    # processes is a list of tuples of fqdn, process name and pending state
+    # and they are sorted just like in _merge_active
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO dart.pending_process (fqdn, name, state)
+        VALUES %s
+        ON CONFLICT (fqdn, name) DO UPDATE
+        SET state = excluded.state
+        WHERE pending_process.state IS DISTINCT FROM excluded.state
+    """, sorted(processes, key=lambda x: (x[1], x[0])), page_size=PAGE_SIZE)
+
+
+def write_buffered(active, states, pending):
+    # this writes everything that the ingest buffer collected for a lot of
+    # hosts in one transaction with one statement for each kind of thing
+    # instead of one transaction for each host. "active" maps each host to a
+    # full list of active processes and when the agent took it, "states" maps
+    # each host to state changes like merge_active takes, and "pending" maps
+    # each host to its pending processes. it ends up the same as calling
+    # replace_active, merge_active and replace_pending for each host in that
+    # order. hosts are locked in order by name for the whole transaction.
+    hosts = sorted(set(active) | set(states) | set(pending))
+    if (not hosts):
+        return
 
-def insert_pending(fqdn, process, state):
     with db_client.conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO dart.pending_process (fqdn, name, state, polled)
-                VALUES (%s, %s, %s, transaction_timestamp())
-                ON CONFLICT (fqdn, name) DO UPDATE
-                SET state = excluded.state,
-                    polled = excluded.polled
-            """, (fqdn, process, state))
+            # this is _insert_fqdn for every host at once. it also says for
+            # each host whether its list of active processes is the newest
+            # one that we have and when the newest one was taken.
+            rows = psycopg2.extras.execute_values(cur, """
+                WITH incoming (fqdn, reported) AS (VALUES %s),
+                     upserted AS (
+                         INSERT INTO dart.host (fqdn, polled, reported)
+                         SELECT fqdn, transaction_timestamp(), reported
+                         FROM incoming
+                         ORDER BY fqdn
+                         ON CONFLICT (fqdn) DO UPDATE
+                         SET polled = excluded.polled,
+                             reported = GREATEST(host.reported, excluded.reported)
+                         RETURNING fqdn, reported
+                     )
+                SELECT
+                    upserted.fqdn,
+                    (incoming.reported IS NULL OR upserted.reported = incoming.reported) AS current,
+                    extract(epoch FROM upserted.reported)::float AS reported
+                FROM upserted
+                JOIN incoming ON incoming.fqdn = upserted.fqdn
+            """, [(x, (active[x][1] if x in active else None)) for x in hosts], template="(%s, to_timestamp(%s))", page_size=PAGE_SIZE, fetch=True)
+            current = {x["fqdn"] for x in rows if x["current"]}
+            newest = {x["fqdn"]: x["reported"] for x in rows}
+
+            # lists of active processes that are older than the one that we
+            # already have are skipped
+            replacing = {k: v[0] for k, v in active.items() if k in current}
+            if (replacing):
+                _merge_active(cur, [(fqdn, *x) for fqdn, processes in replacing.items() for x in processes])
+
+                keep = [(fqdn, x[0]) for fqdn, processes in replacing.items() for x in processes]
+                cur.execute("""
+                    DELETE FROM dart.active_process
+                    WHERE fqdn = ANY(%s)
+                      AND NOT EXISTS (
+                          SELECT 1
+                          FROM unnest(%s::text[], %s::text[]) AS keep (fqdn, name)
+                          WHERE keep.fqdn = active_process.fqdn
+                            AND keep.name = active_process.name
+                      )
+                """, (list(replacing), [x[0] for x in keep], [x[1] for x in keep]))
+
+            # then state changes that the agent saw after the newest list
+            merging = [(fqdn, *x[:-1]) for fqdn, processes in states.items() for x in processes if _is_current(x[-1], newest.get(fqdn))]
+            if (merging):
+                _merge_active(cur, merging)
+
+            if (pending):
+                _merge_pending(cur, [(fqdn, *x) for fqdn, processes in pending.items() for x in processes])
+
+                keep = [(fqdn, x[0]) for fqdn, processes in pending.items() for x in processes]
+                cur.execute("""
+                    DELETE FROM dart.pending_process
+                    WHERE fqdn = ANY(%s)
+                      AND NOT EXISTS (
+                          SELECT 1
+                          FROM unnest(%s::text[], %s::text[]) AS keep (fqdn, name)
+                          WHERE keep.fqdn = pending_process.fqdn
+                            AND keep.name = pending_process.name
+                      )
+                """, (list(pending), [x[0] for x in keep], [x[1] for x in keep]))
 
 
 def insert_host(fqdn, booted, kernel):
@@ -161,3 +374,17 @@ def insert_host(fqdn, booted, kernel):
                     kernel = excluded.kernel,
                     polled = excluded.polled
             """, (fqdn, booted, kernel))
+
+
+def update_telemetry(fqdn, telemetry):
+    # this changes on every report so it is kept away from the host where it
+    # would give the host and the list of hosts a new version every time
+    with db_client.conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO dart.host_telemetry (fqdn, telemetry, reported)
+                VALUES (%s, %s::jsonb, transaction_timestamp())
+                ON CONFLICT (fqdn) DO UPDATE
+                SET telemetry = excluded.telemetry,
+                    reported = excluded.reported
+            """, (fqdn, json.dumps(telemetry)))
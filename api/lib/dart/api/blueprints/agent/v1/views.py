@@ -1,11 +1,34 @@
 from ....app import logger
 from ....app import db_client
+from ....app import ingest_buffer
+from ....app import notifier
+from ....app import metrics_registry
 from ....validators import validate_json_data
 from . import v1
 from . import queries as q
 from flask import jsonify, make_response, request
 from flask_login import login_required
 from werkzeug.exceptions import BadRequest
+import dart.common.blobs
+import threading
+import time
+
+
+# the longest that an agent can wait for its configuration to change
+MAXIMUM_WAIT = 300
+
+# how agents are keeping up with their configurations
+syncs = metrics_registry.counter("api_agent_syncs_total", "agent syncs by whether the configuration was sent", ["result"])
+converged_seconds = metrics_registry.histogram("api_agent_converged_seconds", "time taken by agents to apply new configurations", buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+assigned_lookups = metrics_registry.counter("api_agent_assigned_total", "assigned processes looked up by whether they were cached", ["result"])
+
+# the assigned processes and blobs for each host along with the configuration
+# version that they were read at. working them out takes a few queries for
+# every process and agents ask for blobs right after they sync so they are
+# kept until the version changes. what is in here is shared between requests
+# so it must not be modified.
+_assigned = {}
+_assigned_lock = threading.Lock()
 
 
 @v1.route("/assigned/<fqdn>", methods=["GET"])
@@ -16,14 +39,27 @@ def get_assigned_processes(fqdn):
         conn = db_client.conn()
         conn.autocommit = False
 
+        # the version is read before the assignments so if something changes
+        # in between then the agent will just get the new assignments again
+        # the next time that it asks. if the agent already has this version
+        # then there is no reason to send it everything again.
+        etag = _select_configuration_version(fqdn)
+        if (request.if_none_match.contains_weak(etag)):
+            conn.commit()
+            response = make_response("", 304)
+            response.set_etag(etag)
+            return response
+
         # returns assignments and all configurations
         logger.debug("getting process assignments for {}".format(fqdn))
-        assignments = q.get_assigned_processes(fqdn)
+        assignments = list(q.get_assigned_processes(fqdn))
 
         # clean up the transaction
         conn.commit()
 
-        return make_response(jsonify(list(assignments)), 200)
+        response = make_response(jsonify(assignments), 200)
+        response.set_etag(etag)
+        return response
     except Exception as e:
         try:
             conn.rollback()
@@ -61,44 +97,22 @@ def post_active_processes(fqdn):
     #       }
     #  ]
 
+    active = _get_active(request.data)
+    reported = _get_reported(request.data)
+
+    # if we are buffering then we are done here
+    if (ingest_buffer.enabled and ingest_buffer.put_active(fqdn, active, reported)):
+        return make_response(jsonify({}), 202)
+
     conn = None
     try:
         conn = db_client.conn()
         conn.autocommit = False
 
-        # keep a list of the names that are active on this host. we are going
-        # to delete anything that is not on this list.
-        active = []
-
-        # make sure that we have a valid host
-        q.insert_fqdn(fqdn)
-
-        # then insert them all
-        for process in request.data:
-            # make sure that we have a name and a state
-            if (process.get("name") is None):
-                raise BadRequest("The DartAPI received invalid data.")
-            if (process.get("statename") is None):
-                raise BadRequest("The DartAPI received invalid data.")
-
-            logger.debug("inserting active process {} on fqdn {} in state {}".format(process["name"], fqdn, process["statename"]))
-            active.append(process["name"])
-            q.insert_active(
-                fqdn,
-                process["name"],
-                process["statename"],
-                process.get("start"),
-                process.get("stop"),
-                process.get("stdout_logfile"),
-                process.get("stderr_logfile"),
-                process.get("pid"),
-                process.get("exitstatus"),
-                process.get("description"),
-                process.get("spawnerr"),
-            )
-
-        # clean up things that don't exist anymore
-        q.delete_active(fqdn, active)
+        # then replace everything in one go
+        logger.debug("replacing {} active processes on fqdn {}".format(len(active), fqdn))
+        if (not q.replace_active(fqdn, active, reported)):
+            logger.info("not replacing active processes on {} with a list that is older than the last one".format(fqdn))
 
         # clean up the transaction
         conn.commit()
@@ -129,34 +143,20 @@ def post_pending_processes(fqdn):
     #     'removed': []
     # }
 
+    pending = _get_pending(request.data)
+
+    # if we are buffering then we are done here
+    if (ingest_buffer.enabled and ingest_buffer.put_pending(fqdn, pending)):
+        return make_response(jsonify({}), 202)
+
     conn = None
     try:
         conn = db_client.conn()
         conn.autocommit = False
 
-        # keep a list of the names that are pending on this host. we are going
-        # to delete anything that is not on this list.
-        pending = []
-
-        # make sure that we have a valid host
-        q.insert_fqdn(fqdn)
-
-        # then insert them all again
-        for process in request.data.get("added", []):
-            logger.debug("inserting pending 'added' record for {} on {}".format(process, fqdn))
-            pending.append(process)
-            q.insert_pending(fqdn, process, "added")
-        for process in request.data.get("changed", []):
-            logger.debug("inserting pending 'changed' record for {} on {}".format(process, fqdn))
-            pending.append(process)
-            q.insert_pending(fqdn, process, "changed")
-        for process in request.data.get("removed", []):
-            logger.debug("inserting pending 'removed' record for {} on {}".format(process, fqdn))
-            pending.append(process)
-            q.insert_pending(fqdn, process, "removed")
-
-        # clean up things that don't exist anymore
-        q.delete_pending(fqdn, pending)
+        # then replace everything in one go
+        logger.debug("replacing {} pending processes on fqdn {}".format(len(pending), fqdn))
+        q.replace_pending(fqdn, pending)
 
         # clean up the transaction
         conn.commit()
@@ -198,35 +198,39 @@ def post_state(fqdn, process):
     #      'stderr_logfile': '/data/logs/supervisor/cassandra-node-repair.err',
     #  }
 
+    # make sure that we have a name and a state
+    if (request.data.get("name") is None):
+        raise BadRequest("The DartAPI received invalid data.")
+    if (request.data.get("statename") is None):
+        raise BadRequest("The DartAPI received invalid data.")
+
+    state = (
+        request.data["name"],
+        request.data["statename"],
+        request.data.get("start"),
+        request.data.get("stop"),
+        request.data.get("stdout_logfile"),
+        request.data.get("stderr_logfile"),
+        request.data.get("pid"),
+        request.data.get("exitstatus"),
+        request.data.get("description"),
+        request.data.get("spawnerr"),
+        _get_number(request.data.get("now")),
+    )
+
+    # if we are buffering then we are done here
+    logger.info("registering state change for {} on {} to {}".format(request.data["name"], fqdn, request.data["statename"]))
+    if (ingest_buffer.enabled and ingest_buffer.put_state(fqdn, state)):
+        return make_response(jsonify({}), 202)
+
     conn = None
     try:
         conn = db_client.conn()
         conn.autocommit = False
 
-        # make sure that we have a valid host
-        q.insert_fqdn(fqdn)
-
-        # make sure that we have a name and a state
-        if (request.data.get("name") is None):
-            raise BadRequest("The DartAPI received invalid data.")
-        if (request.data.get("statename") is None):
-            raise BadRequest("The DartAPI received invalid data.")
-
-        # send it to the database
-        logger.info("registering state change for {} on {} to {}".format(request.data["name"], fqdn, request.data["statename"]))
-        q.insert_active(
-            fqdn,
-            request.data["name"],
-            request.data["statename"],
-            request.data.get("start"),
-            request.data.get("stop"),
-            request.data.get("stdout_logfile"),
-            request.data.get("stderr_logfile"),
-            request.data.get("pid"),
-            request.data.get("exitstatus"),
-            request.data.get("description"),
-            request.data.get("spawnerr"),
-        )
+        # send it to the database. this makes sure that we have a valid host.
+        if (not q.insert_active(fqdn, *state)):
+            logger.info("not recording state change for {} on {} because it is older than the last list of active processes".format(request.data["name"], fqdn))
 
         # clean up the transaction
         conn.commit()
@@ -254,8 +258,13 @@ def post_probe(fqdn):
     # {
     #      'boot_time': 1536093182,
     #      'kernel': 'Linux-3.10.0-862.6.3.el7.x86_64-x86_64-with-centos-7.6.1810-Core',
+    #      'telemetry': {'lag': 0.5, 'dropped': 0, ...},  <- optional, same as sync
     #  }
 
+    telemetry = request.data.get("telemetry")
+    if (telemetry is not None):
+        telemetry = _get_telemetry(telemetry)
+
     conn = None
     try:
         conn = db_client.conn()
@@ -268,6 +277,8 @@ def post_probe(fqdn):
             request.data.get("booted"),
             request.data.get("kernel"),
         )
+        if (telemetry is not None):
+            q.update_telemetry(fqdn, telemetry)
 
         # clean up the transaction
         conn.commit()
@@ -285,3 +296,305 @@ def post_probe(fqdn):
             conn.autocommit = True
         except Exception:
             pass
+
+
+@v1.route("/sync/<fqdn>", methods=["POST"])
+@login_required
+@validate_json_data
+def post_sync(fqdn):
+    # this does everything that probe, active, pending, and assigned do in one
+    # request. to help with debugging, data will look like this:
+    # {
+    #     'probe': {'booted': 1536093182, 'kernel': 'Linux-3.10.0'},  <- optional, same as probe
+    #     'active': [...],                                              <- optional, same as active
+    #     'pending': {'added': [], 'changed': [], 'removed': []},       <- optional, same as pending
+    #     'version': 'configuration-1234',                              <- optional, the version the agent has
+    #     'converged': {'version': 'configuration-1234', 'seconds': 2.5}, <- optional, how long the agent took to apply it
+    #     'telemetry': {'lag': 0.5, 'dropped': 0, 'queued': {...}, ...},  <- optional, whether the agent is keeping up
+    # }
+    #
+    # the response has the current configuration version and the assigned
+    # processes, but only if the agent doesn't already have that version.
+    # otherwise they are null. the assigned processes are just like assigned
+    # except that the configuration and monitors for each one are replaced
+    # with the name of a blob that has them. agents keep the blobs and ask
+    # for the ones that they don't have from blobs. agents can ask us to
+    # hold on to the request for "wait" seconds until their configuration
+    # changes.
+    if (not isinstance(request.data, dict)):
+        raise BadRequest("The DartAPI received invalid data.")
+
+    wait = request.args.get("wait", "0")
+    try:
+        wait = min(max(float(wait), 0), MAXIMUM_WAIT)
+    except ValueError:
+        logger.warning("could not wait for changes for {} because the wait was invalid: {}".format(fqdn, wait))
+        raise BadRequest("The value for wait must be a number of seconds.")
+
+    probe = request.data.get("probe")
+    if (probe is not None and not isinstance(probe, dict)):
+        raise BadRequest("The DartAPI received invalid data.")
+
+    # the report time comes from the list so make sure that it is a list of
+    # processes before looking for it
+    active = request.data.get("active")
+    reported = None
+    if (active is not None):
+        active = _get_active(request.data["active"])
+        reported = _get_reported(request.data["active"])
+
+    pending = request.data.get("pending")
+    if (pending is not None):
+        pending = _get_pending(pending)
+
+    telemetry = request.data.get("telemetry")
+    if (telemetry is not None):
+        telemetry = _get_telemetry(telemetry)
+
+    # this is how long it took from when the agent wrote its configuration
+    # to when supervisord had all of it
+    converged = request.data.get("converged")
+    if (isinstance(converged, dict)):
+        logger.info("{} applied {} after {} seconds".format(fqdn, converged.get("version"), converged.get("seconds")))
+        if (isinstance(converged.get("seconds"), (int, float))):
+            converged_seconds.observe(converged["seconds"])
+
+    # if we are buffering then those parts are done here
+    if (active is not None and ingest_buffer.enabled and ingest_buffer.put_active(fqdn, active, reported)):
+        active = None
+    if (pending is not None and ingest_buffer.enabled and ingest_buffer.put_pending(fqdn, pending)):
+        pending = None
+
+    # start watching for changes before looking at the version so that we
+    # don't miss a change that happens in between
+    known = request.data.get("version")
+    with notifier.watch(fqdn) as changed:
+        version = _sync_report(fqdn, probe, active, reported, pending, telemetry)
+
+        # if the agent already has this version then wait for it to change.
+        # the database connection goes back to the pool while we wait.
+        if (version == known and wait):
+            db_client.close(None)
+            if (changed is None):
+                # we won't hear about changes so just look again at the end
+                time.sleep(wait)
+                version = _select_configuration_version(fqdn)
+            elif (changed.wait(wait)):
+                version = _select_configuration_version(fqdn)
+
+    if (version == known):
+        syncs.inc(result="unchanged")
+        return make_response(jsonify({"version": version, "assigned": None}), 200)
+
+    syncs.inc(result="changed")
+    version, assignments, _ = _select_assigned(fqdn)
+    return make_response(jsonify({"version": version, "assigned": assignments}), 200)
+
+
+@v1.route("/blobs/<fqdn>", methods=["POST"])
+@login_required
+@validate_json_data
+def post_blobs(fqdn):
+    # to help with debugging, data will look like this:
+    # {
+    #     'hashes': ['9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'],
+    # }
+    #
+    # blobs are made from the host's assignments so a host can only get its
+    # own. blobs that don't exist anymore because something changed are left
+    # out and the agent will find out about the change the next time that it
+    # syncs.
+    hashes = (request.data.get("hashes") if isinstance(request.data, dict) else None)
+    if (not isinstance(hashes, list)):
+        raise BadRequest("The DartAPI received invalid data.")
+
+    _, _, blobs = _select_assigned(fqdn)
+
+    wanted = set(hashes)
+    return make_response(jsonify({"blobs": {k: v for k, v in blobs.items() if k in wanted}}), 200)
+
+
+def _get_active(data):
+    # collect everything that is active on this host. anything that is not in
+    # this list is going to be deleted. the list is keyed by name because the
+    # database will refuse to merge the same row twice in one statement so if
+    # we get duplicates then the last one wins.
+    if (not isinstance(data, list)):
+        raise BadRequest("The DartAPI received invalid data.")
+
+    active = {}
+    for process in data:
+        # make sure that we have a name and a state
+        if (not isinstance(process, dict)):
+            raise BadRequest("The DartAPI received invalid data.")
+        if (process.get("name") is None):
+            raise BadRequest("The DartAPI received invalid data.")
+        if (process.get("statename") is None):
+            raise BadRequest("The DartAPI received invalid data.")
+
+        active[process["name"]] = (
+            process["name"],
+            process["statename"],
+            process.get("start"),
+            process.get("stop"),
+            process.get("stdout_logfile"),
+            process.get("stderr_logfile"),
+            process.get("pid"),
+            process.get("exitstatus"),
+            process.get("description"),
+            process.get("spawnerr"),
+        )
+
+    return list(active.values())
+
+
+def _get_reported(data):
+    # supervisord tells us what time it was when it told the agent about each
+    # process so the newest of those is when the agent took the list. workers
+    # write on their own so this is how we know which list is newer.
+    times = [_get_number(x.get("now")) for x in data if isinstance(x, dict)]
+    return max([x for x in times if x is not None], default=None)
+
+
+def _get_number(value):
+    return (value if isinstance(value, (int, float)) and not isinstance(value, bool) else None)
+
+
+def _get_pending(data):
+    # collect everything that is pending on this host. anything that is not
+    # in this list is going to be deleted. if a process shows up in more than
+    # one list then the last one wins.
+    if (not isinstance(data, dict)):
+        raise BadRequest("The DartAPI received invalid data.")
+
+    pending = {}
+    for state in ["added", "changed", "removed"]:
+        for process in data.get(state, []):
+            pending[process] = (process, state)
+
+    return list(pending.values())
+
+
+def _get_telemetry(data):
+    # keep only the numbers that the agent told us about so that whatever we
+    # put into the database can be compared. the number of things waiting for
+    # each handler is the only thing that isn't a number.
+    if (not isinstance(data, dict)):
+        raise BadRequest("The DartAPI received invalid data.")
+
+    telemetry = {k: v for k, v in data.items() if k != "queued" and _get_number(v) is not None}
+
+    queued = data.get("queued")
+    if (isinstance(queued, dict)):
+        telemetry["queued"] = {str(k): v for k, v in queued.items() if _get_number(v) is not None}
+
+    return telemetry
+
+
+def _sync_report(fqdn, probe, active, reported, pending, telemetry):
+    # write everything that the agent told us in one transaction and return
+    # the configuration version that the agent should have
+    conn = None
+    try:
+        conn = db_client.conn()
+        conn.autocommit = False
+
+        if (probe is not None):
+            logger.info("received host update for {}, booted {} with kernel {}".format(fqdn, probe.get("booted"), probe.get("kernel")))
+            q.insert_host(fqdn, probe.get("booted"), probe.get("kernel"))
+        else:
+            q.insert_fqdn(fqdn)
+
+        if (telemetry is not None):
+            q.update_telemetry(fqdn, telemetry)
+
+        if (active is not None):
+            logger.debug("replacing {} active processes on fqdn {}".format(len(active), fqdn))
+            if (not q.replace_active(fqdn, active, reported)):
+                logger.info("not replacing active processes on {} with a list that is older than the last one".format(fqdn))
+
+        if (pending is not None):
+            logger.debug("replacing {} pending processes on fqdn {}".format(len(pending), fqdn))
+            q.replace_pending(fqdn, pending)
+
+        version = _select_configuration_version(fqdn)
+
+        # clean up the transaction
+        conn.commit()
+
+        return version
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise e
+    finally:
+        try:
+            conn.autocommit = True
+        except Exception:
+            pass
+
+
+def _split_blobs(assignments):
+    # the configuration and monitors for a process are the same on every
+    # host that it is assigned to and they are most of what we would send.
+    # they are replaced with the name of a blob that is a hash of them.
+    blobs = {}
+    for assignment in assignments:
+        blob = {
+            "configuration": assignment.pop("configuration"),
+            "monitors": assignment.pop("monitors"),
+        }
+        assignment["blob"] = dart.common.blobs.get_name(blob)
+        blobs[assignment["blob"]] = blob
+    return assignments, blobs
+
+
+def _select_configuration_version(fqdn):
+    # this is also the etag for the assigned processes
+    return "configuration-{}".format(q.select_configuration_version(fqdn))
+
+
+def _select_assigned(fqdn):
+    # returns the configuration version, the assigned processes with their
+    # configurations and monitors split out, and the blobs that they were
+    # split into. these may be shared with other requests.
+    conn = None
+    try:
+        conn = db_client.conn()
+        conn.autocommit = False
+
+        # the version is read before the assignments so if something changes
+        # in between then the agent will just get the new assignments again
+        # the next time that it asks. what we keep might be newer than the
+        # version that it is kept under but never older and the version
+        # will have moved on by the time that anyone could notice.
+        version = _select_configuration_version(fqdn)
+        with _assigned_lock:
+            cached = _assigned.get(fqdn)
+        if (cached is not None and cached[0] == version):
+            conn.commit()
+            assigned_lookups.inc(result="cached")
+            return cached
+
+        assignments, blobs = _split_blobs(list(q.get_assigned_processes(fqdn)))
+
+        # clean up the transaction
+        conn.commit()
+
+        assigned_lookups.inc(result="read")
+        with _assigned_lock:
+            _assigned[fqdn] = (version, assignments, blobs)
+        return version, assignments, blobs
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise e
+    finally:
+        try:
+            conn.autocommit = True
+        except Exception:
+            pass
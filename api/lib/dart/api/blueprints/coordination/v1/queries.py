@@ -0,0 +1,77 @@
+from ....app import db_client
+import psycopg2.extras
+
+
+def select_hosts(fqdns):
+    with db_client.conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT fqdn
+                FROM dart.host
+                WHERE fqdn = ANY(%s::TEXT[])
+                ORDER BY fqdn
+            """, (list(set(fqdns)),))
+            return [x["fqdn"] for x in cur.fetchall()]
+
+
+def select_assigned_hosts(name, fqdns=None):
+    # every host that the process is assigned to or just the ones given
+    with db_client.conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT fqdn
+                FROM dart.assignment
+                WHERE process_name = %s
+                  AND (%s::TEXT[] IS NULL OR fqdn = ANY(%s::TEXT[]))
+                ORDER BY fqdn
+            """, (name, fqdns, fqdns))
+            return [x["fqdn"] for x in cur.fetchall()]
+
+
+def save_commands(commands):
+    # commands is a list of tuples in the order of the columns of dart.command
+    # with the times as unix timestamps
+    with db_client.conn() as conn:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO dart.command (id, fqdn, action, process, version, status, attempts, message, created, finished, result)
+                VALUES %s
+                ON CONFLICT (id) DO UPDATE
+                SET status = excluded.status,
+                    attempts = excluded.attempts,
+                    message = excluded.message,
+                    finished = excluded.finished,
+                    result = excluded.result
+            """, commands, template="(%s, %s, %s, %s, %s, %s, %s, %s, to_timestamp(%s), to_timestamp(%s), %s::jsonb)")
+
+
+def select_command(command_id):
+    with db_client.conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT
+                    id,
+                    fqdn,
+                    action,
+                    process,
+                    version,
+                    status,
+                    attempts,
+                    message,
+                    to_char(created, 'YYYY-MM-DD HH24:MI:SS') AS created,
+                    to_char(finished, 'YYYY-MM-DD HH24:MI:SS') AS finished,
+                    result
+                FROM dart.command
+                WHERE id = %s
+            """, (command_id,))
+            return cur.fetchone()
+
+
+def delete_commands(seconds):
+    # finished commands are only kept around for so long
+    with db_client.conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                DELETE FROM dart.command
+                WHERE finished < transaction_timestamp() - make_interval(secs => %s)
+            """, (seconds,))
@@ -1,86 +1,188 @@
 from ....app import logger
-from ....app import settings_manager
+from ....app import db_client
+from ....app import coordinator
+from ....validators import validate_json_data
 from . import v1
-from flask import jsonify, make_response
+from . import queries as q
+from flask import jsonify, make_response, request, json, Response, stream_with_context
 from flask_login import login_required
-import socket
-import ssl
-import json
+from werkzeug.exceptions import BadRequest, NotFound
+from dart.common import PROCESSES_TO_IGNORE
+
+
+# the longest that someone can wait for a command to finish
+MAXIMUM_WAIT = 30
+
+# the actions that can be sent to a process or to a host on its own
+PROCESS_ACTIONS = ["start", "stop", "restart", "update"]
+HOST_ACTIONS = ["reread", "rewrite"]
 
 
 @v1.route("/start/<string:fqdn>/<string:process_name>", methods=["POST"])
 @login_required
 def start(fqdn, process_name):
+    _check_process(process_name, "start")
     logger.info("sending start command to {} on {}".format(fqdn, process_name))
-    send_command(fqdn, "start", process_name)
-    return make_response(jsonify({}), 200)
+    command = coordinator.submit(fqdn, "start", process_name)
+    return make_response(jsonify(command.to_dict()), 202)
 
 
 @v1.route("/stop/<string:fqdn>/<string:process_name>", methods=["POST"])
 @login_required
 def stop(fqdn, process_name):
+    _check_process(process_name, "stop")
     logger.info("sending stop command to {} on {}".format(fqdn, process_name))
-    send_command(fqdn, "stop", process_name)
-    return make_response(jsonify({}), 200)
+    command = coordinator.submit(fqdn, "stop", process_name)
+    return make_response(jsonify(command.to_dict()), 202)
 
 
 @v1.route("/restart/<string:fqdn>/<string:process_name>", methods=["POST"])
 @login_required
 def restart(fqdn, process_name):
+    _check_process(process_name, "restart")
     logger.info("sending restart command to {} on {}".format(fqdn, process_name))
-    send_command(fqdn, "restart", process_name)
-    return make_response(jsonify({}), 200)
+    command = coordinator.submit(fqdn, "restart", process_name)
+    return make_response(jsonify(command.to_dict()), 202)
 
 
 @v1.route("/update/<string:fqdn>/<string:process_name>", methods=["POST"])
 @login_required
 def update(fqdn, process_name):
+    _check_process(process_name, "update")
     logger.info("sending update command to {} on {}".format(fqdn, process_name))
-    send_command(fqdn, "update", process_name)
-    return make_response(jsonify({}), 200)
+    command = coordinator.submit(fqdn, "update", process_name)
+    return make_response(jsonify(command.to_dict()), 202)
 
 
 @v1.route("/reread/<string:fqdn>", methods=["POST"])
 @login_required
 def reread(fqdn):
     logger.info("sending reread command to {}".format(fqdn))
-    send_command(fqdn, "reread")
-    return make_response(jsonify({}), 200)
+    command = coordinator.submit(fqdn, "reread")
+    return make_response(jsonify(command.to_dict()), 202)
 
 
 @v1.route("/rewrite/<string:fqdn>", methods=["POST"])
 @login_required
 def rewrite(fqdn):
     logger.info("sending rewrite command to {}".format(fqdn))
-    send_command(fqdn, "rewrite")
-    return make_response(jsonify({}), 200)
-
-
-def send_command(fqdn, action, process=None):
-    ctx = ssl.SSLContext()
-    ctx.verify_mode = ssl.CERT_REQUIRED
-    ctx.check_hostname = True
-
-    ca = settings_manager.get("api.coordination.ca")
-    key = settings_manager.get("api.coordination.key")
-    name = settings_manager.get("api.coordination.name")
-    port = settings_manager.get("api.coordination.port")
-    logger.debug("connecting to {}:{} as {} using {} verified against {}".format(fqdn, port, name, key, ca))
-
-    # we must validate the remote side against the UWCA
-    ctx.load_verify_locations(ca)
-
-    # we will present this as the client certificate for the connection
-    ctx.load_cert_chain(key)
-
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        # we expect the remote side to identify itself as "dart.s.uw.edu"
-        with ctx.wrap_socket(sock, server_hostname=name) as ssock:
-            ssock.connect((fqdn, port))
-
-            if (process is None):
-                logger.debug("connected to {}, sending {}".format(fqdn, action))
-                ssock.sendall((json.dumps({"action": action}) + "\n").encode())
-            else:
-                logger.debug("connected to {}, sending {} to {}".format(fqdn, action, process))
-                ssock.sendall((json.dumps({"action": action, "process": process}) + "\n").encode())
+    command = coordinator.submit(fqdn, "rewrite")
+    return make_response(jsonify(command.to_dict()), 202)
+
+
+@v1.route("/processes/<string:process_name>/<string:action>", methods=["POST"])
+@login_required
+@validate_json_data
+def fan_out_process(process_name, action):
+    if (action not in PROCESS_ACTIONS):
+        logger.warning("could not send {} command to {} because the action was not valid".format(action, process_name))
+        raise NotFound("Unable to send {} commands to processes.".format(action))
+    _check_process(process_name, action)
+
+    hosts, parallelism, batch = _get_fan_out(request.data)
+
+    # with no hosts we go everywhere that the process is assigned
+    assigned = q.select_assigned_hosts(process_name, hosts)
+    skipped = ([] if hosts is None else sorted(set(hosts) - set(assigned)))
+    if (not assigned and not skipped):
+        logger.warning("could not send {} command to {} because it is not assigned to any hosts".format(action, process_name))
+        raise NotFound("No hosts found with the process {} assigned.".format(process_name))
+
+    logger.info("sending {} command to {} on {} hosts".format(action, process_name, len(assigned)))
+    return _fan_out(
+        [(x, action, process_name) for x in assigned],
+        [(x, action, process_name) for x in skipped],
+        "The process is not assigned to this host.",
+        parallelism,
+        batch,
+    )
+
+
+@v1.route("/hosts/<string:action>", methods=["POST"])
+@login_required
+@validate_json_data
+def fan_out_hosts(action):
+    if (action not in HOST_ACTIONS):
+        logger.warning("could not send {} command to hosts because the action was not valid".format(action))
+        raise NotFound("Unable to send {} commands to hosts.".format(action))
+
+    hosts, parallelism, batch = _get_fan_out(request.data)
+    if (not hosts):
+        logger.warning("could not send {} command to hosts because no hosts were given".format(action))
+        raise BadRequest("The 'hosts' field must list the hosts to send the command to.")
+
+    known = q.select_hosts(hosts)
+    skipped = sorted(set(hosts) - set(known))
+
+    logger.info("sending {} command to {} hosts".format(action, len(known)))
+    return _fan_out(
+        [(x, action, None) for x in known],
+        [(x, action, None) for x in skipped],
+        "No host found with this fully qualified domain name.",
+        parallelism,
+        batch,
+    )
+
+
+@v1.route("/commands/<string:command_id>", methods=["GET"])
+@login_required
+def command(command_id):
+    # callers can ask to wait for the command to finish rather than polling
+    wait = request.args.get("wait", "0")
+    try:
+        wait = min(max(float(wait), 0), MAXIMUM_WAIT)
+    except ValueError:
+        logger.warning("could not wait for command {} because the wait was invalid: {}".format(command_id, wait))
+        raise BadRequest("The value for wait must be a number of seconds.")
+
+    # the command may have been sent by another worker
+    command = coordinator.lookup(command_id, wait)
+    if (command is None):
+        logger.warning("could not find command {}".format(command_id))
+        raise NotFound("No command found with the id {}.".format(command_id))
+
+    return make_response(jsonify(command), 200)
+
+
+def _check_process(process_name, action):
+    # we aren't going to let anyone do anything to the dart agent. the tool
+    # and the portal already refuse but anyone can call the api directly.
+    if (process_name in PROCESSES_TO_IGNORE):
+        logger.warning("could not send {} command to {} because no changes are allowed to it".format(action, process_name))
+        raise BadRequest("No changes are allowed to the {} process.".format(process_name))
+
+
+def _get_fan_out(data):
+    if (not isinstance(data, dict)):
+        logger.warning("could not send commands because the data was not an object")
+        raise BadRequest("Invalid data. Must be an object.")
+
+    hosts = data.get("hosts")
+    if (hosts is not None and (not isinstance(hosts, list) or not all(isinstance(x, str) and x.strip() for x in hosts))):
+        logger.warning("could not send commands because the hosts were invalid: {}".format(hosts))
+        raise BadRequest("The 'hosts' field must be a list of fully qualified domain names.")
+
+    for key in ["parallelism", "batch"]:
+        value = data.get(key)
+        if (value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1)):
+            logger.warning("could not send commands because the value for {} was invalid: {}".format(key, value))
+            raise BadRequest("The '{}' field must be a positive number.".format(key))
+
+    return hosts, data.get("parallelism"), data.get("batch")
+
+
+def _fan_out(commands, skipped, reason, parallelism, batch):
+    # write one json document per line for each host as soon as we know what
+    # happened, starting with the ones that we aren't going to try
+    def generate():
+        for fqdn, action, process in skipped:
+            yield json.dumps({"fqdn": fqdn, "action": action, "process": process, "status": "skipped", "message": reason}) + "\n"
+
+        for command in coordinator.fan_out(commands, parallelism, batch):
+            yield json.dumps(command.to_dict()) + "\n"
+
+    # the response can take a long time to stream and we're done with the
+    # database so give the connection back to the pool instead of holding it
+    db_client.close(None)
+
+    return Response(stream_with_context(generate()), 200, mimetype="application/x-ndjson")
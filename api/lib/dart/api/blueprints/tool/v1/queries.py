@@ -1,47 +1,93 @@
 from ....app import db_client
-from datetime import datetime, timedelta
-from crontab import CronTab
+from .... import schedules
+import psycopg2.extras
 import json
+import uuid
 
 
-def is_valid_host(fqdn):
+# how many rows to send to the database in each statement
+PAGE_SIZE = 1000
+
+# a host is lagging when its agent got to its last TICK event at least
+# "lagging" seconds late or when it has dropped events since its last report.
+# agents that have never reported aren't lagging, we just don't know.
+LAGGING = """(
+    COALESCE((ht.telemetry ->> 'lag')::float, 0) >= %(lagging)s OR
+    COALESCE((ht.telemetry ->> 'dropped')::float, 0) > 0
+)"""
+
+
+def select_known(fqdns, names):
+    # returns the hosts and processes that exist out of the ones given so that
+    # any number of them can be checked at once. processes are returned both
+    # by name and by name and environment.
     with db_client.conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-                SELECT COUNT(*) AS total
+                SELECT 'host' AS kind, fqdn AS name, NULL AS environment
                 FROM dart.host
-                WHERE fqdn = %s
-            """, (fqdn,))
-            row = cur.fetchone()
-            return (row["total"] > 0)
+                WHERE fqdn = ANY(%s::TEXT[])
+                UNION ALL
+                SELECT 'process' AS kind, name, environment
+                FROM dart.process
+                WHERE name = ANY(%s::TEXT[])
+            """, (list(set(fqdns)), list(set(names))))
 
+            known = {"hosts": set(), "names": set(), "processes": set()}
+            for row in cur:
+                if (row["kind"] == "host"):
+                    known["hosts"].add(row["name"])
+                else:
+                    known["names"].add(row["name"])
+                    known["processes"].add((row["name"], row["environment"]))
+            return known
+
+
+def select_change(scope, name=""):
+    # triggers give every host and process a new version whenever anything
+    # about it changes. the lists of hosts and processes have an empty name.
+    # if nothing has changed since the versions were first recorded then
+    # there won't be a row yet.
+    #
+    # a few things change too often to give anything a new version: when
+    # each host was last polled, what its agent last reported, and the state
+    # of a process on every host that it is on. giving those new versions
+    # would have every host waiting on the same rows. instead they are
+    # summed up here from the rows themselves so that the version still
+    # changes whenever anything that we return does. every rewritten row has
+    # a new xmin so that is what stands in for the processes.
+    with db_client.conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT version
+                FROM dart.change
+                WHERE scope = %s
+                  AND name = %s
+            """, (scope, name))
+            row = cur.fetchone()
+            version = (row["version"] if row else 0)
 
-def is_valid_process(name, environment=None):
-    if (not environment):
-        with db_client.conn() as conn:
-            with conn.cursor() as cur:
+            if (scope == "host"):
+                cur.execute("""
+                    SELECT md5(string_agg(concat_ws(' ', h.fqdn, h.polled, ht.reported), ',' ORDER BY h.fqdn)) AS checksum
+                    FROM dart.host h
+                    LEFT OUTER JOIN dart.host_telemetry ht ON ht.fqdn = h.fqdn
+                    WHERE (%(name)s = '' OR h.fqdn = %(name)s)
+                """, {"name": name})
+            elif (scope == "process" and name != ""):
                 cur.execute("""
-                    SELECT COUNT(*) AS total
-                    FROM dart.process
+                    SELECT md5(string_agg(concat_ws(' ', fqdn, xmin), ',' ORDER BY fqdn)) AS checksum
+                    FROM dart.active_process
                     WHERE name = %s
                 """, (name,))
-                row = cur.fetchone()
-                return (row["total"] > 0)
+            else:
+                return str(version)
 
-    else:
-        with db_client.conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT COUNT(*) AS total
-                    FROM dart.process
-                    WHERE name = %s
-                      AND environment = %s
-                """, (name, environment))
-                row = cur.fetchone()
-                return (row["total"] > 0)
+            row = cur.fetchone()
+            return "{}.{}".format(version, row["checksum"] or "")
 
 
-def select_hosts():
+def select_hosts(after=None, limit=None, prefix=None, states=None, stream=False, lagging=60, sort="fqdn"):
     """
         This returns all hosts known to dart. The result is a dict where the
         key is the fully qualified domain name and the value is another dict
@@ -60,46 +106,91 @@ def select_hosts():
           changes
         * disabled - the number of processes that are disabled
         * assigned - the number of processes that are assigned
+        * telemetry - the last report from the agent about whether it is
+          keeping up with supervisord
+        * lagging - whether the agent got to its last TICK event at least
+          "lagging" seconds late or dropped any events since its last report
+
+        Hosts are returned in order by name or, if "sort" is "lag", with the
+        agents that are furthest behind first. To get one page at a time, give
+        the name of the last host on the previous page as "after" along with a
+        "limit". Only hosts whose name starts with "prefix" are returned if a
+        prefix is given. Only hosts with at least one process in each of the
+        given states are returned if "states" is given. The states are the
+        names of the counts listed above or "lagging". If "stream" is true then rows are
+        fetched from the database in batches as they are consumed rather
+        than all at once.
     """
+    # lagging isn't a count in the summary so it gets its own condition
+    states = list(states or [])
+    conditions, parameters = _filters("h.fqdn", "hs", after, prefix, [x for x in states if x != "lagging"])
+    if ("lagging" in states):
+        conditions.append(LAGGING)
+
+    order = ("(ht.telemetry ->> 'lag')::float DESC NULLS LAST, h.fqdn" if sort == "lag" else "h.fqdn")
     with db_client.conn() as conn:
-        with conn.cursor() as cur:
+        with _cursor(conn, stream) as cur:
+            # the summary is kept up to date by triggers on every table that
+            # it summarizes so there is nothing to count here
             cur.execute("""
                 SELECT
                     h.fqdn,
                     to_char(h.polled, 'YYYY-MM-DD HH24:MI:SS') AS polled,
-                    (SELECT COUNT(*) FROM dart.active_process WHERE fqdn = h.fqdn) AS total,
-                    (SELECT COUNT(*) FROM dart.active_process WHERE fqdn = h.fqdn AND state = 'RUNNING') AS running,
-                    (SELECT COUNT(*) FROM dart.active_process WHERE fqdn = h.fqdn AND state IN ('STOPPED', 'STOPPING', 'EXITED')) AS stopped,
-                    (SELECT COUNT(*) FROM dart.active_process WHERE fqdn = h.fqdn AND state IN ('BACKOFF', 'FATAL', 'UNKNOWN')) AS failed,
-                    (SELECT COUNT(*) FROM dart.pending_process WHERE fqdn = h.fqdn) AS pending,
-                    (SELECT COUNT(*) FROM dart.assignment WHERE fqdn = h.fqdn) AS assigned,
-                    (SELECT COUNT(*) FROM dart.assignment WHERE fqdn = h.fqdn AND disabled IS TRUE) AS disabled
+                    COALESCE(hs.total, 0) AS total,
+                    COALESCE(hs.running, 0) AS running,
+                    COALESCE(hs.stopped, 0) AS stopped,
+                    COALESCE(hs.failed, 0) AS failed,
+                    COALESCE(hs.pending, 0) AS pending,
+                    COALESCE(hs.assigned, 0) AS assigned,
+                    COALESCE(hs.disabled, 0) AS disabled,
+                    ht.telemetry,
+                    {} AS lagging
                 FROM dart.host h
-                ORDER BY h.fqdn
-            """)
+                LEFT OUTER JOIN dart.host_summary hs ON hs.fqdn = h.fqdn
+                LEFT OUTER JOIN dart.host_telemetry ht ON ht.fqdn = h.fqdn
+                WHERE {}
+                ORDER BY {}
+                LIMIT %(limit)s
+            """.format(LAGGING, " AND ".join(conditions), order), dict(parameters, limit=limit, lagging=lagging))
             yield from cur
 
 
-def select_host(fqdn):
+def select_host(fqdn, lagging=60):
     result = None
 
     with db_client.conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 SELECT
-                    fqdn,
-                    to_char(booted, 'YYYY-MM-DD HH24:MI:SS') AS booted,
-                    kernel,
-                    to_char(polled, 'YYYY-MM-DD HH24:MI:SS') AS polled
-                FROM dart.host
-                WHERE fqdn = %s
-            """, (fqdn,))
+                    h.fqdn,
+                    to_char(h.booted, 'YYYY-MM-DD HH24:MI:SS') AS booted,
+                    h.kernel,
+                    to_char(h.polled, 'YYYY-MM-DD HH24:MI:SS') AS polled,
+                    ht.telemetry,
+                    {} AS lagging
+                FROM dart.host h
+                LEFT OUTER JOIN dart.host_telemetry ht ON ht.fqdn = h.fqdn
+                WHERE h.fqdn = %(fqdn)s
+            """.format(LAGGING), {"fqdn": fqdn, "lagging": lagging})
             result = cur.fetchone()
 
         if (result is None):
             return
 
-        result["assignments"] = []
+    # these each check that the host exists again but it is simpler than
+    # having two copies of each query
+    result["assignments"] = select_host_assignments(fqdn) or []
+    result["active"] = select_host_active(fqdn) or []
+    result["pending"] = select_host_pending(fqdn) or []
+
+    return result
+
+
+def select_host_assignments(fqdn):
+    # this is one query so that we can tell the difference between a host
+    # with no assignments and a host that doesn't exist. if the host exists
+    # then there is always at least one row.
+    with db_client.conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 SELECT
@@ -109,23 +200,23 @@ def select_host(fqdn):
                     p.schedule,
                     a.disabled,
                     (pdm.ci IS NOT NULL) AS daemon
-                FROM dart.assignment a
-                INNER JOIN dart.process p                       ON p.name = a.process_name AND p.environment = a.process_environment
+                FROM dart.host h
+                LEFT OUTER JOIN dart.assignment a               ON a.fqdn = h.fqdn
+                LEFT OUTER JOIN dart.process p                  ON p.name = a.process_name AND p.environment = a.process_environment
                 LEFT OUTER JOIN dart.process_daemon_monitor pdm ON pdm.process_name = a.process_name AND pdm.process_environment = a.process_environment
-                WHERE a.fqdn = %s
+                WHERE h.fqdn = %s
                 ORDER BY a.process_name, a.process_environment
             """, (fqdn,))
-            for row in cur:
-                if (row["schedule"] is not None):
-                    try:
-                        crontab = CronTab(row["schedule"])
-                        now = datetime.now()
-                        row["starts"] = (now + timedelta(seconds=(int(crontab.next(default_utc=True)) + 1))).strftime("%Y-%m-%d %H:%M:%S")
-                    except ValueError:
-                        row["starts"] = None
-                result["assignments"].append(row)
-
-        result["active"] = []
+            if (cur.rowcount == 0):
+                return
+
+            return schedules.add_starts([row for row in cur if (row["name"] is not None)])
+
+
+def select_host_active(fqdn):
+    # just like select_host_assignments, one query that returns None if the
+    # host doesn't exist
+    with db_client.conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 SELECT
@@ -137,39 +228,40 @@ def select_host(fqdn):
                     a.disabled,
                     p.schedule,
                     (pdm.ci IS NOT NULL) AS daemon
-                FROM dart.active_process ap
+                FROM dart.host h
+                LEFT OUTER JOIN dart.active_process ap          ON ap.fqdn = h.fqdn
                 LEFT OUTER JOIN dart.assignment a               ON a.process_name = ap.name AND a.fqdn = ap.fqdn
                 LEFT OUTER JOIN dart.process_daemon_monitor pdm ON pdm.process_name = a.process_name AND pdm.process_environment = a.process_environment
                 LEFT OUTER JOIN dart.process p                  ON p.name = a.process_name AND p.environment = a.process_environment
-                WHERE ap.fqdn = %s
+                WHERE h.fqdn = %s
                 ORDER BY ap.name
             """, (fqdn,))
-            for row in cur:
-                if (row["schedule"] is not None):
-                    try:
-                        crontab = CronTab(row["schedule"])
-                        now = datetime.now()
-                        row["starts"] = (now + timedelta(seconds=(int(crontab.next(default_utc=True)) + 1))).strftime("%Y-%m-%d %H:%M:%S")
-                    except ValueError:
-                        row["starts"] = None
-                result["active"].append(row)
-
-        result["pending"] = []
+            if (cur.rowcount == 0):
+                return
+
+            return schedules.add_starts([row for row in cur if (row["name"] is not None)])
+
+
+def select_host_pending(fqdn):
+    # just like select_host_assignments, one query that returns None if the
+    # host doesn't exist
+    with db_client.conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 SELECT
                     p.name,
                     p.state,
                     a.disabled
-                FROM dart.pending_process p
-                LEFT OUTER JOIN dart.assignment a ON a.process_name = p.name AND a.fqdn = p.fqdn
-                WHERE p.fqdn = %s
+                FROM dart.host h
+                LEFT OUTER JOIN dart.pending_process p ON p.fqdn = h.fqdn
+                LEFT OUTER JOIN dart.assignment a      ON a.process_name = p.name AND a.fqdn = p.fqdn
+                WHERE h.fqdn = %s
                 ORDER BY p.name
             """, (fqdn,))
-            for row in cur:
-                result["pending"].append(row)
+            if (cur.rowcount == 0):
+                return
 
-    return result
+            return [row for row in cur if (row["name"] is not None)]
 
 
 def delete_host(fqdn):
@@ -181,19 +273,18 @@ def delete_host(fqdn):
             """, (fqdn,))
 
 
-def select_processes():
+def select_processes(after=None, limit=None, prefix=None, states=None, stream=False):
     """
         This returns all processes known to dart. This includes processed that
         are active whether or not they are configured and those configured
         whether or not they are active as well as those that are pending
         changes on any host. The result is a dict where the key is the name of
         the process and the value is another dict containing a handful of
-        details about the process including: the set of hosts on which the
-        process is active, the set of hosts on which the process has a
-        pending change, the set of hosts on which the process is assigned, as
-        well as the number of hosts on which the process is configured,
-        assigned, disabled, active, failed, or pending changes. Here are some
-        details on specific fields:
+        details about the process including the number of hosts on which the
+        process is configured, assigned, disabled, active, failed, or pending
+        changes. The hosts themselves can be found with
+        select_process_active, select_process_pending, and
+        select_process_assignments. Here are some details on specific fields:
 
         * configured - the number of configurations that this process has
         * assigned - the number of hosts to which this process is assigned
@@ -204,44 +295,36 @@ def select_processes():
           failing
         * pending - the number of hosts on which this process has pending
           configuration changes
+        * unassigned_active - the number of hosts on which this process is
+          active but to which it is not assigned
+        * unassigned_pending - the number of hosts on which this process has
+          pending configuration changes but to which it is not assigned
+
+        Paging and filtering works just like it does for select_hosts except
+        by process name.
     """
+    conditions, parameters = _filters("ps.name", "ps", after, prefix, states)
     with db_client.conn() as conn:
-        with conn.cursor() as cur:
+        with _cursor(conn, stream) as cur:
+            # the summary is kept up to date by triggers on every table that
+            # it summarizes so there is nothing to count here
             cur.execute("""
                 SELECT
-                    p.name,
-                    (SELECT COUNT(*) FROM dart.active_process WHERE name = p.name) AS active,
-                    (SELECT COUNT(*) FROM dart.active_process WHERE name = p.name AND state IN ('BACKOFF', 'FATAL', 'UNKNOWN')) AS failed,
-                    (SELECT COUNT(*) FROM dart.pending_process WHERE name = p.name) AS pending,
-                    (SELECT COUNT(*) FROM dart.assignment WHERE process_name = p.name) AS assigned,
-                    (SELECT COUNT(*) FROM dart.assignment WHERE process_name = p.name AND disabled IS TRUE) AS disabled,
-                    (SELECT COUNT(*) FROM dart.process WHERE name = p.name) AS configured,
-                    array_remove((SELECT array_agg(DISTINCT fqdn) FROM dart.active_process WHERE name = p.name), NULL) AS active_hosts,
-                    array_remove((SELECT array_agg(DISTINCT fqdn) FROM dart.pending_process WHERE name = p.name), NULL) AS pending_hosts,
-                    array_remove((SELECT array_agg(DISTINCT fqdn) FROM dart.assignment WHERE process_name = p.name), NULL) AS assigned_hosts,
-                    array_remove((SELECT array_agg(DISTINCT fqdn) FROM dart.assignment WHERE process_name = p.name AND disabled IS TRUE), NULL) AS disabled_hosts
-                FROM (
-                    SELECT name FROM dart.process
-                    UNION
-                    SELECT name FROM dart.active_process
-                    UNION
-                    SELECT name FROM dart.pending_process
-                ) p
-                GROUP BY p.name
-                ORDER BY p.name
-            """)
-            for row in cur:
-                # if no hosts are returned it will be None and we need them to be lists
-                if (row["active_hosts"] is None):
-                    row["active_hosts"] = []
-                if (row["pending_hosts"] is None):
-                    row["pending_hosts"] = []
-                if (row["assigned_hosts"] is None):
-                    row["assigned_hosts"] = []
-                if (row["disabled_hosts"] is None):
-                    row["disabled_hosts"] = []
-
-                yield row
+                    ps.name,
+                    ps.active,
+                    ps.failed,
+                    ps.pending,
+                    ps.assigned,
+                    ps.disabled,
+                    ps.configured,
+                    ps.unassigned_active,
+                    ps.unassigned_pending
+                FROM dart.process_summary ps
+                WHERE {}
+                ORDER BY ps.name
+                LIMIT %(limit)s
+            """.format(" AND ".join(conditions)), dict(parameters, limit=limit))
+            yield from cur
 
 
 def select_process(name):
@@ -260,15 +343,7 @@ def select_process(name):
                 WHERE name = %s
                 ORDER BY environment
             """, (name,))
-            for row in cur:
-                if (row["schedule"] is not None):
-                    try:
-                        crontab = CronTab(row["schedule"])
-                        now = datetime.now()
-                        row["starts"] = (now + timedelta(seconds=(int(crontab.next(default_utc=True)) + 1))).strftime("%Y-%m-%d %H:%M:%S")
-                    except ValueError:
-                        row["starts"] = None
-                environments.append(row)
+            environments.extend(schedules.add_starts(cur.fetchall()))
 
         # if no configurations then nothing else to do
         if (len(environments) == 0):
@@ -277,80 +352,11 @@ def select_process(name):
         # keep everything in here, this is a dict
         results = {
             "environments": environments,
-            "assignments": [],
-            "active": [],
-            "pending": [],
+            "assignments": select_process_assignments(name) or [],
+            "active": select_process_active(name) or [],
+            "pending": select_process_pending(name) or [],
         }
 
-        # get assignments for this process
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT
-                    a.fqdn,
-                    a.process_environment AS environment,
-                    p.type,
-                    p.schedule,
-                    a.disabled
-                FROM dart.assignment a
-                INNER JOIN dart.process p ON p.name = a.process_name AND p.environment = a.process_environment
-                WHERE a.process_name = %s
-                ORDER BY a.fqdn, a.process_environment
-            """, (name,))
-            for row in cur:
-                if (row["schedule"] is not None):
-                    try:
-                        crontab = CronTab(row["schedule"])
-                        now = datetime.now()
-                        row["starts"] = (now + timedelta(seconds=(int(crontab.next(default_utc=True)) + 1))).strftime("%Y-%m-%d %H:%M:%S")
-                    except ValueError:
-                        row["starts"] = None
-                results["assignments"].append(row)
-
-        # get active instances of this process
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT
-                    ap.fqdn,
-                    ap.name,
-                    p.environment,
-                    ap.state,
-                    ap.description,
-                    ap.error,
-                    a.disabled,
-                    p.schedule,
-                    (pdm.ci IS NOT NULL) AS daemon
-                FROM dart.active_process ap
-                LEFT OUTER JOIN dart.assignment a               ON a.process_name = ap.name AND a.fqdn = ap.fqdn
-                LEFT OUTER JOIN dart.process_daemon_monitor pdm ON pdm.process_name = a.process_name AND pdm.process_environment = a.process_environment
-                LEFT OUTER JOIN dart.process p                  ON p.name = a.process_name AND p.environment = a.process_environment
-                WHERE ap.name = %s
-                ORDER BY ap.fqdn
-            """, (name,))
-            for row in cur:
-                if (row["schedule"] is not None):
-                    try:
-                        crontab = CronTab(row["schedule"])
-                        now = datetime.now()
-                        row["starts"] = (now + timedelta(seconds=(int(crontab.next(default_utc=True)) + 1))).strftime("%Y-%m-%d %H:%M:%S")
-                    except ValueError:
-                        row["starts"] = None
-                results["active"].append(row)
-
-        # get pending instances of this process
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT
-                    p.fqdn,
-                    p.state,
-                    a.disabled
-                FROM dart.pending_process p
-                LEFT OUTER JOIN dart.assignment a ON a.process_name = p.name AND a.fqdn = p.fqdn
-                WHERE p.name = %s
-                ORDER BY p.fqdn
-            """, (name,))
-            for row in cur:
-                results["pending"].append(row)
-
         # get monitoring configurations for each environment
         results["monitoring"] = {}
         for environment in environments:
@@ -444,154 +450,260 @@ def select_process(name):
     return results
 
 
-def delete_process(name, environment=None):
-    if (environment is None):
-        with db_client.conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    DELETE FROM dart.process
-                    WHERE name = %s
-                """, (name,))
-
-    else:
-        with db_client.conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    DELETE FROM dart.process
-                    WHERE name = %s AND environment = %s
-                """, (name, environment))
-
-
-def insert_host_assignment(fqdn, name, environment):
+def select_process_assignments(name):
+    # this is one query so that we can tell the difference between a process
+    # that isn't assigned anywhere and a process that doesn't exist. a process
+    # exists if it has a configuration and then there is always at least one
+    # row.
     with db_client.conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-                INSERT INTO dart.assignment (fqdn, process_name, process_environment)
-                VALUES (%s, %s, %s)
-                ON CONFLICT DO NOTHING
-            """, (fqdn, name, environment))
-
+                SELECT
+                    a.fqdn,
+                    a.process_environment AS environment,
+                    p.type,
+                    p.schedule,
+                    a.disabled
+                FROM dart.process_summary ps
+                LEFT OUTER JOIN dart.assignment a ON a.process_name = ps.name
+                LEFT OUTER JOIN dart.process p    ON p.name = a.process_name AND p.environment = a.process_environment
+                WHERE ps.name = %s
+                  AND ps.configured > 0
+                ORDER BY a.fqdn, a.process_environment
+            """, (name,))
+            if (cur.rowcount == 0):
+                return
 
-def delete_host_assignment(fqdn, name):
-    with db_client.conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                DELETE FROM dart.assignment
-                WHERE fqdn = %s
-                  AND process_name = %s
-            """, (fqdn, name))
+            return schedules.add_starts([row for row in cur if (row["fqdn"] is not None)])
 
 
-def update_process_disabled(fqdn, name, disabled):
+def select_process_active(name):
+    # just like select_process_assignments, one query that returns None if
+    # the process doesn't exist
     with db_client.conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-                UPDATE dart.assignment
-                SET disabled = %s
-                WHERE fqdn = %s
-                  AND process_name = %s
-            """, (disabled, fqdn, name))
+                SELECT
+                    ap.fqdn,
+                    ap.name,
+                    p.environment,
+                    ap.state,
+                    ap.description,
+                    ap.error,
+                    a.disabled,
+                    p.schedule,
+                    (pdm.ci IS NOT NULL) AS daemon
+                FROM dart.process_summary ps
+                LEFT OUTER JOIN dart.active_process ap          ON ap.name = ps.name
+                LEFT OUTER JOIN dart.assignment a               ON a.process_name = ap.name AND a.fqdn = ap.fqdn
+                LEFT OUTER JOIN dart.process_daemon_monitor pdm ON pdm.process_name = a.process_name AND pdm.process_environment = a.process_environment
+                LEFT OUTER JOIN dart.process p                  ON p.name = a.process_name AND p.environment = a.process_environment
+                WHERE ps.name = %s
+                  AND ps.configured > 0
+                ORDER BY ap.fqdn
+            """, (name,))
+            if (cur.rowcount == 0):
+                return
 
+            return schedules.add_starts([row for row in cur if (row["fqdn"] is not None)])
 
-def insert_process(process_name, process_environment, process_type, configuration, schedule):
-    with db_client.conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO dart.process (name, environment, type, configuration, schedule)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (name, environment) DO UPDATE
-                SET configuration = excluded.configuration,
-                    type = excluded.type,
-                    schedule = excluded.schedule
-            """, (process_name, process_environment, process_type, configuration, schedule))
 
-
-def insert_process_state_monitor(process_name, process_environment, ci, severity):
+def select_process_pending(name):
+    # just like select_process_assignments, one query that returns None if
+    # the process doesn't exist
     with db_client.conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-                INSERT INTO dart.process_state_monitor (process_name, process_environment, ci, severity)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (process_name, process_environment) DO UPDATE
-                SET ci = excluded.ci,
-                    severity = excluded.severity
-            """, (process_name, process_environment, json.dumps(ci), severity))
+                SELECT
+                    p.fqdn,
+                    p.state,
+                    a.disabled
+                FROM dart.process_summary ps
+                LEFT OUTER JOIN dart.pending_process p ON p.name = ps.name
+                LEFT OUTER JOIN dart.assignment a      ON a.process_name = p.name AND a.fqdn = p.fqdn
+                WHERE ps.name = %s
+                  AND ps.configured > 0
+                ORDER BY p.fqdn
+            """, (name,))
+            if (cur.rowcount == 0):
+                return
 
+            return [row for row in cur if (row["fqdn"] is not None)]
 
-def delete_process_state_monitor(process_name, process_environment):
-    with db_client.conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                DELETE FROM dart.process_state_monitor
-                WHERE process_name = %s
-                  AND process_environment = %s
-            """, (process_name, process_environment))
 
+def delete_process(name, environment=None):
+    if (environment is None):
+        with db_client.conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM dart.process
+                    WHERE name = %s
+                """, (name,))
 
-def insert_process_daemon_monitor(process_name, process_environment, ci, severity):
-    with db_client.conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO dart.process_daemon_monitor (process_name, process_environment, ci, severity)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (process_name, process_environment) DO UPDATE
-                SET ci = excluded.ci,
-                    severity = excluded.severity
-            """, (process_name, process_environment, json.dumps(ci), severity))
+    else:
+        with db_client.conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM dart.process
+                    WHERE name = %s AND environment = %s
+                """, (name, environment))
 
 
-def delete_process_daemon_monitor(process_name, process_environment):
+def change_assignments(inserts, deletes, updates):
+    # "inserts" is a list of (fqdn, name, environment), "deletes" is a list of
+    # (fqdn, name) and "updates" is a list of (fqdn, name, disabled). deletes
+    # go first so that a process can be removed and added back in a different
+    # environment. always write rows in the same order so that two changes at
+    # the same time can't deadlock each other.
     with db_client.conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                DELETE FROM dart.process_daemon_monitor
-                WHERE process_name = %s
-                  AND process_environment = %s
-            """, (process_name, process_environment))
-
-
-def insert_process_heartbeat_monitor(process_name, process_environment, timeout, ci, severity):
+            if (deletes):
+                deletes = sorted(deletes)
+                cur.execute("""
+                    DELETE FROM dart.assignment
+                    WHERE (fqdn, process_name) IN (
+                        SELECT * FROM unnest(%s::TEXT[], %s::TEXT[])
+                    )
+                """, ([x[0] for x in deletes], [x[1] for x in deletes]))
+
+            if (inserts):
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO dart.assignment (fqdn, process_name, process_environment)
+                    VALUES %s
+                    ON CONFLICT DO NOTHING
+                """, sorted(inserts), page_size=PAGE_SIZE)
+
+            if (updates):
+                updates = sorted(updates)
+                cur.execute("""
+                    UPDATE dart.assignment a
+                    SET disabled = x.disabled
+                    FROM unnest(%s::TEXT[], %s::TEXT[], %s::BOOLEAN[]) AS x (fqdn, process_name, disabled)
+                    WHERE a.fqdn = x.fqdn
+                      AND a.process_name = x.process_name
+                      AND a.disabled IS DISTINCT FROM x.disabled
+                """, ([x[0] for x in updates], [x[1] for x in updates], [x[2] for x in updates]))
+
+
+def select_process_hashes(names):
+    # returns a dict keyed by name and environment. processes that were
+    # registered before we kept hashes have None and so always look changed.
     with db_client.conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
-                INSERT INTO dart.process_heartbeat_monitor (process_name, process_environment, timeout, ci, severity)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (process_name, process_environment) DO UPDATE
-                SET ci = excluded.ci,
-                    severity = excluded.severity
-            """, (process_name, process_environment, timeout, json.dumps(ci), severity))
-
+                SELECT
+                    name,
+                    environment,
+                    content_hash
+                FROM dart.process
+                WHERE name = ANY(%s)
+            """, (names,))
+            return {(row["name"], row["environment"]): row["content_hash"] for row in cur}
 
-def delete_process_heartbeat_monitor(process_name, process_environment):
-    with db_client.conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                DELETE FROM dart.process_heartbeat_monitor
-                WHERE process_name = %s
-                  AND process_environment = %s
-            """, (process_name, process_environment))
 
+def register_processes(processes):
+    # everything here is done with one statement per table no matter how many
+    # processes are given. always write rows in the same order so that two
+    # registrations at the same time can't deadlock each other.
+    processes = sorted(processes, key=lambda x: (x["name"], x["environment"]))
+    names = [x["name"] for x in processes]
+    environments = [x["environment"] for x in processes]
 
-def insert_process_log_monitor(process_name, process_environment, stream, sort_order, regex, stop, name, ci, severity):
-    with db_client.conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO dart.process_log_monitor (process_name, process_environment, stream, sort_order, regex, stop, name, ci, severity)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (process_name, process_environment, stream, sort_order) DO UPDATE
-                SET regex = excluded.regex,
-                    stop = excluded.stop,
-                    name = excluded.name,
-                    ci = excluded.ci,
-                    severity = excluded.severity
-            """, (process_name, process_environment, stream, sort_order, regex, stop, name, json.dumps(ci), severity))
-
-
-def delete_process_log_monitor(process_name, process_environment):
     with db_client.conn() as conn:
         with conn.cursor() as cur:
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO dart.process (name, environment, type, configuration, schedule, content_hash)
+                VALUES %s
+                ON CONFLICT (name, environment) DO UPDATE
+                SET configuration = excluded.configuration,
+                    type = excluded.type,
+                    schedule = excluded.schedule,
+                    content_hash = excluded.content_hash
+            """, [(x["name"], x["environment"], x["type"], x["configuration"], x["schedule"], x["content_hash"]) for x in processes], page_size=PAGE_SIZE)
+
+            # the monitors that only have one configuration per process
+            for monitor, table, columns in [("state", "dart.process_state_monitor", ["ci", "severity"]),
+                                            ("daemon", "dart.process_daemon_monitor", ["ci", "severity"]),
+                                            ("heartbeat", "dart.process_heartbeat_monitor", ["timeout", "ci", "severity"])]:
+                rows = []
+                for process in processes:
+                    if (process[monitor] is not None):
+                        values = dict(process[monitor], ci=json.dumps(process[monitor]["ci"]))
+                        rows.append(tuple([process["name"], process["environment"]] + [values[x] for x in columns]))
+
+                if (rows):
+                    psycopg2.extras.execute_values(cur, """
+                        INSERT INTO {table} (process_name, process_environment, {columns})
+                        VALUES %s
+                        ON CONFLICT (process_name, process_environment) DO UPDATE
+                        SET {updates}
+                    """.format(
+                        table=table,
+                        columns=", ".join(columns),
+                        updates=", ".join("{0} = excluded.{0}".format(x) for x in columns),
+                    ), rows, page_size=PAGE_SIZE)
+
+                # remove the monitor from the processes that no longer have it
+                cur.execute("""
+                    DELETE FROM {}
+                    WHERE (process_name, process_environment) IN (
+                        SELECT * FROM unnest(%s::TEXT[], %s::TEXT[])
+                    )
+                """.format(table), (
+                    [x["name"] for x in processes if (x[monitor] is None)],
+                    [x["environment"] for x in processes if (x[monitor] is None)],
+                ))
+
+            # log monitors are a list for each process
+            rows = []
+            for process in processes:
+                for log in process["logs"]:
+                    rows.append((process["name"], process["environment"], log["stream"], log["sort_order"], log["regex"], log["stop"], log["name"], json.dumps(log["ci"]), log["severity"]))
+
+            if (rows):
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO dart.process_log_monitor (process_name, process_environment, stream, sort_order, regex, stop, name, ci, severity)
+                    VALUES %s
+                    ON CONFLICT (process_name, process_environment, stream, sort_order) DO UPDATE
+                    SET regex = excluded.regex,
+                        stop = excluded.stop,
+                        name = excluded.name,
+                        ci = excluded.ci,
+                        severity = excluded.severity
+                """, rows, page_size=PAGE_SIZE)
+
+            # remove any log monitors beyond the ones that we just wrote
             cur.execute("""
                 DELETE FROM dart.process_log_monitor
-                WHERE process_name = %s
-                  AND process_environment = %s
-            """, (process_name, process_environment))
+                WHERE (process_name, process_environment) IN (
+                    SELECT * FROM unnest(%s::TEXT[], %s::TEXT[])
+                )
+                AND (process_name, process_environment, stream, sort_order) NOT IN (
+                    SELECT * FROM unnest(%s::TEXT[], %s::TEXT[], %s::TEXT[], %s::INTEGER[])
+                )
+            """, (names, environments, [x[0] for x in rows], [x[1] for x in rows], [x[2] for x in rows], [x[3] for x in rows]))
+
+
+def _filters(key, summary, after, prefix, states):
+    # the column names in "states" are checked by the caller. everything else
+    # is passed as a parameter.
+    conditions = ["TRUE"]
+    parameters = {}
+    if (after is not None):
+        conditions.append("{} > %(after)s".format(key))
+        parameters["after"] = after
+    if (prefix):
+        conditions.append("{} LIKE %(prefix)s".format(key))
+        parameters["prefix"] = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    for state in (states or []):
+        conditions.append("COALESCE({}.{}, 0) > 0".format(summary, state))
+    return conditions, parameters
+
+
+def _cursor(conn, stream):
+    # a named cursor is a server side cursor so rows are fetched in batches as
+    # they are consumed instead of all at once. it only works inside of a
+    # transaction.
+    if (stream):
+        return conn.cursor(name="stream_{}".format(uuid.uuid4().hex))
+    return conn.cursor()
@@ -1,66 +1,90 @@
 from ....app import logger
 from ....app import db_client
+from ....app import single_flight
+from ....app import coordinator
+from ....app import settings_manager
 from ....validators import validate_json_data
+from .... import schedules
+from ....schedules import get_now as schedules_now
 from . import v1
 from . import queries as q
-from flask import jsonify, make_response, request
+from flask import jsonify, make_response, request, json, Response, stream_with_context
 from flask_login import login_required, current_user
-from werkzeug.exceptions import BadRequest, NotFound
-from crontab import CronTab
+from werkzeug.exceptions import HTTPException, BadRequest, NotFound
+import urllib.parse
+import hashlib
 import re
 
 
+# the columns that hosts and processes can be filtered on using "state"
+HOST_STATES = ["total", "running", "stopped", "failed", "pending", "assigned", "disabled", "lagging"]
+PROCESS_STATES = ["active", "failed", "pending", "assigned", "disabled", "configured"]
+
+
 @v1.route("/hosts", methods=["GET"])
 @login_required
 def hosts():
-    conn = None
-    try:
-        conn = db_client.conn()
-        conn.autocommit = False
-        hosts = list(q.select_hosts())
-        conn.commit()
+    filters = _get_filters(HOST_STATES)
 
-        return make_response(jsonify(hosts), 200)
-    except Exception as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        raise e
-    finally:
-        try:
-            conn.autocommit = True
-        except Exception:
-            pass
+    # hosts can also be listed with the agents that are furthest behind
+    # first. they can't be paged by name then so they can only be limited.
+    filters["sort"] = request.args.get("sort", "fqdn")
+    if (filters["sort"] not in ["fqdn", "lag"]):
+        raise BadRequest("The sort must be one of: fqdn, lag")
+    if (filters["sort"] == "lag" and filters["after"] is not None):
+        raise BadRequest("Hosts sorted by lag cannot be paged with after.")
+    filters["lagging"] = _get_lagging()
+
+    streaming = _is_streaming()
+    etag = _get_etag("host", lagging=filters["lagging"], streaming=streaming)
+    if (request.if_none_match.contains_weak(etag)):
+        return _not_modified(etag)
+
+    if (streaming):
+        return _stream(q.select_hosts, filters, etag)
+
+    hosts = single_flight.do(_get_flight_key(etag), _read, lambda: list(q.select_hosts(**filters)))
+    response = make_response(jsonify(hosts), 200)
+    response.set_etag(etag)
+    if (filters["sort"] != "fqdn"):
+        return response
+    return _paginate(response, hosts, "fqdn", filters)
 
 
 @v1.route("/hosts/<fqdn>", methods=["GET"])
 @login_required
 def host(fqdn):
-    conn = None
-    try:
-        conn = db_client.conn()
-        conn.autocommit = False
+    lagging = _get_lagging()
+    etag = _get_etag("host", fqdn, schedules=True, lagging=lagging)
+    if (request.if_none_match.contains_weak(etag)):
+        return _not_modified(etag)
 
-        host = q.select_host(fqdn)
-        if (host is None):
-            logger.warning("could not get host {} because it was not found".format(fqdn))
-            raise NotFound("No host found with the fully qualified domain name {}.".format(fqdn))
+    host = single_flight.do(_get_flight_key(etag), _read, q.select_host, fqdn, lagging)
+    if (host is None):
+        logger.warning("could not get host {} because it was not found".format(fqdn))
+        raise NotFound("No host found with the fully qualified domain name {}.".format(fqdn))
 
-        conn.commit()
+    response = make_response(jsonify(host), 200)
+    response.set_etag(etag)
+    return response
 
-        return make_response(jsonify(host), 200)
-    except Exception as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        raise e
-    finally:
-        try:
-            conn.autocommit = True
-        except Exception:
-            pass
+
+@v1.route("/hosts/<fqdn>/active", methods=["GET"])
+@login_required
+def host_active(fqdn):
+    return _host_part(fqdn, q.select_host_active)
+
+
+@v1.route("/hosts/<fqdn>/pending", methods=["GET"])
+@login_required
+def host_pending(fqdn):
+    return _host_part(fqdn, q.select_host_pending)
+
+
+@v1.route("/hosts/<fqdn>/assignments", methods=["GET"])
+@login_required
+def host_assignments(fqdn):
+    return _host_part(fqdn, q.select_host_assignments)
 
 
 @v1.route("/hosts/<fqdn>", methods=["DELETE"])
@@ -102,54 +126,54 @@ def delete_host(fqdn):
 @v1.route("/processes", methods=["GET"])
 @login_required
 def processes():
-    conn = None
-    try:
-        conn = db_client.conn()
-        conn.autocommit = False
-        processes = list(q.select_processes())
-        conn.commit()
+    filters = _get_filters(PROCESS_STATES)
+    streaming = _is_streaming()
+    etag = _get_etag("process", streaming=streaming)
+    if (request.if_none_match.contains_weak(etag)):
+        return _not_modified(etag)
 
-        return make_response(jsonify(processes), 200)
-    except Exception as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        raise e
-    finally:
-        try:
-            conn.autocommit = True
-        except Exception:
-            pass
+    if (streaming):
+        return _stream(q.select_processes, filters, etag)
+
+    processes = single_flight.do(_get_flight_key(etag), _read, lambda: list(q.select_processes(**filters)))
+    response = make_response(jsonify(processes), 200)
+    response.set_etag(etag)
+    return _paginate(response, processes, "name", filters)
 
 
 @v1.route("/processes/<name>", methods=["GET"])
 @login_required
 def process(name):
-    conn = None
-    try:
-        conn = db_client.conn()
-        conn.autocommit = False
+    etag = _get_etag("process", name, schedules=True)
+    if (request.if_none_match.contains_weak(etag)):
+        return _not_modified(etag)
 
-        process = q.select_process(name)
-        if (process is None):
-            logger.warning("could not get process {} because it was not found".format(name))
-            raise NotFound("No process found with the name {}.".format(name))
+    process = single_flight.do(_get_flight_key(etag), _read, q.select_process, name)
+    if (process is None):
+        logger.warning("could not get process {} because it was not found".format(name))
+        raise NotFound("No process found with the name {}.".format(name))
 
-        conn.commit()
+    response = make_response(jsonify(process), 200)
+    response.set_etag(etag)
+    return response
 
-        return make_response(jsonify(process), 200)
-    except Exception as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        raise e
-    finally:
-        try:
-            conn.autocommit = True
-        except Exception:
-            pass
+
+@v1.route("/processes/<name>/hosts/active", methods=["GET"])
+@login_required
+def process_active(name):
+    return _process_part(name, q.select_process_active)
+
+
+@v1.route("/processes/<name>/hosts/pending", methods=["GET"])
+@login_required
+def process_pending(name):
+    return _process_part(name, q.select_process_pending)
+
+
+@v1.route("/processes/<name>/hosts/assignments", methods=["GET"])
+@login_required
+def process_assignments(name):
+    return _process_part(name, q.select_process_assignments)
 
 
 @v1.route("/processes/<name>", methods=["DELETE"])
@@ -201,7 +225,7 @@ def delete_process(name, environment=None):
             pass
 
 
-# assign or unassign a process from a host
+# assign or unassign processes from a host
 @v1.route("/hosts/<fqdn>", methods=["PATCH"])
 @login_required
 @validate_json_data
@@ -213,75 +237,25 @@ def change_host(fqdn):
     # to help with debugging
     logger.debug("received host change request from {}: {}".format(current_user.source, data))
 
+    # this might be one operation or a list of them
+    batch, operations = _get_operations(data, "host {}".format(fqdn))
+    changes = [_parse_operation(_parse_host_operation, fqdn, x) for x in operations]
+
     conn = None
     try:
         conn = db_client.conn()
         conn.autocommit = False
 
+        # check every host and process that we were given all at once
+        known = q.select_known([fqdn] + [x["fqdn"] for x in changes if ("error" not in x)], [x["name"] for x in changes if ("error" not in x)])
+
         # make sure the host is valid
-        if (not q.is_valid_host(fqdn)):
+        if (fqdn not in known["hosts"]):
             logger.warning("could not change host {} because it was not found".format(fqdn))
             raise NotFound("No host found with the fully qualified domain name {}.".format(fqdn))
 
-        # we need all of these fields
-        if ("op" not in data or "path" not in data or "value" not in data):
-            logger.warning("could not change host {} because the patch data was missing fields".format(fqdn))
-            raise BadRequest("Invalid PATCH data. Must include fields 'op', 'path', and 'value'.")
-
-        # make sure the fields look good
-        if (data["op"] is None or not isinstance(data["op"], str) or not data["op"].strip() or data["op"] not in ["add", "remove"]):
-            logger.warning("could not change host {} because the operation value was invalid: {}".format(fqdn, data["op"]))
-            raise BadRequest("Invalid PATCH data. The 'op' field must be either 'add' or 'remove'.")
-        if (data["path"] is None or not isinstance(data["path"], str) or not data["path"].strip()):
-            logger.warning("could not change host {} because the path was invalid: {}".format(fqdn, data["path"]))
-            raise BadRequest("Invalid PATCH data. The 'path' field must contain a valid path to patch.")
-        if (data["value"] is None or not isinstance(data["value"], dict)):
-            logger.warning("could not change host {} because the value was invalid: {}".format(fqdn, data["value"]))
-            raise BadRequest("Invalid PATCH data. The 'value' field must contain data to patch.")
-
-        # we only support patching the assignments array
-        if (data["path"] != "/assignments"):
-            logger.warning("could not change host {} because the path was not supported: {}".format(fqdn, data["path"]))
-            raise BadRequest("Unable to PATCH the path {}.".format(data["path"]))
-
-        if (data["op"] == "add"):
-            value = data["value"]
-            process_name = value.get("name")
-            process_environment = value.get("environment")
-
-            if (process_name is None or not isinstance(process_name, str) or not process_name.strip()):
-                logger.warning("could not add process to host {} because either the process name was missing".format(fqdn))
-                raise BadRequest("No process name given.")
-            if (process_environment is None or not isinstance(process_environment, str) or not process_environment.strip()):
-                logger.warning("could not add process to host {} because either the process environment was missing".format(fqdn))
-                raise BadRequest("No process environment given.")
-
-            # make sure this is a valid process
-            if (not q.is_valid_process(process_name, process_environment)):
-                logger.warning("could not add process to host {} because no process was found with the name {} and environment {}".format(fqdn, process_name, process_environment))
-                raise NotFound("No process found named {} with the environment {}.".format(process_name, process_environment))
-
-            q.insert_host_assignment(fqdn, process_name, process_environment)
-        elif (data["op"] == "remove"):
-            value = data["value"]
-            process_name = value.get("name")
-
-            if (process_name is None or not process_name):
-                logger.warning("could not add process to host {} because either the process name was missing".format(fqdn))
-                raise BadRequest("No process name given.")
-
-            # make sure this is a valid process
-            if (not q.is_valid_process(process_name)):
-                logger.warning("could not remove process from host {} because no process was found with the name {}".format(fqdn, process_name))
-                raise NotFound("No process found named {}.".format(process_name))
-
-            q.delete_host_assignment(fqdn, process_name)
-        else:
-            raise BadRequest("Unable to execute PATCH operation {} against {}.".format(data["op"], data["path"]))
-
+        response = _change_assignments(batch, changes, known)
         conn.commit()
-
-        return make_response(jsonify({}), 200)
     except Exception as e:
         try:
             conn.rollback()
@@ -294,8 +268,10 @@ def change_host(fqdn):
         except Exception:
             pass
 
+    return _send_rewrites(batch, changes, response)
+
 
-# enable or disable a process on a host
+# assign, unassign, enable or disable a process on hosts
 @v1.route("/processes/<name>", methods=["PATCH"])
 @login_required
 @validate_json_data
@@ -307,70 +283,25 @@ def change_process(name):
     # to help with debugging
     logger.debug("received process change request from {}: {}".format(current_user.source, data))
 
+    # this might be one operation or a list of them
+    batch, operations = _get_operations(data, "process {}".format(name))
+    changes = [_parse_operation(_parse_process_operation, name, x) for x in operations]
+
     conn = None
     try:
         conn = db_client.conn()
         conn.autocommit = False
 
+        # check every host and process that we were given all at once
+        known = q.select_known([x["fqdn"] for x in changes if ("error" not in x)], [name])
+
         # make sure the process is valid
-        if (not q.is_valid_process(name)):
+        if (name not in known["names"]):
             logger.warning("could not change the process {} because it was not found".format(name))
             raise NotFound("No process found with the name {}.".format(name))
 
-        # we need all of these fields
-        if ("op" not in data or "path" not in data or "value" not in data):
-            logger.warning("could not change process {} because the patch data was missing fields".format(name))
-            raise BadRequest("Invalid PATCH data. Must include fields 'op', 'path', and 'value'.")
-
-        # make sure the fields look good
-        if (data["op"] is None or not isinstance(data["op"], str) or not data["op"].strip() or data["op"] not in ["replace"]):
-            logger.warning("could not change process {} because the operation value was invalid: {}".format(name, data["op"]))
-            raise BadRequest("Invalid PATCH data. The 'op' field must be 'replace'.")
-        if (data["path"] is None or not isinstance(data["path"], str) or not data["path"].strip()):
-            logger.warning("could not change process {} because the path was invalid: {}".format(name, data["path"]))
-            raise BadRequest("Invalid PATCH data. The 'path' field must contain a valid path to patch.")
-        if (data["value"] is None or not isinstance(data["value"], dict)):
-            logger.warning("could not change process {} because the value was invalid: {}".format(name, data["value"]))
-            raise BadRequest("Invalid PATCH data. The 'value' field must contain data to patch.")
-
-        # we only support patching the assignments array
-        if (data["path"] != "/assignments"):
-            logger.warning("could not change process {} because the path was not supported: {}".format(name, data["path"]))
-            raise BadRequest("Unable to PATCH {}.".format(data["path"]))
-
-        # we only support the "replace" operation
-        if (data["op"] == "replace"):
-            value = data["value"]
-            fqdn = value.get("fqdn")
-            disabled = value.get("disabled")
-
-            if (fqdn is None or not isinstance(fqdn, str) or not fqdn.strip()):
-                logger.warning("could not update process {} because the fqdn was missing".format(name))
-                raise BadRequest("No fully qualified domain name given.")
-
-            # make sure this is a valid fqdn
-            if (not q.is_valid_host(fqdn)):
-                logger.warning("could not update process {} because no host was found with the fqdn {}".format(name, fqdn))
-                raise NotFound("No host found with the fully qualified domain name {}.".format(fqdn))
-
-            # make sure our boolean is valid
-            if (disabled is None):
-                logger.warning("could not update process {} on {} because the value for disabled was invalid: {}".format(name, fqdn, disabled))
-                raise NotFound("Invalid PATCH data. A value for disabled must be given.")
-
-            # now convert it to a string and evaluate it
-            disabled = str(disabled).strip().lower()
-            if (disabled not in ["yes", "true", "no", "false"]):
-                logger.warning("could not update process {} on {} because the value for disabled was invalid: {}".format(name, fqdn, disabled))
-                raise NotFound("Invalid PATCH data. The value for disabled must be either 'yes', 'no', 'true', or 'false'.")
-
-            q.update_process_disabled(fqdn, name, disabled in ["yes", "true"])
-        else:
-            raise BadRequest("Unable to execute PATCH operation {} against {}.".format(data["op"], data["path"]))
-
+        response = _change_assignments(batch, changes, known)
         conn.commit()
-
-        return make_response(jsonify({}), 200)
     except Exception as e:
         try:
             conn.rollback()
@@ -383,6 +314,8 @@ def change_process(name):
         except Exception:
             pass
 
+    return _send_rewrites(batch, changes, response)
+
 
 @v1.route("/register", methods=["POST"])
 @login_required
@@ -395,26 +328,64 @@ def register():
     # to help with debugging
     logger.debug("received registration request from {}: {}".format(current_user.source, data))
 
+    # if this is a dry run then we say what we would change but change nothing
+    dry_run = (request.args.get("dry_run", "").lower() in ["1", "true", "yes"])
+
+    # validate everything before touching the database. if a process is
+    # listed more than once then the last one wins.
+    registrations = {}
+    processes = data.get("processes")
+    if (processes is not None):
+        if (not isinstance(processes, list)):
+            raise BadRequest("Processes must be provided as a list.")
+
+        for index, process in enumerate(processes):
+            process = validate_process(process, index + 1)
+            registrations[(process["name"], process["environment"])] = process
+
     conn = None
     try:
         conn = db_client.conn()
         conn.autocommit = False
 
+        # only write the processes whose configurations actually changed. if
+        # we rewrite everything then every host will think that its
+        # configuration changed, too.
+        hashes = q.select_process_hashes(list(set(x[0] for x in registrations)))
         registered = []
-        processes = data.get("processes")
-        if (processes is not None):
-            if (not isinstance(processes, list)):
-                raise BadRequest("Processes must be provided as a list.")
-
-            # add all of the processes back
-            for index, process in enumerate(processes):
-                registered += register_process(process, index + 1)
+        changes = []
+        for key, process in registrations.items():
+            if (key not in hashes):
+                status = "added"
+            elif (hashes[key] != process["content_hash"]):
+                status = "changed"
+            else:
+                status = "unchanged"
+
+            if (status != "unchanged"):
+                changes.append(process)
+
+            registered.append({
+                "name": process["name"],
+                "environment": process["environment"],
+                "type": process["type"],
+                "status": status,
+            })
+
+        if (changes and not dry_run):
+            q.register_processes(changes)
 
         # clean up the transaction
         conn.commit()
 
-        # return only that we succeeded
-        return make_response(jsonify({"registered": registered}), 200)
+        # return what we did or would have done
+        return make_response(jsonify({
+            "registered": registered,
+            "added": len([x for x in registered if (x["status"] == "added")]),
+            "changed": len([x for x in registered if (x["status"] == "changed")]),
+            "unchanged": len([x for x in registered if (x["status"] == "unchanged")]),
+            "dry_run": dry_run,
+        }), 200)
     except Exception as e:
         try:
             conn.rollback()
@@ -428,8 +399,9 @@ def register():
             pass
 
 
-def register_process(data, sort_order):
-    registered = []
+def validate_process(data, sort_order):
+    if (not isinstance(data, dict)):
+        raise BadRequest("The number {} process in the list is not a dictionary.".format(sort_order))
 
     # get the pieces that we need and validate some things as soon as possible
     process_name = data.get("name")
@@ -449,18 +421,20 @@ def register_process(data, sort_order):
 
     # validate the schedule
     if (schedule is not None):
-        try:
-            CronTab(schedule)
-        except ValueError:
+        if (not schedules.is_valid(schedule)):
             raise BadRequest("The schedule for '{}' in '{}' is not valid: {}".format(process_name, process_environment, schedule))
 
-    # update the database with the new process details
-    q.insert_process(process_name, process_environment, process_type, supervisor, schedule)
-    registered.append({
+    process = {
         "name": process_name,
         "environment": process_environment,
         "type": process_type,
-    })
+        "configuration": supervisor,
+        "schedule": schedule,
+        "state": None,
+        "daemon": None,
+        "heartbeat": None,
+        "logs": [],
+    }
 
     monitors = data.get("monitoring", dict())
     default_ci = monitors.get("ci")
@@ -473,21 +447,17 @@ def register_process(data, sort_order):
         try:
             ci = validate_ci(state_monitor.get("ci", default_ci))
             severity = validate_severity(state_monitor.get("severity"))
-            q.insert_process_state_monitor(process_name, process_environment, ci, severity)
+            process["state"] = {"ci": ci, "severity": severity}
         except BadRequest as e:
             raise BadRequest("The state monitoring configuration for '{}' in '{}' is not valid: {}.".format(process_name, process_environment, e))
-    else:
-        q.delete_process_state_monitor(process_name, process_environment)
 
     if (daemon_monitor is not None):
         try:
             ci = validate_ci(daemon_monitor.get("ci", default_ci))
             severity = validate_severity(daemon_monitor.get("severity"))
-            q.insert_process_daemon_monitor(process_name, process_environment, ci, severity)
+            process["daemon"] = {"ci": ci, "severity": severity}
         except BadRequest as e:
             raise BadRequest("The daemon monitoring configuration for '{}' in '{}' is not valid: {}.".format(process_name, process_environment, e))
-    else:
-        q.delete_process_daemon_monitor(process_name, process_environment)
 
     if (heartbeat_monitor is not None):
         try:
@@ -499,16 +469,14 @@ def register_process(data, sort_order):
                 raise BadRequest("missing timeout")
             try:
                 timeout = int(timeout)
-            except TypeError:
+            except (TypeError, ValueError):
                 raise BadRequest("timeout is invalid")
             if (timeout < 1 or timeout > 10080):
                 raise BadRequest("timeout must be at least one minute and no longer than one week")
 
-            q.insert_process_heartbeat_monitor(process_name, process_environment, timeout, ci, severity)
+            process["heartbeat"] = {"timeout": timeout, "ci": ci, "severity": severity}
         except BadRequest as e:
             raise BadRequest("The heartbeat monitoring configuration for '{}' in '{}' is not valid: {}.".format(process_name, process_environment, e))
-    else:
-        q.delete_process_heartbeat_monitor(process_name, process_environment)
 
     if (log_monitor is not None):
         try:
@@ -539,13 +507,22 @@ def register_process(data, sort_order):
                     # missing or set to anything else then false
                     stop = (stop is not None and str(stop).lower() in ["yes", "true", "on", "1"])
 
-                    q.insert_process_log_monitor(process_name, process_environment, stream, index, regex, stop, name, ci, severity)
+                    process["logs"].append({
+                        "stream": stream,
+                        "sort_order": index,
+                        "regex": regex,
+                        "stop": stop,
+                        "name": name,
+                        "ci": ci,
+                        "severity": severity,
+                    })
         except BadRequest as e:
             raise BadRequest("The log monitoring configuration for '{}' in '{}' is not valid: {}.".format(process_name, process_environment, e))
-    else:
-        q.delete_process_log_monitor(process_name, process_environment)
 
-    return registered
+    # this is how we tell if anything changed since the last registration
+    process["content_hash"] = hashlib.sha256(json.dumps(process, sort_keys=True).encode("utf8")).hexdigest()
+
+    return process
 
 
 def validate_ci(ci):
@@ -570,3 +547,374 @@ def validate_severity(severity):
     if (severity not in ["1", "2", "3", "4", "5", "OK"]):
         raise BadRequest("severity must be either 1, 2, 3, 4, 5, or OK")
     return severity
+
+
+def _get_operations(data, subject):
+    # a patch is either one operation or a list of them. a list is checked
+    # and applied all at once and gets a result for each operation.
+    if (not isinstance(data, list)):
+        return False, [data]
+
+    if (not data):
+        logger.warning("could not change {} because the patch data was an empty list".format(subject))
+        raise BadRequest("Invalid PATCH data. No operations given.")
+
+    return True, data
+
+
+def _parse_operation(parse, target, data):
+    # problems with one operation in a list shouldn't hide problems with the
+    # others so we hang on to the error and carry on
+    try:
+        return parse(target, data)
+    except HTTPException as e:
+        return {"error": e}
+
+
+def _check_operation(data, subject, ops):
+    # we need an object for each operation
+    if (not isinstance(data, dict)):
+        logger.warning("could not change {} because the patch data was not an object".format(subject))
+        raise BadRequest("Invalid PATCH data. Each operation must be an object.")
+
+    # we need all of these fields
+    if ("op" not in data or "path" not in data or "value" not in data):
+        logger.warning("could not change {} because the patch data was missing fields".format(subject))
+        raise BadRequest("Invalid PATCH data. Must include fields 'op', 'path', and 'value'.")
+
+    # make sure the fields look good
+    if (data["op"] is None or not isinstance(data["op"], str) or not data["op"].strip() or data["op"] not in ops):
+        logger.warning("could not change {} because the operation value was invalid: {}".format(subject, data["op"]))
+        raise BadRequest("Invalid PATCH data. The 'op' field must be one of {}.".format(", ".join("'{}'".format(x) for x in ops)))
+    if (data["path"] is None or not isinstance(data["path"], str) or not data["path"].strip()):
+        logger.warning("could not change {} because the path was invalid: {}".format(subject, data["path"]))
+        raise BadRequest("Invalid PATCH data. The 'path' field must contain a valid path to patch.")
+    if (data["value"] is None or not isinstance(data["value"], dict)):
+        logger.warning("could not change {} because the value was invalid: {}".format(subject, data["value"]))
+        raise BadRequest("Invalid PATCH data. The 'value' field must contain data to patch.")
+
+    # we only support patching the assignments array
+    if (data["path"] != "/assignments"):
+        logger.warning("could not change {} because the path was not supported: {}".format(subject, data["path"]))
+        raise BadRequest("Unable to PATCH the path {}.".format(data["path"]))
+
+
+def _parse_host_operation(fqdn, data):
+    _check_operation(data, "host {}".format(fqdn), ["add", "remove"])
+
+    value = data["value"]
+    process_name = value.get("name")
+    if (process_name is None or not isinstance(process_name, str) or not process_name.strip()):
+        logger.warning("could not change host {} because the process name was missing".format(fqdn))
+        raise BadRequest("No process name given.")
+
+    if (data["op"] == "add"):
+        process_environment = value.get("environment")
+        if (process_environment is None or not isinstance(process_environment, str) or not process_environment.strip()):
+            logger.warning("could not add process to host {} because the process environment was missing".format(fqdn))
+            raise BadRequest("No process environment given.")
+
+        return {"op": "add", "fqdn": fqdn, "name": process_name, "environment": process_environment}
+
+    return {"op": "remove", "fqdn": fqdn, "name": process_name}
+
+
+def _parse_process_operation(name, data):
+    _check_operation(data, "process {}".format(name), ["add", "remove", "replace"])
+
+    value = data["value"]
+    fqdn = value.get("fqdn")
+    if (fqdn is None or not isinstance(fqdn, str) or not fqdn.strip()):
+        logger.warning("could not change process {} because the fqdn was missing".format(name))
+        raise BadRequest("No fully qualified domain name given.")
+
+    if (data["op"] == "add"):
+        process_environment = value.get("environment")
+        if (process_environment is None or not isinstance(process_environment, str) or not process_environment.strip()):
+            logger.warning("could not add process {} to {} because the process environment was missing".format(name, fqdn))
+            raise BadRequest("No process environment given.")
+
+        return {"op": "add", "fqdn": fqdn, "name": name, "environment": process_environment}
+
+    if (data["op"] == "remove"):
+        return {"op": "remove", "fqdn": fqdn, "name": name}
+
+    # make sure our boolean is valid
+    disabled = value.get("disabled")
+    if (disabled is None):
+        logger.warning("could not update process {} on {} because the value for disabled was invalid: {}".format(name, fqdn, disabled))
+        raise NotFound("Invalid PATCH data. A value for disabled must be given.")
+
+    # now convert it to a string and evaluate it
+    disabled = str(disabled).strip().lower()
+    if (disabled not in ["yes", "true", "no", "false"]):
+        logger.warning("could not update process {} on {} because the value for disabled was invalid: {}".format(name, fqdn, disabled))
+        raise NotFound("Invalid PATCH data. The value for disabled must be either 'yes', 'no', 'true', or 'false'.")
+
+    return {"op": "replace", "fqdn": fqdn, "name": name, "disabled": disabled in ["yes", "true"]}
+
+
+def _check_change(change, known):
+    # make sure everything that the operation refers to exists
+    if (change["fqdn"] not in known["hosts"]):
+        logger.warning("could not change process {} on {} because no host was found with that fqdn".format(change["name"], change["fqdn"]))
+        raise NotFound("No host found with the fully qualified domain name {}.".format(change["fqdn"]))
+
+    if (change["op"] == "add"):
+        if ((change["name"], change["environment"]) not in known["processes"]):
+            logger.warning("could not add process to host {} because no process was found with the name {} and environment {}".format(change["fqdn"], change["name"], change["environment"]))
+            raise NotFound("No process found named {} with the environment {}.".format(change["name"], change["environment"]))
+    elif (change["name"] not in known["names"]):
+        logger.warning("could not change process {} on {} because no process was found with that name".format(change["name"], change["fqdn"]))
+        raise NotFound("No process found named {}.".format(change["name"]))
+
+
+def _change_assignments(batch, changes, known):
+    for change in changes:
+        if ("error" not in change):
+            try:
+                _check_change(change, known)
+            except HTTPException as e:
+                change["error"] = e
+
+    errors = [x["error"] for x in changes if ("error" in x)]
+    if (errors):
+        # a single operation fails the same way that it always has
+        if (not batch):
+            raise errors[0]
+
+        # otherwise nothing is applied and the caller gets to see what was
+        # wrong with every operation. there is nothing to roll back.
+        code = min(x.code for x in errors)
+        return make_response(jsonify({
+            "code": code,
+            "message": "No changes were made because {} of {} operations could not be applied.".format(len(errors), len(changes)),
+            "results": _get_results(changes),
+        }), code)
+
+    # operations are applied in order so the last one for each assignment
+    # wins. a removal followed by an addition needs to do both.
+    inserts, deletes, updates = {}, set(), {}
+    for change in changes:
+        key = (change["fqdn"], change["name"])
+        if (change["op"] == "add"):
+            inserts[key] = change["environment"]
+        elif (change["op"] == "remove"):
+            inserts.pop(key, None)
+            updates.pop(key, None)
+            deletes.add(key)
+        else:
+            updates[key] = change["disabled"]
+
+    q.change_assignments(
+        [k + (v,) for k, v in inserts.items()],
+        list(deletes),
+        [k + (v,) for k, v in updates.items()],
+    )
+
+
+def _send_rewrites(batch, changes, response):
+    if (response is not None):
+        return response
+
+    # a single operation leaves the rewrite to the caller like it always has
+    if (not batch):
+        return make_response(jsonify({}), 200)
+
+    # tell every host that we changed to rewrite its configuration. this
+    # happens after the changes are committed so that the hosts see them.
+    # the commands are sent in the background and the caller gets their ids.
+    rewrites = coordinator.submit_all([(x, "rewrite", None) for x in sorted(set(x["fqdn"] for x in changes))])
+    return make_response(jsonify({
+        "results": _get_results(changes),
+        "rewrites": [x.to_dict() for x in rewrites],
+    }), 200)
+
+
+def _get_results(changes):
+    results = []
+    for index, change in enumerate(changes):
+        if ("error" in change):
+            results.append({"index": index, "code": change["error"].code, "message": change["error"].description})
+        else:
+            results.append({"index": index, "code": 200, "message": None})
+    return results
+
+
+def _get_filters(states):
+    # the list endpoints take these optional arguments:
+    #   limit - the most results to return
+    #   after - only return results whose names sort after this one
+    #   prefix - only return results whose names start with this
+    #   state - only return results with something in this state, may repeat
+    #   failed - shortcut for state=failed
+    #   pending - shortcut for state=pending
+    limit = request.args.get("limit")
+    if (limit is not None):
+        try:
+            limit = int(limit)
+            if (limit < 1):
+                raise ValueError(limit)
+        except ValueError:
+            raise BadRequest("The limit must be a positive integer.")
+
+    selected = []
+    for state in request.args.getlist("state"):
+        if (state not in states):
+            raise BadRequest("The state must be one of: {}".format(", ".join(states)))
+        selected.append(state)
+    for state in ["failed", "pending"]:
+        if (request.args.get(state, "").lower() in ["1", "true", "yes"]):
+            selected.append(state)
+
+    return {
+        "after": request.args.get("after"),
+        "limit": limit,
+        "prefix": request.args.get("prefix"),
+        "states": selected,
+    }
+
+
+def _get_lagging():
+    # how many seconds behind supervisord an agent can be before it is lagging
+    return float(settings_manager.get("api.telemetry.lagging", 60))
+
+
+def _is_streaming():
+    # clients can ask for newline delimited json either with an argument or
+    # with an accept header
+    if (request.args.get("format") == "ndjson"):
+        return True
+    return (request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson")
+
+
+def _stream(select, filters, etag):
+    # write one json document per line as the rows come out of the database.
+    # the transaction has to live inside of the generator because the
+    # generator doesn't run until after this function returns.
+    def generate():
+        conn = None
+        try:
+            conn = db_client.conn()
+            conn.autocommit = False
+            for row in select(stream=True, **filters):
+                yield json.dumps(row) + "\n"
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise e
+        finally:
+            try:
+                conn.autocommit = True
+            except Exception:
+                pass
+
+    response = Response(stream_with_context(generate()), 200, mimetype="application/x-ndjson")
+    response.set_etag(etag)
+    return response
+
+
+def _host_part(fqdn, select):
+    # parts of a host change whenever the host does
+    etag = _get_etag("host", fqdn, schedules=True)
+    if (request.if_none_match.contains_weak(etag)):
+        return _not_modified(etag)
+
+    results = single_flight.do(_get_flight_key(etag), _read, select, fqdn)
+    if (results is None):
+        logger.warning("could not get host {} because it was not found".format(fqdn))
+        raise NotFound("No host found with the fully qualified domain name {}.".format(fqdn))
+
+    response = make_response(jsonify(results), 200)
+    response.set_etag(etag)
+    return response
+
+
+def _process_part(name, select):
+    # parts of a process change whenever the process does
+    etag = _get_etag("process", name, schedules=True)
+    if (request.if_none_match.contains_weak(etag)):
+        return _not_modified(etag)
+
+    results = single_flight.do(_get_flight_key(etag), _read, select, name)
+    if (results is None):
+        logger.warning("could not get process {} because it was not found".format(name))
+        raise NotFound("No process found with the name {}.".format(name))
+
+    response = make_response(jsonify(results), 200)
+    response.set_etag(etag)
+    return response
+
+
+def _read(select, *args, **kwargs):
+    conn = None
+    try:
+        conn = db_client.conn()
+        conn.autocommit = False
+        result = select(*args, **kwargs)
+        conn.commit()
+
+        return result
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise e
+    finally:
+        try:
+            conn.autocommit = True
+        except Exception:
+            pass
+
+
+def _get_flight_key(etag):
+    # requests for the same thing can share one trip to the database. the tag
+    # is part of the key so that a request never gets data that is older than
+    # the version that it is about to tag it with.
+    arguments = urllib.parse.urlencode(sorted(request.args.items(multi=True)))
+    return "{}?{} {}".format(request.path, arguments, etag)
+
+
+def _get_etag(scope, name="", schedules=False, lagging=None, streaming=False):
+    # every host and process and the lists of them get a new version from the
+    # database whenever anything that we return about them changes. the
+    # version is read before the data so if something changes in between
+    # then the client will just get the new data again the next time that it
+    # asks.
+    parts = [scope, q.select_change(scope, name)]
+
+    # the next start time for scheduled processes is worked out to the
+    # minute from the current time so it can change once a minute without
+    # the database changing at all. this is the same minute that they are
+    # worked out from.
+    if (schedules):
+        parts.append(int(schedules_now() // 60))
+
+    # whether a host is lagging depends on how far behind we allow it to be
+    if (lagging is not None):
+        parts.append(lagging)
+
+    # the same list comes in two formats and each needs its own tag
+    if (streaming):
+        parts.append("ndjson")
+
+    return "-".join(str(x) for x in parts)
+
+
+def _not_modified(etag):
+    response = make_response("", 304)
+    response.set_etag(etag)
+    return response
+
+
+def _paginate(response, results, key, filters):
+    # if we filled up a page then tell the client where to find the next one
+    if (filters["limit"] is not None and len(results) == filters["limit"]):
+        arguments = request.args.to_dict(flat=False)
+        arguments["after"] = [results[-1][key]]
+        response.headers["Link"] = "<{}?{}>; rel=\"next\"".format(request.path, urllib.parse.urlencode(arguments, doseq=True))
+    return response
@@ -0,0 +1,560 @@
+import logging
+import traceback
+import threading
+import atexit
+import socket
+import queue
+import uuid
+import time
+import ssl
+import os
+import json
+import collections
+from datetime import datetime
+
+
+# we want to set up a separate logger
+logger = logging.getLogger(__name__)
+
+
+# the states that a command goes through. it is finished once it is "sent" or
+# "failed" and it will never change again after that.
+QUEUED = "queued"
+SENDING = "sending"
+RETRYING = "retrying"
+SENT = "sent"
+FAILED = "failed"
+
+# how often to look in the database for a command that another worker is
+# sending when someone is waiting for it to finish
+POLL = 1
+
+# how often each worker removes old commands from the database
+PRUNE = 60
+
+
+class Command:
+    def __init__(self, fqdn, action, process=None, version=None):
+        self.id = uuid.uuid4().hex
+        self.fqdn = fqdn
+        self.action = action
+        self.process = process
+        self.version = version
+        self.status = QUEUED
+        self.attempts = 0
+        self.message = None
+        self.created = time.time()
+        self.finished = None
+        self.result = None
+        self.event = threading.Event()
+
+        # something waiting to hear about this command when it finishes
+        self.listener = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "fqdn": self.fqdn,
+            "action": self.action,
+            "process": self.process,
+            "version": self.version,
+            "status": self.status,
+            "attempts": self.attempts,
+            "message": self.message,
+            "created": datetime.fromtimestamp(self.created).strftime("%Y-%m-%d %H:%M:%S"),
+            "finished": (datetime.fromtimestamp(self.finished).strftime("%Y-%m-%d %H:%M:%S") if self.finished is not None else None),
+            "result": self.result,
+        }
+
+    def to_row(self):
+        # the columns of dart.command in order
+        return (
+            self.id,
+            self.fqdn,
+            self.action,
+            self.process,
+            self.version,
+            self.status,
+            self.attempts,
+            self.message,
+            self.created,
+            self.finished,
+            (json.dumps(self.result) if self.result is not None else None),
+        )
+
+
+class Connection:
+    def __init__(self, fqdn, ssock, sessions):
+        self.fqdn = fqdn
+        self.socket = ssock
+        self.reader = ssock.makefile("rb")
+        self.sessions = sessions
+        self.used = time.monotonic()
+
+    def close(self):
+        for thing in [self.reader, self.socket]:
+            try:
+                thing.close()
+            except Exception:
+                pass
+
+
+class Coordinator:
+    """
+    Sends commands to the coordination listener on remote hosts. A command is
+    a single line of JSON naming the action and maybe a process. Commands are
+    put on a queue and a fixed number of background threads send them so that
+    a request never waits on a remote host and a change that touches a lot of
+    hosts only talks to so many of them at the same time. Each command gets an
+    ID that can be used to find out whether it was sent. A command that can't
+    be sent is tried again a few times before it is marked as failed. The TLS
+    context is only built once and the TLS session for each host is kept so
+    that talking to the same host again doesn't need a full handshake.
+
+    Hosts write back a line saying how each command went and a command that
+    the host couldn't carry out is marked as failed but not tried again. The
+    connection is then kept open for the next command to the same host. Hosts
+    that don't write anything back just hang up and we count the command as
+    sent.
+
+    Commands are sent by the worker that received them but they are written
+    to the database when they are submitted, when they are tried again, and
+    when they finish so that any worker can say what happened to them. If
+    they can't be written then they are still sent. Only one command goes to
+    a host at a time. If a command comes up for a host that is already being
+    sent something then it waits with the host for its turn instead of tying
+    up a thread. A command that is being tried again keeps its turn so that
+    commands to a host always go out in the order that they were submitted.
+    """
+
+    def __init__(self, app=None, **kwargs):
+        if (app is not None):
+            self.init_app(app, **kwargs)
+        else:
+            self.app = None
+
+    def init_app(self, app, db_client=None, ca=None, key=None, name=None, port=3278, concurrency=10, timeout=5, retries=2, backoff=1, history=3600, wait=30, connections=100, idle=60):
+        self.app = app
+        self.db_client = db_client
+        self.ca = ca
+        self.key = key
+        self.name = name
+        self.port = int(port)
+        self.concurrency = max(int(concurrency), 1)
+        self.timeout = float(timeout)
+        self.retries = max(int(retries), 0)
+        self.backoff = float(backoff)
+        self.history = float(history)
+        self.wait = float(wait)
+        self.connections = max(int(connections), 0)
+        self.idle = float(idle)
+
+        # the context is built when it is first needed and again whenever the
+        # certificates change on disk. sessions only work with the context
+        # that made them.
+        self._context = None
+        self._context_version = None
+        self._sessions = {}
+        self._context_lock = threading.Lock()
+
+        # every command that we know about, keyed by id, and for each host
+        # that is being sent something, the id of the command being sent and
+        # the commands waiting their turn so that commands to one host go out
+        # one at a time and in order
+        self._commands = {}
+        self._hosts = {}
+        self._pruned = 0
+        self._connections = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+
+        # keep some statistics so that people can see how we're doing
+        self._submitted = 0    # number of commands put on the queue
+        self._sent = 0         # number of commands successfully sent
+        self._retried = 0      # number of times a command was tried again
+        self._failed = 0       # number of commands that were given up on
+        self._rejected = 0     # number of commands that hosts couldn't carry out
+        self._resumed = 0      # number of connections that reused a session
+        self._reused = 0       # number of commands sent on an open connection
+
+        logger.info("sending coordination commands with {} workers, a timeout of {} seconds and {} retries".format(self.concurrency, self.timeout, self.retries))
+        self.threads = []
+        for index in range(0, self.concurrency):
+            thread = threading.Thread(target=self._run, name="coordination-{}".format(index), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        # let anything already on the queue go out when the worker goes away
+        atexit.register(self.stop)
+
+    def stop(self):
+        for _ in self.threads:
+            self._queue.put(None)
+        for thread in self.threads:
+            thread.join(self.timeout)
+
+        with self._lock:
+            while (self._connections):
+                self._connections.popitem()[1].close()
+
+    def submit(self, fqdn, action, process=None):
+        return self.submit_all([(fqdn, action, process)])[0]
+
+    def submit_all(self, commands, listener=None):
+        # takes a list of (fqdn, action, process) tuples and returns a command
+        # for each of them in the same order. a rewrite can also be told what
+        # configuration version caused it by adding it to the end. if a listener is given then each
+        # command is put on it when it finishes.
+        commands = [Command(*x) for x in commands]
+        for command in commands:
+            command.listener = listener
+
+        with self._lock:
+            self._prune()
+            for command in commands:
+                self._commands[command.id] = command
+            self._submitted += len(commands)
+
+        # they are written before they are sent so that nobody can ask about
+        # a command that isn't there yet
+        self._save(commands)
+
+        for command in commands:
+            self._queue.put(command)
+        return commands
+
+    def fan_out(self, commands, parallelism=None, batch=None):
+        # takes a list of (fqdn, action, process) tuples and yields each one as
+        # it finishes. no more than "parallelism" of them are outstanding at a
+        # time. if "batch" is given then the commands go out in groups of that
+        # size and a group doesn't start until the one before it has finished
+        # so that something can be restarted across a lot of hosts without
+        # stopping it everywhere at once. if the caller stops listening then
+        # no more commands are sent.
+        parallelism = max(int(parallelism or self.concurrency), 1)
+        batch = max(int(batch or len(commands)), 1)
+
+        finished = queue.Queue()
+        for start in range(0, len(commands), batch):
+            waiting = list(commands[start:start + batch])
+            outstanding = 0
+            while (waiting or outstanding):
+                while (waiting and outstanding < parallelism):
+                    self.submit_all([waiting.pop(0)], listener=finished)
+                    outstanding += 1
+
+                yield finished.get()
+                outstanding -= 1
+
+    def get(self, command_id):
+        with self._lock:
+            return self._commands.get(command_id)
+
+    def lookup(self, command_id, wait=0):
+        # returns the command as a dict or None if nobody knows about it. if
+        # "wait" is given then wait up to that many seconds for it to finish.
+        # commands that this worker is sending can be waited on directly and
+        # commands that other workers are sending are checked on every so
+        # often.
+        command = self.get(command_id)
+        if (command is not None):
+            if (wait):
+                command.event.wait(wait)
+            return command.to_dict()
+
+        deadline = time.monotonic() + wait
+        while True:
+            result = self._load(command_id)
+            remaining = deadline - time.monotonic()
+            if (result is None or result["finished"] is not None or remaining <= 0):
+                return result
+            time.sleep(min(remaining, POLL))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "known": len(self._commands),
+                "submitted": self._submitted,
+                "sent": self._sent,
+                "retried": self._retried,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "connections": len(self._connections),
+                "resumed": self._resumed,
+                "reused": self._reused,
+            }
+
+    def send(self, fqdn, action, process=None, command_id=None, version=None):
+        # returns what the host said about the command or None if it didn't
+        # say anything
+        message = {"action": action}
+        if (process is not None):
+            message["process"] = process
+        if (version is not None):
+            message["version"] = version
+        if (command_id is not None):
+            message["id"] = command_id
+        data = (json.dumps(message) + "\n").encode()
+
+        # use the connection that we already have to the host if there is one.
+        # if the host hung up on it then it never got the command so we can
+        # send it again on a new connection.
+        connection = self._take_connection(fqdn)
+        if (connection is not None):
+            try:
+                logger.debug("reusing connection to {}, sending {}".format(fqdn, message))
+                result = self._exchange(connection, data, reused=True)
+                with self._lock:
+                    self._reused += 1
+                return result
+            except OSError as e:
+                logger.debug("connection to {} went away, reconnecting: {}".format(fqdn, e))
+
+        connection = self._connect(fqdn)
+        logger.debug("connected to {}, sending {}".format(fqdn, message))
+        return self._exchange(connection, data)
+
+    def _connect(self, fqdn):
+        ctx, sessions = self._get_context()
+
+        # connecting to a host that isn't there shouldn't take forever
+        sock = socket.create_connection((fqdn, self.port), timeout=self.timeout)
+        try:
+            # we expect the remote side to identify itself with our name
+            ssock = ctx.wrap_socket(sock, server_hostname=self.name, session=sessions.get(fqdn))
+        except Exception:
+            sock.close()
+            raise
+
+        # hang on to the session so that we can use it next time
+        sessions[fqdn] = ssock.session
+        if (ssock.session_reused):
+            with self._lock:
+                self._resumed += 1
+
+        # once we're connected the host gets longer to answer us
+        ssock.settimeout(self.wait)
+        return Connection(fqdn, ssock, sessions)
+
+    def _exchange(self, connection, data, reused=False):
+        try:
+            connection.socket.sendall(data)
+            response = connection.reader.readline()
+        except socket.timeout:
+            # the host got the command but it is taking a while to carry it
+            # out. we don't want to send it again so it counts as sent.
+            connection.close()
+            return None
+        except Exception:
+            connection.close()
+            raise
+
+        # tls 1.3 sends the session after the handshake so get it again now
+        # that we've heard from the host
+        connection.sessions[connection.fqdn] = connection.socket.session
+
+        if (not response):
+            connection.close()
+
+            # hosts that only take one command per connection hang up without
+            # saying anything but a connection that has been used before
+            # shouldn't do that
+            if (reused):
+                raise ConnectionResetError("connection to {} was closed".format(connection.fqdn))
+            return None
+
+        try:
+            result = json.loads(response.decode("utf8"))
+        except ValueError:
+            logger.warning("received an invalid response from {}: {}".format(connection.fqdn, response))
+            connection.close()
+            return None
+
+        self._keep_connection(connection)
+        return result
+
+    def _take_connection(self, fqdn):
+        with self._lock:
+            connection = self._connections.pop(fqdn, None)
+
+        # the host will hang up on connections that sit around for too long
+        if (connection is not None and time.monotonic() - connection.used > self.idle):
+            connection.close()
+            return None
+
+        return connection
+
+    def _keep_connection(self, connection):
+        connection.used = time.monotonic()
+
+        closing = []
+        with self._lock:
+            self._connections[connection.fqdn] = connection
+            while (len(self._connections) > self.connections):
+                closing.append(self._connections.popitem(last=False)[1])
+
+        for connection in closing:
+            connection.close()
+
+    def _get_context(self):
+        # certificates get replaced from time to time and we want to pick up
+        # the new ones without being restarted
+        version = (os.stat(self.ca).st_mtime, os.stat(self.key).st_mtime)
+
+        with self._context_lock:
+            if (self._context is None or self._context_version != version):
+                logger.debug("loading coordination certificates from {} verified against {}".format(self.key, self.ca))
+                ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+                ctx.verify_mode = ssl.CERT_REQUIRED
+                ctx.check_hostname = True
+
+                # we must validate the remote side against the UWCA
+                ctx.load_verify_locations(self.ca)
+
+                # we will present this as the client certificate for the connection
+                ctx.load_cert_chain(self.key)
+
+                self._context = ctx
+                self._context_version = version
+                self._sessions = {}
+
+            return self._context, self._sessions
+
+    def _run(self):
+        while True:
+            command = self._queue.get()
+            if (command is None):
+                return
+
+            try:
+                self._deliver(command)
+            except Exception as e:
+                logger.error("unexpected error sending {} command to {}: {}".format(command.action, command.fqdn, e))
+                logger.debug(traceback.format_exc())
+
+    def _deliver(self, command):
+        with self._lock:
+            host = self._hosts.setdefault(command.fqdn, [command.id, collections.deque()])
+            if (host[0] != command.id):
+                # something else is being sent to this host so this waits for
+                # its turn and the thread gets on with something else
+                host[1].append(command)
+                return
+
+            command.status = SENDING
+            command.attempts += 1
+
+        retrying = False
+        try:
+            result = self.send(command.fqdn, command.action, command.process, command.id, command.version)
+
+            with self._lock:
+                command.result = result
+
+                # the host got the command but couldn't carry it out or said
+                # something that we don't understand. sending it again isn't
+                # going to help.
+                if (result is not None and not isinstance(result, dict)):
+                    self._rejected += 1
+                    self._finish(command, FAILED, "Invalid response.")
+                elif (result is not None and not result.get("success")):
+                    self._rejected += 1
+                    self._finish(command, FAILED, result.get("error") or "Unknown error.")
+                else:
+                    self._sent += 1
+                    self._finish(command, SENT, None)
+        except Exception as e:
+            logger.warning("could not send {} command to {} on attempt {}: {}".format(command.action, command.fqdn, command.attempts, e))
+            logger.debug(traceback.format_exc())
+
+            with self._lock:
+                if (command.attempts > self.retries):
+                    self._failed += 1
+                    self._finish(command, FAILED, str(e))
+                else:
+                    self._retried += 1
+                    command.status = RETRYING
+                    command.message = str(e)
+                    retrying = True
+
+                    # wait a bit longer each time before trying again. the
+                    # wait happens off of the workers so that they can get on
+                    # with sending other commands. the command keeps its turn
+                    # with the host so that nothing behind it goes out first.
+                    timer = threading.Timer(self.backoff * (2 ** (command.attempts - 1)), self._queue.put, (command,))
+                    timer.daemon = True
+                    timer.start()
+        finally:
+            if (not retrying):
+                self._next(command.fqdn)
+
+        self._save([command])
+
+    def _next(self, fqdn):
+        # the next command waiting for the host gets its turn
+        with self._lock:
+            host = self._hosts[fqdn]
+            if (host[1]):
+                command = host[1].popleft()
+                host[0] = command.id
+                self._queue.put(command)
+            else:
+                del self._hosts[fqdn]
+
+    def _finish(self, command, status, message):
+        # must be called while holding the lock
+        command.status = status
+        command.message = message
+        command.finished = time.time()
+        command.event.set()
+        if (command.listener is not None):
+            command.listener.put(command)
+
+    def _prune(self):
+        # must be called while holding the lock. finished commands are only
+        # kept around for so long.
+        cutoff = time.time() - self.history
+        for command_id in [k for k, v in self._commands.items() if (v.finished is not None and v.finished < cutoff)]:
+            del self._commands[command_id]
+
+    def _save(self, commands):
+        # this gets its own connection so that it works the same in and out
+        # of a request and never ends up in the request's transaction
+        if (self.db_client is None):
+            return
+
+        # avoid circular imports
+        from .blueprints.coordination.v1 import queries as q
+
+        with self._lock:
+            prune = (time.monotonic() - self._pruned > PRUNE)
+            if (prune):
+                self._pruned = time.monotonic()
+
+        try:
+            with self.app.app_context():
+                try:
+                    q.save_commands([x.to_row() for x in commands])
+                    if (prune):
+                        q.delete_commands(self.history)
+                finally:
+                    # there is no request to tear down so we have to give the
+                    # connection back ourselves
+                    self.db_client.close(None)
+        except Exception as e:
+            logger.warning("could not save {} commands: {}".format(len(commands), e))
+            logger.debug(traceback.format_exc())
+
+    def _load(self, command_id):
+        if (self.db_client is None):
+            return
+
+        # avoid circular imports
+        from .blueprints.coordination.v1 import queries as q
+
+        with self.app.app_context():
+            try:
+                return q.select_command(command_id)
+            finally:
+                self.db_client.close(None)
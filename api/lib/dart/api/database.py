@@ -1,14 +1,18 @@
 import logging
 import psycopg2
 from psycopg2.extensions import TRANSACTION_STATUS_UNKNOWN, TRANSACTION_STATUS_IDLE
+from psycopg2.extensions import POLL_OK, POLL_READ, POLL_WRITE
 from psycopg2.extras import RealDictCursor
 import threading
+import collections
+import time
 import tenacity
 import traceback
-from flask import session, g
+from flask import session, g, has_request_context
 import uuid
 import pwd
 import os
+import dart.common.monkey
 
 
 # we want to set up a separate logger
@@ -19,77 +23,245 @@ class PoolError(psycopg2.Error):
     pass
 
 
+class Waiter:
+    def __init__(self, key):
+        self.key = key
+        self.conn = None
+        self.event = threading.Event()
+
+
+class ConnectionInfo:
+    def __init__(self):
+        self.created = time.monotonic()
+        self.returned = self.created
+        self.suspect = False
+        self.userid = None
+
+
 class ConnectionPool:
-    def __init__(self, minconn, maxconn, *args, **kwargs):
+    """
+    A thread safe pool of connections. Connections are handed out by key so
+    that asking for the same key returns the same connection until it is put
+    back. When every connection is in use, callers wait in line in the order
+    that they arrived, up to the timeout. Connections are closed when they
+    have been idle for too long or when they reach their maximum lifetime.
+    They are only tested before being handed out if something went wrong the
+    last time that they were used or if they have been sitting idle.
+    """
+
+    def __init__(self, minconn, maxconn, *args, timeout=30, lifetime=3600, idle=300, check=60, **kwargs):
         self.minconn = int(minconn)
         self.maxconn = int(maxconn)
+        self.timeout = float(timeout)    # how long to wait for a connection
+        self.lifetime = float(lifetime)  # how long to keep a connection at all
+        self.idle = float(idle)          # how long to keep an idle connection
+        self.check = float(check)        # test connections idle this long
 
         self._args = args
         self._kwargs = kwargs
 
-        self._pool = []   # connections that are available
-        self._used = {}   # connections currently in use
+        self._pool = collections.deque()     # connections that are available
+        self._used = {}                      # connections currently in use
+        self._info = {}                      # details about every connection
+        self._waiting = collections.deque()  # callers waiting for a connection
+        self._size = 0                       # connections open or opening
+
+        # keep some statistics about how long people wait
+        self._waits = 0
+        self._wait_time = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
 
         # control access to the thread pool
         self._lock = threading.RLock()
 
+    # if we can't connect to the database then retry with a random value
+    # between every 0.5 and 1.5 seconds. our space in the pool is given up
+    # between tries so that nobody waits in line behind us while we sleep.
+    @tenacity.retry(retry=tenacity.retry_if_exception_type(psycopg2.OperationalError), wait=tenacity.wait_fixed(0.5) + tenacity.wait_random(0, 1.5), before=tenacity.before_log(logger, logging.DEBUG))
     def getconn(self, key):
+        waiter = None
         with self._lock:
             # this key already has a connection so return it
             if (key in self._used):
                 return self._used[key]
 
-            # our pool is currently empty
-            if (len(self._pool) == 0):
-                # we've given out all of the connections that we want to
-                if (len(self._used) == self.maxconn):
-                    raise PoolError("connection pool exhausted")
-
-                # get a connection but do it with a retry
+            # close anything that has been sitting around for too long
+            expired = self._expire()
+
+            # only take a connection if nobody is already waiting for one.
+            # otherwise get in line behind them.
+            if (len(self._waiting) == 0 and len(self._pool) != 0):
+                conn = self._pool.pop()
+                self._used[key] = conn
+            elif (len(self._waiting) == 0 and self._size < self.maxconn):
+                self._size += 1
+                conn = None
+            else:
+                waiter = Waiter(key)
+                self._waiting.append(waiter)
+
+        self._close(expired)
+
+        if (waiter is not None):
+            start = time.monotonic()
+            if (not waiter.event.wait(self.timeout)):
+                with self._lock:
+                    # it is possible that we were given a connection between
+                    # timing out and getting the lock
+                    if (waiter in self._waiting):
+                        self._waiting.remove(waiter)
+                        self._timeouts += 1
+                        raise PoolError("timed out waiting for a connection after {} seconds".format(self.timeout))
+
+            with self._lock:
+                waited = time.monotonic() - start
+                self._waits += 1
+                self._wait_time += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+
+            # we were either handed a connection or a slot to open one
+            conn = waiter.conn
+
+        if (conn is None):
+            try:
                 conn = self._connect()
+            except BaseException:
+                with self._lock:
+                    self._size -= 1
+                    self._handoff(None)
+                raise
 
-                # add to the list of available connections
-                self._pool.append(conn)
+            with self._lock:
+                self._info[conn] = ConnectionInfo()
+                self._used[key] = conn
 
-            # take a connection out of the pool and give it away
-            self._used[key] = conn = self._pool.pop()
-            return conn
+        return conn
+
+    def get(self, key):
+        # returns the connection already handed out with this key, if any,
+        # without ever taking a new one
+        with self._lock:
+            return self._used.get(key)
 
     def putconn(self, key, close=False):
         with self._lock:
-            conn = self.getconn(key)
+            conn = self._used.pop(key, None)
             if (conn is None):
                 raise PoolError("no connection with that key")
-
-            if (len(self._pool) < self.minconn and not close):
-                # Return the connection into a consistent state before putting
-                # it back into the pool
-                status = conn.info.transaction_status
-                if (status == TRANSACTION_STATUS_UNKNOWN):
-                    # server connection lost
-                    conn.close()
-                elif (status != TRANSACTION_STATUS_IDLE):
-                    # connection in error or in transaction
+            info = self._info[conn]
+
+        # return the connection into a consistent state before putting it back
+        # into the pool. do this without holding the lock because it may need
+        # to talk to the database.
+        if (not close and not conn.closed):
+            status = conn.info.transaction_status
+            if (status == TRANSACTION_STATUS_UNKNOWN):
+                # server connection lost
+                close = True
+            elif (status != TRANSACTION_STATUS_IDLE):
+                # connection in error or in transaction. it is probably fine
+                # but test it before it gets used again.
+                info.suspect = True
+                try:
                     conn.rollback()
-                    self._pool.append(conn)
-                else:
-                    # regular idle connection
-                    self._pool.append(conn)
+                except Exception:
+                    close = True
+
+        if (conn.closed or time.monotonic() - info.created > self.lifetime):
+            close = True
+
+        with self._lock:
+            if (close):
+                self._discard(conn)
+                self._handoff(None)
+                expired = []
             else:
-                conn.close()
+                info.returned = time.monotonic()
+                if (not self._handoff(conn)):
+                    self._pool.append(conn)
+                expired = self._expire()
 
-            # here we check for the presence of key because it can happen that
-            # a thread tries to put back a connection after a call to close
-            if (key in self._used):
-                del self._used[key]
+        if (close):
+            self._close([conn])
+        self._close(expired)
+
+    def is_suspect(self, conn):
+        # a connection is worth testing if something went wrong with it or it
+        # has been sitting around unused for a while
+        info = self._info[conn]
+        return info.suspect or (time.monotonic() - info.returned > self.check)
+
+    def set_suspect(self, conn, suspect):
+        self._info[conn].suspect = suspect
+
+    def get_userid(self, conn):
+        return self._info[conn].userid
+
+    def set_userid(self, conn, userid):
+        self._info[conn].userid = userid
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self._size,
+                "idle": len(self._pool),
+                "used": len(self._used),
+                "waiting": len(self._waiting),
+                "waits": self._waits,
+                "wait_time": self._wait_time,
+                "wait_time_max": self._wait_time_max,
+                "timeouts": self._timeouts,
+            }
+
+    def _handoff(self, conn):
+        # give a connection to the next person in line. if the connection is
+        # None then they get our space in the pool and open their own. this
+        # must be called while holding the lock.
+        if (len(self._waiting) == 0):
+            return False
+
+        waiter = self._waiting.popleft()
+        if (conn is None):
+            self._size += 1
+        else:
+            self._used[waiter.key] = conn
+        waiter.conn = conn
+        waiter.event.set()
+        return True
+
+    def _expire(self):
+        # find idle connections that have been around for too long. the oldest
+        # connections are at the front of the pool. this must be called while
+        # holding the lock and the connections that are returned must be
+        # closed after releasing the lock.
+        now = time.monotonic()
+        expired = []
+        for conn in list(self._pool):
+            info = self._info[conn]
+            if (now - info.created > self.lifetime or (now - info.returned > self.idle and self._size > self.minconn)):
+                self._pool.remove(conn)
+                self._discard(conn)
+                expired.append(conn)
+        return expired
+
+    def _discard(self, conn):
+        # this must be called while holding the lock
+        self._info.pop(conn, None)
+        self._size -= 1
+
+    def _close(self, connections):
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
 
-    # retry with a random value between every 0.5 and 1.5 seconds
-    @tenacity.retry(wait=tenacity.wait_fixed(0.5) + tenacity.wait_random(0, 1.5), before=tenacity.before_log(logger, logging.DEBUG))
     def _connect(self):
         try:
             # connect to the database with the arguments provided when the pool was
-            # initialized. enable autocommit for consistency. this will retry using
-            # the "tenacity" library.
+            # initialized. enable autocommit for consistency. getconn retries this
+            # using the "tenacity" library.
             conn = psycopg2.connect(*self._args, **self._kwargs)
             conn.autocommit = True
             return conn
@@ -99,6 +271,23 @@ class ConnectionPool:
             raise
 
 
+def gevent_wait_callback(conn, timeout=None):
+    # this lets other greenlets run while we wait for the database. without it
+    # every query blocks every other request in the worker until it finishes.
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if (state == POLL_OK):
+            break
+        elif (state == POLL_READ):
+            wait_read(conn.fileno(), timeout=timeout)
+        elif (state == POLL_WRITE):
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError("bad result from poll: {}".format(state))
+
+
 class DatabaseClient:
     def __init__(self, app=None, **kwargs):
         if (app is not None):
@@ -106,9 +295,20 @@ class DatabaseClient:
         else:
             self.app = None
 
-    def init_app(self, app, key, minconn=2, maxconn=16, **kwargs):
+    def init_app(self, app, key, minconn=2, maxconn=None, timeout=30, lifetime=3600, idle=300, check=60, **kwargs):
         self.app = app
 
+        # if we are running under gevent then let psycopg2 cooperate with it.
+        # a gevent worker can have many more concurrent requests than a thread
+        # based worker so it gets a bigger pool by default.
+        if (dart.common.monkey.is_gevent_patched()):
+            logger.info("using gevent wait callback for database connections")
+            psycopg2.extensions.set_wait_callback(gevent_wait_callback)
+            if (maxconn is None):
+                maxconn = 64
+        if (maxconn is None):
+            maxconn = 16
+
         # this is how we will find the database connection client identifier
         # for this request. this lets the library ensure that it is handing out
         # the same connection for the duration of the request.
@@ -118,65 +318,86 @@ class DatabaseClient:
         self.pool = ConnectionPool(
             minconn=minconn,
             maxconn=maxconn,
+            timeout=timeout,
+            lifetime=lifetime,
+            idle=idle,
+            check=check,
             cursor_factory=RealDictCursor,
             **kwargs,
         )
 
+        # if a request fails then the connection that it used gets tested the
+        # next time that someone asks for it
+        self.app.after_request(self.inspect)
+
         # this will clean up the connection when it is done
         self.app.teardown_request(self.close)
 
     def conn(self):
+        # if we have a database client identifier for this request already
+        # then return the connection associated with that identifier. we want
+        # to return the same connection through an entire request. it is not
+        # tested because it may be in the middle of a transaction. if it is
+        # gone then raise an exception because a new connection would quietly
+        # lose whatever the request has done so far.
+        if (hasattr(g, self.key)):
+            db_client_id = str(getattr(g, self.key))
+            db_client = self.pool.get(db_client_id)
+            if (db_client is None or db_client.closed):
+                delattr(g, self.key)  # remove client identifier
+                if (db_client is not None):
+                    self.pool.putconn(db_client_id, close=True)
+                raise PoolError("request connection lost")
+
+            return db_client
+
         # loop until we have a database connection
         db_client = None
         while (db_client is None):
-            # see if we have a database client identifier for this request
-            # already. if we have a client identifier then get the connection
-            # associated with that identifier and test if it is still alive. if
-            # it is alive then return it. if it is not alive then raise an
-            # exception because we want to return the same connection through
-            # an entire request. if we do NOT have a client identifier then
-            # get a connection and test it until we get a connection that is
-            # alive.
-            db_client_id = None
-            if (hasattr(g, self.key)):
-                # try to get a connection with this client id
-                db_client_id = str(getattr(g, self.key))
-                db_client = self._get_connection(db_client_id)
-
-                # no connection returned for the request's client identifier so
-                # the connection is dead and we can't do anything.
-                if (db_client is None):
-                    delattr(g, self.key)  # remove client identifier
-                    raise PoolError("request connection lost")
-
-                # actually the client identifier returned a valid connection
-                return db_client
-
-            # try to get a connection with a new identifier
+            # try to get a connection with a new identifier. if the connection
+            # doesn't work then we'll just repeat the loop which is a-ok.
             db_client_id = str(uuid.uuid4())
             db_client = self._get_connection(db_client_id)
 
-            # the connection that we got was valid so let's save the identifier
-            # and return the connection. (if it wasn't valid then we'll just
-            # repeate the loop which is a-ok.)
-            if (db_client is not None):
-                # do anything with a new connection here. for example, maybe
-                # you want to set a configuration value that use the person's
-                # username in it. i don't know. TODO
-
-                # set a username if we know it as this lets modified_by columns
-                # work. we absolutely want to reset the username each time we
-                # hand a connection back, even if we can't find a username. if
-                # we don't then it's possible that we could inadvertently reuse
-                # username from a previous request which would be incorrect.
-                username = session.get("username", pwd.getpwuid(os.getuid())[0]) or "cork"
+        # set a username if we know it as this lets modified_by columns work.
+        # we absolutely want to reset the username each time we hand a
+        # connection back, even if we can't find a username. if we don't then
+        # it's possible that we could inadvertently reuse username from a
+        # previous request which would be incorrect. but if the connection
+        # already has this username then there is no reason to set it again.
+        # background threads don't have a request so they don't have a
+        # session either.
+        username = pwd.getpwuid(os.getuid())[0]
+        if (has_request_context()):
+            username = session.get("username", username)
+        username = username or "cork"
+        if (self.pool.get_userid(db_client) != username):
+            try:
                 cur = db_client.cursor()
                 cur.execute("SELECT set_config('local.userid', %s, FALSE)", [username])
                 cur.close()
-
-                # then attach the connection to the request global
-                setattr(g, self.key, db_client_id)
-                return db_client
+                self.pool.set_userid(db_client, username)
+            except Exception:
+                self.pool.putconn(db_client_id, close=True)
+                raise
+
+        # then attach the connection to the request global
+        setattr(g, self.key, db_client_id)
+        return db_client
+
+    def connect(self):
+        # returns a connection that is not part of the pool for things that
+        # need to hang on to one forever, like listening for notifications.
+        # the caller must close it.
+        return self.pool._connect()
+
+    def inspect(self, response):
+        if (response.status_code >= 500 and hasattr(g, self.key)):
+            try:
+                self.pool.set_suspect(self.pool.get(str(getattr(g, self.key))), True)
+            except (PoolError, KeyError):
+                pass
+        return response
 
     def close(self, exception):
         # this gets called when a request is finished, regardless of the state
@@ -184,6 +405,7 @@ class DatabaseClient:
         if (hasattr(g, self.key)):
             try:
                 db_client_id = getattr(g, self.key)
+                delattr(g, self.key)
                 self.pool.putconn(db_client_id)
                 logger.debug("returned connection {} to pool named {}".format(db_client_id, self.key))
             except (PoolError, KeyError) as e:
@@ -192,6 +414,12 @@ class DatabaseClient:
     def _get_connection(self, db_client_id):
         db_client = self.pool.getconn(db_client_id)
 
+        # only test connections that have given us trouble or that have been
+        # sitting around for a while. everything else is probably fine.
+        if (not self.pool.is_suspect(db_client)):
+            logger.debug("using connection {} from pool named {}".format(db_client_id, self.key))
+            return db_client
+
         try:
             logger.debug("testing connection {} from pool named {}".format(db_client_id, self.key))
 
@@ -199,7 +427,7 @@ class DatabaseClient:
             # if it doesn't work then we're going to close it and try to
             # get a different connection until we find one that works.
             cur = db_client.cursor()
-            cur.execute("SELECT pg_backend_pid()")
+            cur.execute("SELECT 1")
             cur.close()
         except Exception as e:
             logger.warning("connection {} from pool named {} failed: {}".format(db_client_id, self.key, e))
@@ -213,6 +441,7 @@ class DatabaseClient:
             return
         else:
             logger.debug("using connection {} from pool named {}".format(db_client_id, self.key))
+            self.pool.set_suspect(db_client, False)
 
             # the connection was good
             return db_client
@@ -0,0 +1,237 @@
+import logging
+import threading
+import traceback
+import atexit
+import time
+from dart.common.killer import GracefulEventKiller
+
+
+# we want to set up a separate logger
+logger = logging.getLogger(__name__)
+
+
+class IngestBuffer:
+    """
+    When enabled, the agent endpoints put their validated data into this buffer
+    instead of writing it to the database and a background thread writes it
+    out in batches. Data is kept per host and the last write wins so if a host
+    sends us three updates before we get around to writing them then we only
+    write the last one. A full list of active processes supersedes any state
+    changes that the agent saw before it but never a list that the agent took
+    after it. Each flush writes every host in one transaction and only falls
+    back to writing hosts one at a time when that fails. The buffer only holds
+    so many hosts and when it is full the caller is expected to write
+    synchronously instead.
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.enabled = False
+        if (app is not None):
+            self.init_app(app, **kwargs)
+        else:
+            self.app = None
+
+    def init_app(self, app, enabled=False, interval=1, limit=10000):
+        self.app = app
+        self.enabled = bool(enabled)
+        self.interval = float(interval)
+        self.limit = int(limit)
+
+        # everything that is waiting to be written, keyed by fqdn
+        self._buffer = {}
+        self._lock = threading.RLock()
+
+        # keep some statistics so that people can see how far behind we are
+        self._received = 0     # number of updates put into the buffer
+        self._coalesced = 0    # number of updates replaced by a newer update
+        self._rejected = 0     # number of updates refused because we're full
+        self._flushed = 0      # number of hosts successfully written
+        self._failed = 0       # number of hosts that failed to be written
+        self._dropped = 0      # number of hosts thrown away after failing
+        self._last_flush_duration = 0.0
+        self._last_flush_lag = 0.0
+
+        if (self.enabled):
+            logger.info("buffering agent updates, flushing every {} seconds with a limit of {} hosts".format(self.interval, self.limit))
+            self.killer = GracefulEventKiller()
+            self.thread = threading.Thread(target=self._run, name="ingest", daemon=True)
+            self.thread.start()
+
+            # try to write out whatever we have when the worker goes away
+            atexit.register(self.stop)
+
+    def stop(self):
+        if (self.enabled):
+            self.killer.kill()
+            self.thread.join()
+
+    def put_active(self, fqdn, processes, reported=None):
+        return self._put(fqdn, {"active": processes, "reported": reported, "states": {}})
+
+    def put_pending(self, fqdn, processes):
+        return self._put(fqdn, {"pending": processes})
+
+    def put_state(self, fqdn, process):
+        return self._put(fqdn, {"states": {process[0]: process}})
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            return {
+                "hosts": len(self._buffer),
+                "lag": max([now - x["received"] for x in self._buffer.values()], default=0.0),
+                "received": self._received,
+                "coalesced": self._coalesced,
+                "rejected": self._rejected,
+                "flushed": self._flushed,
+                "failed": self._failed,
+                "dropped": self._dropped,
+                "last_flush_duration": self._last_flush_duration,
+                "last_flush_lag": self._last_flush_lag,
+            }
+
+    def flush(self):
+        # take everything out of the buffer so that requests can keep filling
+        # it up while we write to the database
+        with self._lock:
+            buffer, self._buffer = self._buffer, {}
+
+        if (not buffer):
+            return
+
+        start = time.time()
+        lag = max(start - x["received"] for x in buffer.values())
+
+        # everything goes out in one transaction. if that doesn't work then we
+        # don't know which host broke it so every host is written on its own
+        # and only the hosts that still don't work are put back.
+        with self.app.app_context():
+            try:
+                self._write(buffer)
+                self._flushed += len(buffer)
+            except Exception as e:
+                logger.warning("could not write buffered updates for {} hosts together, writing them one at a time: {}".format(len(buffer), e))
+                logger.debug(traceback.format_exc())
+
+                for fqdn, entry in buffer.items():
+                    try:
+                        self._write({fqdn: entry})
+                        self._flushed += 1
+                    except Exception as e:
+                        logger.error("could not write buffered updates for {}: {}".format(fqdn, e))
+                        logger.debug(traceback.format_exc())
+                        self._failed += 1
+
+                        # put it back so that we try again next time. if the
+                        # buffer filled up while we were trying then there is
+                        # nowhere to put it and the host has to wait until its
+                        # next update.
+                        if (not self._put(fqdn, entry, requeue=True)):
+                            logger.error("dropped buffered updates for {} because the buffer is full".format(fqdn))
+                            self._dropped += 1
+
+        self._last_flush_duration = time.time() - start
+        self._last_flush_lag = lag
+        logger.debug("flushed buffered updates for {} hosts in {:.3f} seconds, oldest update was {:.3f} seconds old".format(len(buffer), self._last_flush_duration, lag))
+
+    def _write(self, buffer):
+        # avoid circular imports
+        from .app import db_client
+        from .blueprints.agent.v1 import queries as q
+
+        conn = None
+        try:
+            conn = db_client.conn()
+            conn.autocommit = False
+
+            # a full list of active processes goes first because any state
+            # changes that we have were seen after it. it is skipped if
+            # another worker already wrote a newer one.
+            q.write_buffered(
+                {k: (v["active"], v.get("reported")) for k, v in buffer.items() if v.get("active") is not None},
+                {k: list(v["states"].values()) for k, v in buffer.items() if v.get("states")},
+                {k: v["pending"] for k, v in buffer.items() if v.get("pending") is not None},
+            )
+
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise e
+        finally:
+            try:
+                conn.autocommit = True
+            except Exception:
+                pass
+
+            # there is no request to tear down so we have to give the
+            # connection back ourselves
+            db_client.close(None)
+
+    def _put(self, fqdn, update, requeue=False):
+        with self._lock:
+            entry = self._buffer.get(fqdn)
+            if (entry is None):
+                if (len(self._buffer) >= self.limit):
+                    if (not requeue):
+                        self._rejected += 1
+                    return False
+
+                self._buffer[fqdn] = dict(update)
+                self._buffer[fqdn].setdefault("received", time.time())
+            else:
+                # if we are putting something back then the entry in the
+                # buffer is newer than it. otherwise the update is newer. the
+                # newer one wins wherever they overlap except that a list of
+                # active processes is never replaced by one that the agent
+                # took before it.
+                newer, older = ((entry, update) if requeue else (update, entry))
+
+                merged = {
+                    "received": min(entry["received"], update.get("received", entry["received"])),
+                    "pending": (newer["pending"] if newer.get("pending") is not None else older.get("pending")),
+                    "active": newer.get("active"),
+                    "reported": newer.get("reported"),
+                    "states": {**older.get("states", {}), **newer.get("states", {})},
+                }
+                if (older.get("active") is not None and (newer.get("active") is None or self._is_older(newer.get("reported"), older.get("reported")))):
+                    merged["active"] = older["active"]
+                    merged["reported"] = older.get("reported")
+
+                # the list of active processes already has any state changes
+                # that the agent saw before it took the list. the last thing
+                # in a state change is when the agent saw it.
+                if (merged["active"] is not None):
+                    merged["states"] = {k: v for k, v in merged["states"].items() if not self._is_older(v[-1], merged["reported"])}
+
+                if (not requeue):
+                    self._coalesced += self._count(entry) + self._count(update) - self._count(merged)
+
+                self._buffer[fqdn] = merged
+
+            if (not requeue):
+                self._received += 1
+
+            return True
+
+    @staticmethod
+    def _is_older(reported, than):
+        # we can only tell if we know both times
+        return (reported is not None and than is not None and reported < than)
+
+    @staticmethod
+    def _count(entry):
+        return sum(entry.get(x) is not None for x in ["active", "pending"]) + len(entry.get("states", {}))
+
+    def _run(self):
+        while (not self.killer.killed(self.interval)):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("unexpected error flushing buffered updates: {}".format(e))
+                logger.debug(traceback.format_exc())
+
+        # one last time on the way out
+        self.flush()
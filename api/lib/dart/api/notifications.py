@@ -0,0 +1,223 @@
+import logging
+import traceback
+import threading
+import contextlib
+import atexit
+import select
+import time
+
+
+# we want to set up a separate logger
+logger = logging.getLogger(__name__)
+
+
+# the database tells us about configuration changes on this channel
+CHANNEL = "dart_configuration"
+
+# every worker agrees that whoever holds this advisory lock is the one that
+# tells agents about changes. it is just "dart" in hex.
+LOCK = 0x64617274
+
+
+class Notifier:
+    """
+    Tells agents when their configurations change so that they don't have to
+    keep asking. Triggers in the database give a host a new configuration
+    version whenever its assignments or the configurations of the processes
+    assigned to it change and send the host and its new version out as a
+    notification when the change is committed. We listen for those and send
+    the host a rewrite command. Notifications are gathered for a moment first
+    so that a change to a process that is assigned to a lot of hosts, or a lot
+    of changes at once, only tells each host once, about its newest version.
+
+    Every worker listens but only the one holding an advisory lock in the
+    database tells hosts so that they aren't told once for every worker. If
+    that worker goes away then so does its connection and its lock and another
+    worker takes over. Changes made in between aren't announced so agents
+    still check for changes on their own every so often.
+
+    Requests can also watch for changes to a host so that agents that can't
+    be reached can hold a request open until their configuration changes.
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.enabled = False
+        if (app is not None):
+            self.init_app(app, **kwargs)
+        else:
+            self.app = None
+
+    def init_app(self, app, db_client, coordinator, enabled=True, push=True, delay=1, retry=30):
+        self.app = app
+        self.db_client = db_client
+        self.coordinator = coordinator
+        self.enabled = bool(enabled)
+        self.push = bool(push)
+        self.delay = float(delay)
+        self.retry = float(retry)
+
+        # events for requests that are waiting for changes, keyed by host
+        self._watchers = {}
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+        # keep some statistics so that people can see how we're doing
+        self._listening = False  # whether this worker is listening
+        self._leading = False    # whether this worker is the one telling hosts
+        self._received = 0       # number of notifications received
+        self._told = 0           # number of rewrite commands submitted
+        self._woken = 0          # number of waiting requests woken up
+        self._errors = 0         # number of times listening stopped unexpectedly
+
+        if (not self.enabled):
+            return
+
+        if (self.push):
+            logger.info("telling agents about configuration changes after {} seconds".format(self.delay))
+        self.thread = threading.Thread(target=self._run, name="notifications", daemon=True)
+        self.thread.start()
+
+        # stop listening when the worker goes away
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+
+    @contextlib.contextmanager
+    def watch(self, fqdn):
+        # yields an event that is set when the configuration for the host
+        # changes. start watching before looking at the configuration or a
+        # change in between will be missed. if we aren't listening then we
+        # won't hear about any changes so this yields None.
+        event = threading.Event()
+        with self._lock:
+            if (not self._listening):
+                event = None
+            else:
+                self._watchers.setdefault(fqdn, set()).add(event)
+
+        try:
+            yield event
+        finally:
+            if (event is not None):
+                with self._lock:
+                    watchers = self._watchers.get(fqdn, set())
+                    watchers.discard(event)
+                    if (not watchers):
+                        self._watchers.pop(fqdn, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "listening": self._listening,
+                "leading": self._leading,
+                "watching": sum(len(x) for x in self._watchers.values()),
+                "received": self._received,
+                "told": self._told,
+                "woken": self._woken,
+                "errors": self._errors,
+            }
+
+    def _run(self):
+        while (not self._stopped.is_set()):
+            conn = None
+            try:
+                conn = self.db_client.connect()
+                self._listen(conn)
+            except Exception as e:
+                logger.warning("stopped listening for configuration changes: {}".format(e))
+                logger.debug(traceback.format_exc())
+                with self._lock:
+                    self._errors += 1
+            finally:
+                with self._lock:
+                    self._listening = False
+                    self._leading = False
+
+                    # nobody will hear about changes now so stop waiting
+                    for watchers in self._watchers.values():
+                        for event in watchers:
+                            event.set()
+
+                # closing the connection also gives up the lock
+                if (conn is not None):
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+            self._stopped.wait(self.retry)
+
+    def _listen(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("LISTEN {}".format(CHANNEL))
+
+        logger.info("listening for configuration changes")
+        with self._lock:
+            self._listening = True
+
+        pending = {}
+        deadline = None
+        checked = 0
+        while (not self._stopped.is_set()):
+            # every so often see if we should be the one telling hosts about
+            # changes. this also makes sure that when nothing is happening it
+            # is because nothing is changing and not because the database went
+            # away.
+            if (deadline is None and time.monotonic() - checked >= self.retry):
+                self._lead(conn)
+                checked = time.monotonic()
+
+            timeout = (self.retry if deadline is None else max(deadline - time.monotonic(), 0))
+            if (select.select([conn], [], [], timeout)[0]):
+                conn.poll()
+                while (conn.notifies):
+                    self._receive(conn.notifies.pop(0), pending)
+
+                if (pending and deadline is None):
+                    deadline = time.monotonic() + self.delay
+
+            if (deadline is not None and time.monotonic() >= deadline):
+                self._tell(pending)
+                pending = {}
+                deadline = None
+
+    def _lead(self, conn):
+        with conn.cursor() as cur:
+            if (not self.push or self._leading):
+                cur.execute("SELECT 1")
+                return
+
+            cur.execute("SELECT pg_try_advisory_lock(%s) AS locked", (LOCK,))
+            if (cur.fetchone()["locked"]):
+                logger.info("telling hosts about configuration changes from this worker")
+                with self._lock:
+                    self._leading = True
+
+    def _receive(self, notify, pending):
+        # the payload is the host and its new version
+        try:
+            fqdn, version = notify.payload.split(" ", 1)
+            version = int(version)
+        except ValueError:
+            logger.warning("received an invalid configuration notification: {}".format(notify.payload))
+            return
+
+        with self._lock:
+            self._received += 1
+
+            # anything waiting on this host hears about it right away
+            for event in self._watchers.get(fqdn, set()):
+                event.set()
+                self._woken += 1
+
+            # if we hear about the same host more than once then the last one
+            # is its newest version
+            if (self._leading):
+                pending[fqdn] = version
+
+    def _tell(self, pending):
+        logger.info("telling {} hosts that their configurations changed".format(len(pending)))
+        self.coordinator.submit_all([(fqdn, "rewrite", None, version) for fqdn, version in sorted(pending.items())])
+        with self._lock:
+            self._told += len(pending)
@@ -0,0 +1,90 @@
+from flask import g, has_request_context
+from crontab import CronTab
+from datetime import datetime
+import functools
+import time
+
+
+# how many upcoming runs to work out for each schedule at a time. we need at
+# least two because the first one might already be in the past.
+RUNS = 5
+
+
+def get_now():
+    # everything in a request should agree on what time it is
+    if (not has_request_context()):
+        return time.time()
+
+    if ("schedules_now" not in g):
+        g.schedules_now = time.time()
+    return g.schedules_now
+
+
+def is_valid(schedule):
+    return (_compile(schedule) is not None)
+
+
+def next_run(schedule, now=None):
+    # returns the timestamp of the next time that the schedule will run or
+    # None if the schedule is not valid
+    if (now is None):
+        now = get_now()
+
+    for run in _runs(schedule, int(now // 60)):
+        if (run > now):
+            return run
+
+    # this should never happen because only one run can be in the past
+    crontab = _compile(schedule)
+    if (crontab is None):
+        return
+    return now + crontab.next(now=now, default_utc=True)
+
+
+def next_runs(schedules, now=None):
+    # returns a dict of the next time that each schedule will run, formatted
+    # for display. schedules that are not valid get None.
+    if (now is None):
+        now = get_now()
+
+    results = {}
+    for schedule in set(schedules):
+        run = next_run(schedule, now)
+        results[schedule] = (datetime.fromtimestamp(run).strftime("%Y-%m-%d %H:%M:%S") if run is not None else None)
+    return results
+
+
+def add_starts(rows, now=None):
+    # give every row that has a schedule the next time that it will start
+    runs = next_runs([x["schedule"] for x in rows if (x["schedule"] is not None)], now)
+    for row in rows:
+        if (row["schedule"] is not None):
+            row["starts"] = runs[row["schedule"]]
+    return rows
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(schedule):
+    # parsing is the slow part so never do it twice for the same schedule
+    try:
+        return CronTab(schedule)
+    except ValueError:
+        return
+
+
+@functools.lru_cache(maxsize=4096)
+def _runs(schedule, minute):
+    # crontab only runs things at the top of a minute so the upcoming runs
+    # don't change until the minute does. the minute is part of the key so
+    # old results just fall out of the cache.
+    crontab = _compile(schedule)
+    if (crontab is None):
+        return ()
+
+    # start just before the minute so that a run at the top of it counts
+    runs = []
+    start = (minute * 60) - 1
+    for _ in range(0, RUNS):
+        start = start + crontab.next(now=start, default_utc=True)
+        runs.append(start)
+    return tuple(runs)
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+
+
+# we want to set up a separate logger
+logger = logging.getLogger(__name__)
+
+
+class Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Lets concurrent requests for the same thing share one computation. The
+    first request to ask for something runs the computation and everything
+    that asks for the same thing while it is running waits for it to finish
+    and gets the same result. Results can also be kept for a short while so
+    that requests that arrive just after the computation finished get the
+    result without running it again. Results are shared between requests so
+    they must not be modified.
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.enabled = False
+        if (app is not None):
+            self.init_app(app, **kwargs)
+        else:
+            self.app = None
+
+    def init_app(self, app, enabled=True, ttl=1):
+        self.app = app
+        self.enabled = bool(enabled)
+        self.ttl = float(ttl)
+
+        # computations that are running and results that we are keeping
+        self._calls = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+        # keep some statistics so that people can see whether this helps
+        self._executed = 0     # number of times a computation was run
+        self._coalesced = 0    # number of callers that waited on a running computation
+        self._cached = 0       # number of callers that got a kept result
+        self._failed = 0       # number of computations that raised an exception
+
+        if (self.enabled):
+            logger.info("coalescing concurrent reads, keeping results for {} seconds".format(self.ttl))
+
+    def do(self, key, function, *args, **kwargs):
+        if (not self.enabled):
+            return function(*args, **kwargs)
+
+        with self._lock:
+            now = time.monotonic()
+            result = self._results.get(key)
+            if (result is not None and result[0] > now):
+                self._cached += 1
+                return result[1]
+
+            call = self._calls.get(key)
+            if (call is not None):
+                self._coalesced += 1
+                leader = False
+            else:
+                call = Call()
+                self._calls[key] = call
+                leader = True
+
+        if (not leader):
+            call.event.wait()
+            if (call.error is not None):
+                raise call.error
+            return call.value
+
+        try:
+            call.value = function(*args, **kwargs)
+            return call.value
+        except Exception as e:
+            # everyone who was waiting gets the same exception
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._executed += 1
+                del self._calls[key]
+
+                if (call.error is not None):
+                    self._failed += 1
+                elif (self.ttl > 0):
+                    now = time.monotonic()
+                    self._results[key] = (now + self.ttl, call.value)
+
+                    # don't let old results pile up
+                    for expired in [k for k, v in self._results.items() if v[0] <= now]:
+                        del self._results[expired]
+
+            call.event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": len(self._calls),
+                "kept": len(self._results),
+                "executed": self._executed,
+                "coalesced": self._coalesced,
+                "cached": self._cached,
+                "failed": self._failed,
+            }
@@ -4,6 +4,7 @@ from flask_login import current_user
 from werkzeug.exceptions import BadRequest
 import functools
 import json
+import gzip
 
 
 # this will validate that we got valid json data
@@ -15,9 +16,18 @@ def validate_json_data(f):
             logger.warning("received empty data from {}".format(current_user.source))
             raise BadRequest("The DartAPI received an empty message. You must POST data in the body of the request to use the DartAPI.")
 
+        # clients can compress big requests
+        data = request.data
+        if (request.headers.get("Content-Encoding", "").lower() == "gzip"):
+            try:
+                data = gzip.decompress(data)
+            except (OSError, EOFError):
+                logger.warning("received invalid compressed data from {}".format(current_user.source))
+                raise BadRequest("The DartAPI received compressed data that could not be decompressed. You must send only valid gzip data.")
+
         # make sure that it is valid utf8 data
         try:
-            data = request.data.decode("utf8")
+            data = data.decode("utf8")
         except UnicodeDecodeError:
             logger.warning("received non-UTF-8 data from {}".format(current_user.source))
             raise BadRequest("The DartAPI received non-UTF-8 data that could not be decoded. You must send data only in UTF-8.")
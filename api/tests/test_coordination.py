@@ -0,0 +1,80 @@
+from dart.api.coordination import Coordinator, SENT, FAILED
+import threading
+import pytest
+
+
+class Host:
+    # stands in for the coordination listener on a host. it fails the first
+    # time that it is sent anything in "broken", or every time if "forever"
+    # is set, and answers with whatever is in "answers".
+    def __init__(self, broken=(), forever=False, answers=None):
+        self.broken = set(broken)
+        self.forever = forever
+        self.answers = answers or {}
+        self.received = []
+        self.lock = threading.Lock()
+
+    def send(self, fqdn, action, process=None, command_id=None, version=None):
+        with self.lock:
+            self.received.append((fqdn, action))
+            if (action in self.broken):
+                if (not self.forever):
+                    self.broken.remove(action)
+                raise ConnectionRefusedError("connection refused")
+        return self.answers.get(action, {"success": True})
+
+
+@pytest.fixture
+def coordinator():
+    coordinator = Coordinator(object(), concurrency=4, retries=2, backoff=0.05)
+    yield coordinator
+    coordinator.stop()
+
+
+def wait(commands):
+    for command in commands:
+        assert command.event.wait(5)
+
+
+def test_commands_to_a_host_stay_in_order(coordinator):
+    host = Host(broken=["stop"])
+    coordinator.send = host.send
+
+    commands = coordinator.submit_all([("a", "stop"), ("a", "start"), ("b", "start"), ("a", "restart")])
+    wait(commands)
+
+    # the command that had to be tried again still goes out before the ones
+    # behind it
+    assert [x[1] for x in host.received if x[0] == "a"] == ["stop", "stop", "start", "restart"]
+    assert [x.status for x in commands] == [SENT, SENT, SENT, SENT]
+    assert commands[0].attempts == 2
+    assert coordinator.stats()["retried"] == 1
+
+
+def test_retries_run_out(coordinator):
+    host = Host(broken=["stop"], forever=True)
+    coordinator.send = host.send
+    commands = coordinator.submit_all([("a", "stop"), ("a", "start")])
+    wait(commands)
+
+    assert commands[0].status == FAILED
+    assert commands[0].attempts == 3
+    assert "connection refused" in commands[0].message
+    assert commands[1].status == SENT
+    assert coordinator.stats()["failed"] == 1
+
+
+def test_host_could_not_do_it(coordinator):
+    host = Host(answers={"stop": {"success": False, "error": "no such process"}, "start": ["not", "an", "object"]})
+    coordinator.send = host.send
+
+    commands = coordinator.submit_all([("a", "stop"), ("a", "start")])
+    wait(commands)
+
+    # neither of these is tried again
+    assert [(x.status, x.message, x.attempts) for x in commands] == [
+        (FAILED, "no such process", 1),
+        (FAILED, "Invalid response.", 1),
+    ]
+    assert coordinator.stats()["rejected"] == 2
+    assert coordinator.stats()["retried"] == 0
@@ -0,0 +1,158 @@
+from dart.api.database import ConnectionPool, PoolError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+import threading
+import pytest
+import time
+
+
+class Info:
+    def __init__(self):
+        self.transaction_status = TRANSACTION_STATUS_IDLE
+
+
+class Connection:
+    # just enough of a psycopg2 connection for the pool to look after
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+        self.info = Info()
+        self.rollbacks = 0
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+
+class Pool(ConnectionPool):
+    # hands out fake connections instead of talking to a database
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened = []
+
+    def _connect(self):
+        conn = Connection(len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+
+def test_same_key_same_connection():
+    pool = Pool(0, 2)
+    conn = pool.getconn("a")
+    assert pool.getconn("a") is conn
+    assert pool.get("a") is conn
+    assert pool.get("b") is None
+    assert pool.getconn("b") is not conn
+    assert pool.stats()["size"] == 2
+
+
+def test_connections_are_reused():
+    pool = Pool(0, 2)
+    conn = pool.getconn("a")
+    pool.putconn("a")
+    assert pool.getconn("b") is conn
+    assert len(pool.opened) == 1
+
+    with pytest.raises(PoolError):
+        pool.putconn("a")
+
+
+def test_handoff_in_order():
+    pool = Pool(0, 1)
+    conn = pool.getconn("a")
+
+    # everyone else has to wait in line for the one connection
+    got = []
+
+    def wait(key):
+        got.append((key, pool.getconn(key)))
+        pool.putconn(key)
+
+    threads = []
+    for key in ["b", "c"]:
+        thread = threading.Thread(target=wait, args=(key,))
+        thread.start()
+        threads.append(thread)
+        while (pool.stats()["waiting"] < len(threads)):
+            time.sleep(0.01)
+
+    pool.putconn("a")
+    for thread in threads:
+        thread.join(5)
+
+    assert got == [("b", conn), ("c", conn)]
+    assert len(pool.opened) == 1
+    stats = pool.stats()
+    assert stats["waits"] == 2
+    assert stats["waiting"] == 0
+    assert stats["used"] == 0
+    assert stats["idle"] == 1
+
+
+def test_closed_connection_hands_off_its_space():
+    pool = Pool(0, 1)
+    first = pool.getconn("a")
+
+    got = []
+    thread = threading.Thread(target=lambda: got.append(pool.getconn("b")))
+    thread.start()
+    while (pool.stats()["waiting"] < 1):
+        time.sleep(0.01)
+
+    # the next one in line opens a new connection instead
+    pool.putconn("a", close=True)
+    thread.join(5)
+
+    assert first.closed
+    assert got[0] is not first
+    assert pool.stats()["size"] == 1
+
+
+def test_timeout():
+    pool = Pool(0, 1, timeout=0.05)
+    pool.getconn("a")
+    with pytest.raises(PoolError):
+        pool.getconn("b")
+
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["waiting"] == 0
+
+
+def test_dirty_connection_is_rolled_back():
+    pool = Pool(0, 1)
+    conn = pool.getconn("a")
+    conn.info.transaction_status = TRANSACTION_STATUS_INTRANS
+    pool.putconn("a")
+
+    assert conn.rollbacks == 1
+    assert not conn.closed
+    assert pool.is_suspect(conn)
+
+
+def test_lifetime():
+    pool = Pool(0, 1, lifetime=60)
+    conn = pool.getconn("a")
+
+    # connections that are too old are closed when they are put back
+    pool._info[conn].created -= 120
+    pool.putconn("a")
+    assert conn.closed
+    assert pool.stats()["size"] == 0
+
+
+def test_idle_expiry():
+    pool = Pool(1, 3, idle=60)
+    first = pool.getconn("a")
+    second = pool.getconn("b")
+    pool.putconn("a")
+    pool.putconn("b")
+
+    # idle connections are closed but we keep the minimum around
+    pool._info[first].returned -= 120
+    pool._info[second].returned -= 120
+    pool.getconn("c")
+    assert [first.closed, second.closed].count(True) == 1
+    assert pool.stats()["size"] == 1
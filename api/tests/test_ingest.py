@@ -0,0 +1,135 @@
+from dart.api.ingest import IngestBuffer
+
+
+def buffer(limit=10):
+    # without "enabled" nothing is ever written so we can look at what would
+    # have been
+    ingest_buffer = IngestBuffer()
+    ingest_buffer.init_app(object(), limit=limit)
+    return ingest_buffer
+
+
+def process(name, state, seen=None):
+    # the same shape as the active processes that the agent views make, with
+    # when the agent saw it on the end for state changes
+    return (name, state, None, None, None, None, None, None, None, None, seen)
+
+
+def test_pending_last_write_wins():
+    ingest_buffer = buffer()
+    assert ingest_buffer.put_pending("a", [("foo", "added")])
+    assert ingest_buffer.put_pending("a", [("foo", "removed")])
+
+    assert ingest_buffer._buffer["a"]["pending"] == [("foo", "removed")]
+    stats = ingest_buffer.stats()
+    assert stats["received"] == 2
+    assert stats["coalesced"] == 1
+
+
+def test_newer_active_replaces_older():
+    ingest_buffer = buffer()
+    ingest_buffer.put_active("a", [process("foo", "RUNNING")], 100)
+    ingest_buffer.put_active("a", [process("foo", "STOPPED")], 200)
+
+    entry = ingest_buffer._buffer["a"]
+    assert entry["active"] == [process("foo", "STOPPED")]
+    assert entry["reported"] == 200
+
+
+def test_older_active_never_replaces_newer():
+    # workers handle requests at their own pace so lists show up out of order
+    ingest_buffer = buffer()
+    ingest_buffer.put_active("a", [process("foo", "STOPPED")], 200)
+    ingest_buffer.put_active("a", [process("foo", "RUNNING")], 100)
+
+    entry = ingest_buffer._buffer["a"]
+    assert entry["active"] == [process("foo", "STOPPED")]
+    assert entry["reported"] == 200
+    assert ingest_buffer.stats()["coalesced"] == 1
+
+
+def test_active_without_reported_replaces():
+    # agents that don't say when they took the list always win
+    ingest_buffer = buffer()
+    ingest_buffer.put_active("a", [process("foo", "STOPPED")], 200)
+    ingest_buffer.put_active("a", [process("foo", "RUNNING")])
+
+    assert ingest_buffer._buffer["a"]["active"] == [process("foo", "RUNNING")]
+
+
+def test_active_prunes_older_states():
+    ingest_buffer = buffer()
+    ingest_buffer.put_state("a", process("foo", "STARTING", 100))
+    ingest_buffer.put_state("a", process("bar", "STARTING", 300))
+    ingest_buffer.put_active("a", [process("foo", "RUNNING"), process("bar", "STARTING")], 200)
+
+    # the list already has what happened to foo but bar changed after it
+    entry = ingest_buffer._buffer["a"]
+    assert list(entry["states"]) == ["bar"]
+    assert entry["active"] == [process("foo", "RUNNING"), process("bar", "STARTING")]
+    assert ingest_buffer.stats()["coalesced"] == 1
+
+
+def test_states_after_active_are_kept():
+    ingest_buffer = buffer()
+    ingest_buffer.put_active("a", [process("foo", "RUNNING")], 200)
+    ingest_buffer.put_state("a", process("foo", "STOPPING", 150))
+    ingest_buffer.put_state("a", process("foo", "STOPPED", 250))
+
+    # the first state change is older than the list so it is dropped and the
+    # second one replaces it
+    entry = ingest_buffer._buffer["a"]
+    assert entry["states"] == {"foo": process("foo", "STOPPED", 250)}
+    assert entry["active"] == [process("foo", "RUNNING")]
+
+
+def test_requeue_does_not_replace_newer():
+    ingest_buffer = buffer()
+    ingest_buffer.put_active("a", [process("foo", "RUNNING")], 100)
+    ingest_buffer.put_pending("a", [("foo", "added")])
+    failed, ingest_buffer._buffer = ingest_buffer._buffer, {}
+
+    # new updates arrive while the failed ones are being written
+    ingest_buffer.put_active("a", [process("foo", "STOPPED")], 200)
+    assert ingest_buffer._put("a", failed["a"], requeue=True)
+
+    # the newer list wins but the pending list that only the failed update
+    # had is kept
+    entry = ingest_buffer._buffer["a"]
+    assert entry["active"] == [process("foo", "STOPPED")]
+    assert entry["reported"] == 200
+    assert entry["pending"] == [("foo", "added")]
+    assert entry["received"] == failed["a"]["received"]
+
+    # putting something back isn't a new update
+    stats = ingest_buffer.stats()
+    assert stats["received"] == 3
+    assert stats["coalesced"] == 0
+
+
+def test_requeue_keeps_newer_active_that_failed():
+    ingest_buffer = buffer()
+    ingest_buffer.put_active("a", [process("foo", "STOPPED")], 200)
+    failed, ingest_buffer._buffer = ingest_buffer._buffer, {}
+
+    # an older list shows up late while the newer one is being written
+    ingest_buffer.put_active("a", [process("foo", "RUNNING")], 100)
+    ingest_buffer._put("a", failed["a"], requeue=True)
+
+    entry = ingest_buffer._buffer["a"]
+    assert entry["active"] == [process("foo", "STOPPED")]
+    assert entry["reported"] == 200
+
+
+def test_full_buffer():
+    ingest_buffer = buffer(limit=1)
+    assert ingest_buffer.put_pending("a", [])
+    assert ingest_buffer.put_pending("a", [("foo", "added")])
+    assert not ingest_buffer.put_pending("b", [])
+    assert ingest_buffer.stats()["rejected"] == 1
+
+    # putting something back when there is no room isn't counted as rejected
+    # because it was never a new update
+    assert not ingest_buffer._put("b", {"pending": [], "received": 0}, requeue=True)
+    assert ingest_buffer.stats()["rejected"] == 1
+    assert list(ingest_buffer._buffer) == ["a"]
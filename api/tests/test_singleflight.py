@@ -0,0 +1,108 @@
+from dart.api.singleflight import SingleFlight
+import threading
+import pytest
+import time
+
+
+def start(single_flight, key, function, callers):
+    # runs "callers" callers at once and returns what each got back
+    results = [None] * callers
+
+    def call(index):
+        try:
+            results[index] = ("value", single_flight.do(key, function))
+        except Exception as e:
+            results[index] = ("error", e)
+
+    threads = [threading.Thread(target=call, args=(x,)) for x in range(0, callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_callers_share_a_result():
+    single_flight = SingleFlight(object(), ttl=0)
+    release = threading.Event()
+    calls = []
+
+    def function():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": 42}
+
+    threads, results = start(single_flight, "key", function, 5)
+
+    # wait for everyone to be waiting on the one that is running
+    while (single_flight.stats()["coalesced"] < 4):
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert all(x == ("value", {"answer": 42}) for x in results)
+    assert results[0][1] is results[1][1]
+
+    stats = single_flight.stats()
+    assert stats["executed"] == 1
+    assert stats["coalesced"] == 4
+    assert stats["running"] == 0
+
+
+def test_concurrent_callers_share_an_error():
+    single_flight = SingleFlight(object(), ttl=1)
+    release = threading.Event()
+    error = RuntimeError("broken")
+
+    def function():
+        release.wait(5)
+        raise error
+
+    threads, results = start(single_flight, "key", function, 3)
+    while (single_flight.stats()["coalesced"] < 2):
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(x == ("error", error) for x in results)
+
+    # errors are never kept so the next caller tries again
+    assert single_flight.stats()["failed"] == 1
+    assert single_flight.stats()["kept"] == 0
+    assert single_flight.do("key", lambda: "fixed") == "fixed"
+
+
+def test_results_are_kept():
+    single_flight = SingleFlight(object(), ttl=60)
+    calls = []
+
+    def function(value):
+        calls.append(value)
+        return value
+
+    assert single_flight.do("a", function, 1) == 1
+    assert single_flight.do("a", function, 2) == 1
+    assert single_flight.do("b", function, 3) == 3
+    assert calls == [1, 3]
+    assert single_flight.stats()["cached"] == 1
+
+
+def test_results_are_not_kept_without_ttl():
+    single_flight = SingleFlight(object(), ttl=0)
+    assert single_flight.do("a", lambda: 1) == 1
+    assert single_flight.do("a", lambda: 2) == 2
+    assert single_flight.stats()["kept"] == 0
+
+
+def test_disabled():
+    single_flight = SingleFlight(object(), enabled=False)
+    assert single_flight.do("a", lambda: 1) == 1
+    assert single_flight.do("a", lambda: 2) == 2
+
+    def function():
+        raise RuntimeError("broken")
+
+    with pytest.raises(RuntimeError):
+        single_flight.do("a", function)
+    assert single_flight.stats()["executed"] == 0
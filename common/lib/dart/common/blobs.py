@@ -0,0 +1,12 @@
+import hashlib
+import json
+
+
+def encode(blob):
+    # blobs are named by a hash of this so it must come out exactly the same
+    # every time for the same blob, wherever it is done
+    return json.dumps(blob, sort_keys=True).encode("utf8")
+
+
+def get_name(blob):
+    return hashlib.sha256(encode(blob)).hexdigest()
@@ -1,10 +1,189 @@
 import logging
+import collections
+import threading
+import urllib.parse
+import json
+import gzip
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from .metrics import MetricsRegistry
 
 
 # create a logger for our libraries to use
 logger = logging.getLogger(__name__)
 
 
+def create_session(url=None, name=None, cert=None, verify=None, pool_size=10, pool_block=True, retries=3, backoff=0.3, retry_all=False, compress=None):
+    """
+    Creates a requests session for talking to one of our APIs. Every request
+    is timed and the times are counted by endpoint so that it is possible to
+    see what is slow. The time spent waiting for a connection from the pool is
+    counted, too. If "pool_block" is set then no more than "pool_size"
+    connections are ever opened and requests wait for one to be free instead.
+    If "compress" is set then request bodies of at least that many bytes are
+    sent with gzip. Failed requests and server errors are retried "retries"
+    times, backing off by "backoff" seconds, doubled after each try. Only
+    requests that are safe to repeat are retried unless "retry_all" is set.
+    """
+    retry = Retry(
+        total=int(retries),
+        read=int(retries),
+        connect=int(retries),
+        backoff_factor=float(backoff),
+        status_forcelist=(500, 502, 503, 504),  # always retry on these response codes
+        method_whitelist=(False if retry_all else Retry.DEFAULT_METHOD_WHITELIST),
+    )
+
+    session = Session(url=url, name=name, compress=compress)
+    session.cert = cert
+    session.verify = verify
+
+    adapter = Adapter(session.metrics, pool_connections=int(pool_size), pool_maxsize=int(pool_size), pool_block=bool(pool_block), max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def create_session_from_settings(settings, prefix, **kwargs):
+    # takes the url, key, ca, and the pool, retry, and compression options
+    # from the settings under the prefix. anything not in the settings comes
+    # from the arguments.
+    options = dict(kwargs)
+    for name in ["pool_size", "pool_block", "retries", "backoff", "retry_all", "compress"]:
+        value = settings.get("{}.{}".format(prefix, name))
+        if (value is not None):
+            options[name] = value
+
+    return create_session(
+        url=settings.get("{}.url".format(prefix)),
+        name=prefix.split(".")[-1],
+        cert=settings.get("{}.key".format(prefix)),
+        verify=settings.get("{}.ca".format(prefix)),
+        **options
+    )
+
+
+class SessionMetrics:
+    """
+    Counts requests by endpoint, how long they took, and how long they waited
+    for a connection. Endpoints are the method and the first three parts of
+    the path under the API, like "GET tool/v1/hosts", so that requests for
+    different hosts or processes are counted together. Everything is kept in
+    the metrics registry, labeled with the name of the API. This is safe to
+    share between threads.
+    """
+
+    def __init__(self, url=None, name=None):
+        self.url = (url or "").rstrip("/")
+        self.name = (name or "api")
+
+        registry = MetricsRegistry()
+        self.latency = registry.histogram("http_client_request_seconds", "time taken to get responses from apis", ("api", "endpoint"))
+        self.errors = registry.counter("http_client_errors_total", "requests to apis that failed or got a server error", ("api", "endpoint"))
+        self.waits = registry.histogram("http_client_pool_wait_seconds", "time spent waiting for a connection to an api", ("api",))
+
+    def get_endpoint(self, method, url):
+        if (self.url and url.startswith(self.url)):
+            path = url[len(self.url):]
+        else:
+            path = urllib.parse.urlsplit(url).path
+        path = path.split("?", 1)[0]
+        return "{} {}".format(method, "/".join([x for x in path.split("/") if x][:3]))
+
+    def timed(self, endpoint, seconds, status=None):
+        # a status of None means that there was no response at all
+        self.latency.observe(seconds, api=self.name, endpoint=endpoint)
+        if (status is None or status >= 500):
+            self.errors.inc(api=self.name, endpoint=endpoint)
+
+    def waited(self, seconds):
+        self.waits.observe(seconds, api=self.name)
+
+    def stats(self):
+        # returns the number of requests and seconds spent on them by
+        # endpoint and the same for waiting for connections
+        endpoints = {}
+        for (name, endpoint), (count, seconds) in self.latency.snapshot().items():
+            if (name == self.name):
+                endpoints[endpoint] = {"count": count, "seconds": round(seconds, 6)}
+
+        count, seconds = self.waits.snapshot().get((self.name,), (0, 0.0))
+        return {"endpoints": endpoints, "pool": {"waits": count, "seconds": round(seconds, 6)}}
+
+
+class Session(requests.Session):
+    """
+    A requests session that counts its requests in "metrics" and compresses
+    big request bodies. Use create_session to get one.
+    """
+
+    def __init__(self, url=None, name=None, compress=None):
+        super().__init__()
+        self.metrics = SessionMetrics(url, name)
+        self.compress = (int(compress) if compress else None)
+
+    def send(self, request, **kwargs):
+        if (self.compress and request.body and "Content-Encoding" not in request.headers):
+            body = request.body
+            if (isinstance(body, str)):
+                body = body.encode("utf8")
+            if (isinstance(body, bytes) and len(body) >= self.compress):
+                request.body = gzip.compress(body)
+                request.headers["Content-Encoding"] = "gzip"
+                request.headers["Content-Length"] = str(len(request.body))
+
+        # for streamed responses this is the time until the headers arrive
+        endpoint = self.metrics.get_endpoint(request.method, request.url)
+        start = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            self.metrics.timed(endpoint, time.monotonic() - start)
+            raise
+
+        self.metrics.timed(endpoint, time.monotonic() - start, response.status_code)
+        return response
+
+
+class Adapter(HTTPAdapter):
+    """
+    An adapter whose connection pools tell "metrics" how long it took to get
+    a connection out of them.
+    """
+
+    def __init__(self, metrics, **kwargs):
+        self.metrics = metrics
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+
+        # the pool manager makes pools from these classes
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("TimedHTTPConnectionPool", (_TimedConnectionPool, HTTPConnectionPool), {"metrics": self.metrics}),
+            "https": type("TimedHTTPSConnectionPool", (_TimedConnectionPool, HTTPSConnectionPool), {"metrics": self.metrics}),
+        }
+
+    def __setstate__(self, state):
+        # adapters are copied by pickling them and we aren't pickled with them
+        self.metrics = SessionMetrics()
+        super().__setstate__(state)
+
+
+class _TimedConnectionPool:
+    metrics = None
+
+    def _get_conn(self, timeout=None):
+        start = time.monotonic()
+        try:
+            return super()._get_conn(timeout=timeout)
+        finally:
+            self.metrics.waited(time.monotonic() - start)
+
+
 def get_ip_address(request):
     ip_addresses = request.headers.get("X-Forwarded-For")
     if (not ip_addresses):
@@ -53,3 +232,103 @@ def get_user_name(request):
 
     logger.warning("no username found in headers")
     return
+
+
+class ResponseCache:
+    """
+    Remembers responses that came with an ETag so that the next request for
+    the same thing can ask the server whether anything changed. If nothing
+    changed then the server sends back a 304 with no body and we hand out the
+    response that we remembered. Only the most recently used responses are
+    kept. This is safe to share between threads.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        # how many requests were answered from the cache and how many weren't
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session, url, params=None, headers=None, **kwargs):
+        # returns a requests response object. it may be one that was returned
+        # before so do not modify it.
+        key = self._key("json", url, params)
+        entry = self._lookup(key)
+
+        response = session.get(url, params=params, headers=self._headers(headers, entry), **kwargs)
+        if (response.status_code == 304 and entry is not None):
+            self._hit(key)
+            return entry[1]
+
+        if (response.status_code == 200 and response.headers.get("ETag")):
+            self._store(key, response.headers["ETag"], response)
+        else:
+            self._forget(key)
+        return response
+
+    def stream(self, session, url, params=None, headers=None, **kwargs):
+        # asks for newline delimited json and yields each record as soon as
+        # it arrives. the records are only remembered if we get all of them.
+        key = self._key("ndjson", url, params)
+        entry = self._lookup(key)
+
+        headers = self._headers(headers, entry)
+        headers["Accept"] = "application/x-ndjson"
+        with session.get(url, params=params, headers=headers, stream=True, **kwargs) as response:
+            # we keep the lines rather than the records and decode them every
+            # time so that callers can modify what they get without changing
+            # what we have remembered
+            if (response.status_code == 304 and entry is not None):
+                self._hit(key)
+                for line in entry[1]:
+                    yield json.loads(line)
+                return
+
+            response.raise_for_status()
+            lines = []
+            for line in response.iter_lines():
+                if (line):
+                    lines.append(line)
+                    yield json.loads(line)
+
+            if (response.headers.get("ETag")):
+                self._store(key, response.headers["ETag"], lines)
+            else:
+                self._forget(key)
+
+    def _key(self, kind, url, params):
+        # requests leaves out parameters with no value so we do too
+        params = sorted((k, v) for k, v in (params or {}).items() if v is not None)
+        return "{} {}?{}".format(kind, url, urllib.parse.urlencode(params, doseq=True))
+
+    def _headers(self, headers, entry):
+        headers = dict(headers or {})
+        if (entry is not None):
+            headers["If-None-Match"] = entry[0]
+        return headers
+
+    def _lookup(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def _hit(self, key):
+        with self._lock:
+            self.hits += 1
+            if (key in self._entries):
+                self._entries.move_to_end(key)
+
+    def _store(self, key, etag, value):
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (etag, value)
+            self._entries.move_to_end(key)
+            while (len(self._entries) > self.size):
+                self._entries.popitem(last=False)
+
+    def _forget(self, key):
+        with self._lock:
+            self.misses += 1
+            self._entries.pop(key, None)
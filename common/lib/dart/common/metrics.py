@@ -0,0 +1,283 @@
+"""
+Counters, gauges, and histograms that can be read by Prometheus. Every
+component has one registry that everything puts its metrics into and that
+renders them in the Prometheus text format. Things that already keep their
+own statistics can be added to the registry with "collect" and their
+statistics are read every time that the metrics are rendered.
+"""
+
+from .singleton import Singleton
+import contextlib
+import ipaddress
+import threading
+import time
+import os
+
+
+# everything that we name gets this in front of it
+NAMESPACE = "dart"
+
+# this is what Prometheus expects to get back
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# the upper bounds in seconds of the buckets that histograms count things in
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = "{}_{}".format(NAMESPACE, name)
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def collect(self):
+        # yields the name, type, and description of every metric and then
+        # a list of the name, labels, and value of every sample of it
+        with self._lock:
+            values = list(self._values.items())
+        yield self.name, self.type, self.description, [(self.name, dict(zip(self.labels, key)), value) for key, value in sorted(values)]
+
+    def _key(self, labels):
+        return tuple(str(labels.get(x, "")) for x in self.labels)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(set(buckets) | {float("inf")}))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if (counts is None):
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+
+            # the last one is the sum of everything
+            counts[-1] += value
+            for i, bound in enumerate(self.buckets):
+                if (value <= bound):
+                    counts[i] += 1
+                    break
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def snapshot(self):
+        # returns the count and sum of everything observed by labels
+        with self._lock:
+            return {key: (sum(counts[:-1]), counts[-1]) for key, counts in self._values.items()}
+
+    def collect(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+
+        samples = []
+        for key, counts in sorted(values):
+            labels = dict(zip(self.labels, key))
+
+            # buckets are cumulative
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                samples.append(("{}_bucket".format(self.name), dict(labels, le=("+Inf" if bound == float("inf") else repr(float(bound)))), total))
+            samples.append(("{}_sum".format(self.name), labels, counts[-1]))
+            samples.append(("{}_count".format(self.name), labels, total))
+
+        yield self.name, self.type, self.description, samples
+
+
+class Collector:
+    """
+    Turns the dict returned by a "stats" function into metrics whenever they
+    are collected. Nested dicts become one metric with a label. Anything that
+    isn't a number is left out. Everything is a gauge unless it is named in
+    "counters".
+    """
+
+    def __init__(self, name, stats, counters=(), label="name"):
+        self.name = "{}_{}".format(NAMESPACE, name)
+        self.stats = stats
+        self.counters = set(counters)
+        self.label = label
+
+    def collect(self):
+        for key, value in sorted(self.stats().items()):
+            name = "{}_{}".format(self.name, key)
+            type = ("counter" if key in self.counters else "gauge")
+
+            if (isinstance(value, dict)):
+                samples = [(name, {self.label: k}, self._number(v)) for k, v in sorted(value.items())]
+                samples = [x for x in samples if x[2] is not None]
+            else:
+                value = self._number(value)
+                samples = ([] if value is None else [(name, {}, value)])
+
+            if (samples):
+                yield name, type, key.replace("_", " "), samples
+
+    def _number(self, value):
+        if (isinstance(value, bool)):
+            return int(value)
+        if (isinstance(value, (int, float))):
+            return value
+
+
+class MetricsRegistry(metaclass=Singleton):
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, description, labels=()):
+        return self._get(Counter, name, description, labels)
+
+    def gauge(self, name, description, labels=()):
+        return self._get(Gauge, name, description, labels)
+
+    def histogram(self, name, description, labels=(), **kwargs):
+        return self._get(Histogram, name, description, labels, **kwargs)
+
+    def register(self, collector):
+        # anything with a "collect" method that works like the one on Metric
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def collect(self, name, stats, counters=(), **kwargs):
+        return self.register(Collector(name, stats, counters, **kwargs))
+
+    def render(self, **extra):
+        # anything in "extra" is added as a label to every sample
+        with self._lock:
+            collectors = list(self._metrics.values()) + list(self._collectors)
+
+        lines = []
+        for collector in collectors:
+            for name, type, description, samples in collector.collect():
+                lines.append("# HELP {} {}".format(name, description.replace("\\", "\\\\").replace("\n", "\\n")))
+                lines.append("# TYPE {} {}".format(name, type))
+                for sample, labels, value in samples:
+                    lines.append("{}{} {}".format(sample, _format_labels(dict(labels, **extra)), _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+    def _get(self, cls, name, description, labels, **kwargs):
+        # asking for the same metric twice gets the same one back so that
+        # things can ask for their metrics wherever they need them
+        with self._lock:
+            metric = self._metrics.get(name)
+            if (metric is None):
+                metric = self._metrics[name] = cls(name, description, labels, **kwargs)
+            elif (not isinstance(metric, cls)):
+                raise ValueError("metric {} is already a {}".format(name, metric.type))
+            return metric
+
+
+def register_flask_app(app, registry, url="/metrics", allowed=(), proxies=0):
+    # times every request by endpoint and serves everything in the registry
+    # to anyone who is logged in or who comes from one of the addresses or
+    # networks in "allowed". if we are behind "proxies" proxies that we trust
+    # then that is the address that connected to the first of them. every
+    # worker has its own registry so everything is labeled with the pid of
+    # the worker. otherwise each scrape would get a different worker and the
+    # counters would look like they go backwards.
+    from flask import request, g, Response
+    from flask_login import login_required
+
+    networks = [ipaddress.ip_network(x, strict=False) for x in allowed]
+
+    requests = registry.histogram("http_request_seconds", "time taken to respond to requests", ("endpoint", "method", "status"))
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.monotonic()
+
+    @app.after_request
+    def stop_request_timer(response):
+        # streamed responses are timed until they start streaming
+        if ("metrics_started" in g):
+            requests.observe(time.monotonic() - g.metrics_started, endpoint=(request.endpoint or "none"), method=request.method, status=response.status_code)
+        return response
+
+    def render():
+        return Response(registry.render(pid=os.getpid()), content_type=CONTENT_TYPE)
+
+    @app.route(url, methods=["GET"])
+    def metrics():
+        if (networks):
+            try:
+                address = ipaddress.ip_address(_get_address(request, int(proxies)))
+                if (any(address in x for x in networks)):
+                    return render()
+            except ValueError:
+                pass
+
+        return login_required(render)()
+
+
+def _get_address(request, proxies):
+    # every proxy adds the address that connected to it to the end of
+    # X-Forwarded-For. anything before what our own proxies added came from
+    # the client and could be anything so it is never used.
+    if (proxies <= 0):
+        return request.remote_addr
+
+    forwarded = [x.strip() for x in request.headers.get("X-Forwarded-For", "").split(",") if x.strip()]
+    if (len(forwarded) < proxies):
+        return ""
+    return forwarded[-proxies]
+
+
+def _format_labels(labels):
+    if (not labels):
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    return "{{{}}}".format(",".join("{}=\"{}\"".format(k, escape(v)) for k, v in labels.items()))
+
+
+def _format_value(value):
+    if (value == float("inf")):
+        return "+Inf"
+    if (isinstance(value, float)):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,116 @@
+from dart.common.singleton import Singleton
+from dart.common.metrics import MetricsRegistry, _get_address
+import pytest
+
+
+@pytest.fixture
+def registry():
+    # the registry is a singleton so every test gets a fresh one
+    Singleton._instances.pop(MetricsRegistry, None)
+    yield MetricsRegistry()
+    Singleton._instances.pop(MetricsRegistry, None)
+
+
+class Request:
+    def __init__(self, remote_addr, forwarded=None):
+        self.remote_addr = remote_addr
+        self.headers = ({} if forwarded is None else {"X-Forwarded-For": forwarded})
+
+
+def test_counter(registry):
+    counter = registry.counter("requests", "number of requests", ["method"])
+    counter.inc(method="GET")
+    counter.inc(2, method="GET")
+    counter.inc(method="POST")
+
+    assert registry.render() == "\n".join([
+        "# HELP dart_requests number of requests",
+        "# TYPE dart_requests counter",
+        "dart_requests{method=\"GET\"} 3",
+        "dart_requests{method=\"POST\"} 1",
+    ]) + "\n"
+
+
+def test_gauge_without_labels(registry):
+    gauge = registry.gauge("size", "how big it is")
+    gauge.set(2.5)
+
+    assert registry.render() == "# HELP dart_size how big it is\n# TYPE dart_size gauge\ndart_size 2.5\n"
+
+
+def test_same_metric(registry):
+    assert registry.counter("requests", "number of requests") is registry.counter("requests", "number of requests")
+    with pytest.raises(ValueError):
+        registry.gauge("requests", "number of requests")
+
+
+def test_histogram(registry):
+    histogram = registry.histogram("duration", "how long it took", buckets=[0.1, 1])
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    # buckets are cumulative and always end with +Inf
+    assert registry.render() == "\n".join([
+        "# HELP dart_duration how long it took",
+        "# TYPE dart_duration histogram",
+        "dart_duration_bucket{le=\"0.1\"} 1",
+        "dart_duration_bucket{le=\"1.0\"} 2",
+        "dart_duration_bucket{le=\"+Inf\"} 3",
+        "dart_duration_sum 5.55",
+        "dart_duration_count 3",
+    ]) + "\n"
+
+
+def test_collector(registry):
+    registry.collect("pool", lambda: {"size": 2, "waits": 7, "hosts": {"b": 1, "a": True}, "name": "skipped"}, counters=["waits"])
+
+    # keys are sorted, nested dicts get a label, and anything that isn't a
+    # number is left out
+    assert registry.render() == "\n".join([
+        "# HELP dart_pool_hosts hosts",
+        "# TYPE dart_pool_hosts gauge",
+        "dart_pool_hosts{name=\"a\"} 1",
+        "dart_pool_hosts{name=\"b\"} 1",
+        "# HELP dart_pool_size size",
+        "# TYPE dart_pool_size gauge",
+        "dart_pool_size 2",
+        "# HELP dart_pool_waits waits",
+        "# TYPE dart_pool_waits counter",
+        "dart_pool_waits 7",
+    ]) + "\n"
+
+
+def test_extra_labels(registry):
+    registry.counter("requests", "number of requests", ["path"]).inc(path="/a")
+    registry.gauge("size", "how big it is").set(1)
+
+    lines = registry.render(pid=123).splitlines()
+    assert "dart_requests{path=\"/a\",pid=\"123\"} 1" in lines
+    assert "dart_size{pid=\"123\"} 1" in lines
+
+
+def test_escaping(registry):
+    registry.gauge("size", "line one\nline two \\ three", ["name"]).set(float("inf"), name="say \"hi\"\n")
+
+    assert registry.render().splitlines() == [
+        "# HELP dart_size line one\\nline two \\\\ three",
+        "# TYPE dart_size gauge",
+        "dart_size{name=\"say \\\"hi\\\"\\n\"} +Inf",
+    ]
+
+
+def test_address_without_proxies():
+    # whatever the client says is ignored
+    assert _get_address(Request("10.0.0.1", "1.1.1.1"), 0) == "10.0.0.1"
+    assert _get_address(Request("10.0.0.1"), 0) == "10.0.0.1"
+
+
+def test_address_behind_proxies():
+    request = Request("10.0.0.1", "1.1.1.1, 2.2.2.2,3.3.3.3")
+    assert _get_address(request, 1) == "3.3.3.3"
+    assert _get_address(request, 2) == "2.2.2.2"
+
+    # not enough proxies said anything so there is no address
+    assert _get_address(request, 4) == ""
+    assert _get_address(Request("10.0.0.1"), 1) == ""
@@ -1,6 +1,4 @@
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+import dart.common.http
 
 
 class APIManager:
@@ -13,21 +11,18 @@ class APIManager:
     def init_app(self, app):
         from .app import settings_manager
 
-        # this sets a custom retry policy. we will retry a few times in case we
-        # hit a server that is transitioning into offline state.
-        retries = 3
-        retry = Retry(
-            total=retries,
-            read=retries,
-            connect=retries,
-            backoff_factor=0.3,
-            status_forcelist=(500, 502, 503, 504),
-        )
-
-        # modify the number of retries that we will make. we will also block
-        # until we get a connection to the remote server.
-        self.dart_api = requests.Session()
-        self.dart_api.cert = settings_manager.get("portal.api.dart.key")
-        self.dart_api.verify = settings_manager.get("portal.api.dart.ca")
-        self.dart_api.mount("https://", HTTPAdapter(pool_block=True, max_retries=retry))
+        # we will retry a few times in case we hit a server that is
+        # transitioning into offline state and block until we get a connection
+        # to the remote server. these can be changed in the settings.
+        self.dart_api = dart.common.http.create_session_from_settings(settings_manager, "portal.api.dart", retries=3, backoff=0.3)
         self.dart_api_url = settings_manager.get("portal.api.dart.url")
+
+        # the portal asks for the same things over and over again so remember
+        # what we got and only download it again when it has changed
+        self.dart_api_cache = dart.common.http.ResponseCache()
+
+    def get(self, url, **kwargs):
+        return self.dart_api_cache.get(self.dart_api, url, **kwargs)
+
+    def stream(self, url, **kwargs):
+        return self.dart_api_cache.stream(self.dart_api, url, **kwargs)
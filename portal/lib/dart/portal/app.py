@@ -5,6 +5,8 @@ from flask_login import LoginManager
 from flask_moment import Moment
 from flask_caching import Cache
 from dart.common.settings import SettingsManager
+from dart.common.metrics import MetricsRegistry
+import dart.common.metrics
 from .api import APIManager
 from . import login
 from . import cache_buster
@@ -17,6 +19,9 @@ logger = logging.getLogger(__name__)
 # get global settings
 settings_manager = SettingsManager(lazy=True)
 
+# everything puts its metrics here
+metrics_registry = MetricsRegistry()
+
 # configure access to the api with retries and whatnot
 api_manager = APIManager()
 
@@ -57,6 +62,12 @@ def load():
     # initialize the cache busting
     cache_buster.init_app(app)
 
+    # time every request and serve everything that we're keeping track of,
+    # including how the DartAPI is treating us, from /metrics. Prometheus
+    # can't log in like a person so it gets in by where it comes from.
+    metrics_registry.collect("portal_api_cache", lambda: {"hits": api_manager.dart_api_cache.hits, "misses": api_manager.dart_api_cache.misses}, counters=["hits", "misses"])
+    dart.common.metrics.register_flask_app(app, metrics_registry, "{}/metrics".format(app.config.get("APPLICATION_ROOT", "")), settings_manager.get("portal.metrics.allowed", []), settings_manager.get("portal.metrics.proxies", 0))
+
     # register the blueprint using the prefix defined in the configuration as
     # the application root. if APPLICATION_ROOT is defined incorrectly then
     # this whole thing will break. multiple blueprints may be defined with a
@@ -48,15 +48,15 @@ def autocomplete_host():
 @api.route("/host/<string:fqdn>/active", methods=["GET"])
 def host_active(fqdn):
     try:
-        @cache.cached(timeout=1, key_prefix="api/host/{}".format(fqdn))
+        @cache.cached(timeout=1, key_prefix="api/host/{}/active".format(fqdn))
         def select():
-            return r.select_host(fqdn)
+            return r.select_host_active(fqdn)
 
         result = select()
         if (result is None):
             return make_response(jsonify([]), 404)
         else:
-            return make_response(jsonify(result["active"]), 200)
+            return make_response(jsonify(result), 200)
     except Exception as e:
         logger.error("internal server error: {}".format(str(e)))
         logger.error(traceback.format_exc())
@@ -66,15 +66,15 @@ def host_active(fqdn):
 @api.route("/host/<string:fqdn>/pending", methods=["GET"])
 def host_pending(fqdn):
     try:
-        @cache.cached(timeout=1, key_prefix="api/host/{}".format(fqdn))
+        @cache.cached(timeout=1, key_prefix="api/host/{}/pending".format(fqdn))
         def select():
-            return r.select_host(fqdn)
+            return r.select_host_pending(fqdn)
 
         result = select()
         if (result is None):
             return make_response(jsonify([]), 404)
         else:
-            return make_response(jsonify(result["pending"]), 200)
+            return make_response(jsonify(result), 200)
     except Exception as e:
         logger.error("internal server error: {}".format(str(e)))
         logger.error(traceback.format_exc())
@@ -84,15 +84,15 @@ def host_pending(fqdn):
 @api.route("/host/<string:fqdn>/assigned", methods=["GET"])
 def host_assigned(fqdn):
     try:
-        @cache.cached(timeout=1, key_prefix="api/host/{}".format(fqdn))
+        @cache.cached(timeout=1, key_prefix="api/host/{}/assignments".format(fqdn))
         def select():
-            return r.select_host(fqdn)
+            return r.select_host_assignments(fqdn)
 
         result = select()
         if (result is None):
             return make_response(jsonify([]), 404)
         else:
-            return make_response(jsonify(result["assignments"]), 200)
+            return make_response(jsonify(result), 200)
     except Exception as e:
         logger.error("internal server error: {}".format(str(e)))
         logger.error(traceback.format_exc())
@@ -173,15 +173,15 @@ def autocomplete_process_environment(process_name):
 @api.route("/process/<string:name>/active", methods=["GET"])
 def process_active(name):
     try:
-        @cache.cached(timeout=1, key_prefix="api/process/{}".format(name))
+        @cache.cached(timeout=1, key_prefix="api/process/{}/active".format(name))
         def select():
-            return r.select_process(name)
+            return r.select_process_active(name)
 
         result = select()
         if (result is None):
             return make_response(jsonify([]), 404)
         else:
-            return make_response(jsonify(result["active"]), 200)
+            return make_response(jsonify(result), 200)
     except Exception as e:
         logger.error("internal server error: {}".format(str(e)))
         logger.error(traceback.format_exc())
@@ -191,15 +191,15 @@ def process_active(name):
 @api.route("/process/<string:name>/pending", methods=["GET"])
 def process_pending(name):
     try:
-        @cache.cached(timeout=1, key_prefix="api/process/{}".format(name))
+        @cache.cached(timeout=1, key_prefix="api/process/{}/pending".format(name))
         def select():
-            return r.select_process(name)
+            return r.select_process_pending(name)
 
         result = select()
         if (result is None):
             return make_response(jsonify([]), 404)
         else:
-            return make_response(jsonify(result["pending"]), 200)
+            return make_response(jsonify(result), 200)
     except Exception as e:
         logger.error("internal server error: {}".format(str(e)))
         logger.error(traceback.format_exc())
@@ -209,15 +209,15 @@ def process_pending(name):
 @api.route("/process/<string:name>/assigned", methods=["GET"])
 def process_assigned(name):
     try:
-        @cache.cached(timeout=1, key_prefix="api/process/{}".format(name))
+        @cache.cached(timeout=1, key_prefix="api/process/{}/assignments".format(name))
         def select():
-            return r.select_process(name)
+            return r.select_process_assignments(name)
 
         result = select()
         if (result is None):
             return make_response(jsonify([]), 404)
         else:
-            return make_response(jsonify(result["assignments"]), 200)
+            return make_response(jsonify(result), 200)
     except Exception as e:
         logger.error("internal server error: {}".format(str(e)))
         logger.error(traceback.format_exc())
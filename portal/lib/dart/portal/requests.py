@@ -5,14 +5,12 @@ import urllib.parse
 import json
 
 
-def select_hosts():
+def select_hosts(prefix=None, states=None):
     url = "{}/tool/v1/hosts".format(api_manager.dart_api_url)
-    response = api_manager.dart_api.get(url, timeout=10)
-    response.raise_for_status()
 
     # convert string timestamp to a datetime object
     results = []
-    for result in response.json():
+    for result in api_manager.stream(url, timeout=10, params={"prefix": prefix, "state": states or []}):
         try:
             result["polled"] = datetime.strptime(result.get("polled"), "%Y-%m-%d %H:%M:%S")
         except Exception:
@@ -24,7 +22,7 @@ def select_hosts():
 
 def select_host(fqdn):
     url = "{}/tool/v1/hosts/{}".format(api_manager.dart_api_url, urllib.parse.quote(fqdn))
-    response = api_manager.dart_api.get(url, timeout=10)
+    response = api_manager.get(url, timeout=10)
 
     # if host doesn't exist we get a 404, don't raise exception
     if (response.status_code == 404):
@@ -46,6 +44,18 @@ def select_host(fqdn):
     return result
 
 
+def select_host_active(fqdn):
+    return _select_part("{}/tool/v1/hosts/{}/active".format(api_manager.dart_api_url, urllib.parse.quote(fqdn)))
+
+
+def select_host_pending(fqdn):
+    return _select_part("{}/tool/v1/hosts/{}/pending".format(api_manager.dart_api_url, urllib.parse.quote(fqdn)))
+
+
+def select_host_assignments(fqdn):
+    return _select_part("{}/tool/v1/hosts/{}/assignments".format(api_manager.dart_api_url, urllib.parse.quote(fqdn)))
+
+
 def delete_host(fqdn):
     url = "{}/tool/v1/hosts/{}".format(api_manager.dart_api_url, urllib.parse.quote(fqdn))
     response = api_manager.dart_api.delete(url, timeout=10)
@@ -53,16 +63,14 @@ def delete_host(fqdn):
     return response.json()
 
 
-def select_processes():
+def select_processes(prefix=None, states=None):
     url = "{}/tool/v1/processes".format(api_manager.dart_api_url)
-    response = api_manager.dart_api.get(url, timeout=10)
-    response.raise_for_status()
-    return response.json()
+    return list(api_manager.stream(url, timeout=10, params={"prefix": prefix, "state": states or []}))
 
 
 def select_process(process_name):
     url = "{}/tool/v1/processes/{}".format(api_manager.dart_api_url, urllib.parse.quote(process_name))
-    response = api_manager.dart_api.get(url, timeout=10)
+    response = api_manager.get(url, timeout=10)
 
     # if process doesn't exist we get a 404, don't raise exception
     if (response.status_code == 404):
@@ -72,6 +80,18 @@ def select_process(process_name):
     return response.json()
 
 
+def select_process_active(process_name):
+    return _select_part("{}/tool/v1/processes/{}/hosts/active".format(api_manager.dart_api_url, urllib.parse.quote(process_name)))
+
+
+def select_process_pending(process_name):
+    return _select_part("{}/tool/v1/processes/{}/hosts/pending".format(api_manager.dart_api_url, urllib.parse.quote(process_name)))
+
+
+def select_process_assignments(process_name):
+    return _select_part("{}/tool/v1/processes/{}/hosts/assignments".format(api_manager.dart_api_url, urllib.parse.quote(process_name)))
+
+
 def delete_process(process_name):
     url = "{}/tool/v1/processes/{}".format(api_manager.dart_api_url, urllib.parse.quote(process_name))
     response = api_manager.dart_api.delete(url, timeout=10)
@@ -102,17 +122,12 @@ def enable_process(fqdn, process_name):
         }
     }
 
-    # patch the configuration
+    # patch the configuration. sending a list of changes gets the api to
+    # tell the remote system to rewrite its configuration for us.
     url = "{}/tool/v1/processes/{}".format(api_manager.dart_api_url, urllib.parse.quote(process_name))
-    response = api_manager.dart_api.patch(url, data=json.dumps(data), timeout=10)
+    response = api_manager.dart_api.patch(url, data=json.dumps([data]), timeout=10)
     response.raise_for_status()
 
-    try:
-        # tell the remote system to rewrite its configuration
-        send_host_command(fqdn, "rewrite")
-    except Exception:
-        pass
-
 
 def disable_process(fqdn, process_name):
     logger.info("disabling {} on {}".format(process_name, fqdn))
@@ -125,17 +140,12 @@ def disable_process(fqdn, process_name):
         }
     }
 
-    # patch the configuration
+    # patch the configuration. sending a list of changes gets the api to
+    # tell the remote system to rewrite its configuration for us.
     url = "{}/tool/v1/processes/{}".format(api_manager.dart_api_url, urllib.parse.quote(process_name))
-    response = api_manager.dart_api.patch(url, data=json.dumps(data), timeout=10)
+    response = api_manager.dart_api.patch(url, data=json.dumps([data]), timeout=10)
     response.raise_for_status()
 
-    try:
-        # tell the remote system to rewrite its configuration
-        send_host_command(fqdn, "rewrite")
-    except Exception:
-        pass
-
 
 def assign_process(fqdn, process_name, process_environment):
     logger.info("assigning {} {} to {}".format(process_name, process_environment, fqdn))
@@ -148,17 +158,12 @@ def assign_process(fqdn, process_name, process_environment):
         }
     }
 
-    # patch the configuration
+    # patch the configuration. sending a list of changes gets the api to
+    # tell the remote system to rewrite its configuration for us.
     url = "{}/tool/v1/hosts/{}".format(api_manager.dart_api_url, urllib.parse.quote(fqdn))
-    response = api_manager.dart_api.patch(url, data=json.dumps(data), timeout=10)
+    response = api_manager.dart_api.patch(url, data=json.dumps([data]), timeout=10)
     response.raise_for_status()
 
-    try:
-        # tell the remote system to rewrite its configuration
-        send_host_command(fqdn, "rewrite")
-    except Exception:
-        pass
-
 
 def unassign_process(fqdn, process_name):
     logger.info("unassigning {} from {}".format(process_name, fqdn))
@@ -170,20 +175,26 @@ def unassign_process(fqdn, process_name):
         }
     }
 
-    # patch the configuration
+    # patch the configuration. sending a list of changes gets the api to
+    # tell the remote system to rewrite its configuration for us.
     url = "{}/tool/v1/hosts/{}".format(api_manager.dart_api_url, urllib.parse.quote(fqdn))
-    response = api_manager.dart_api.patch(url, data=json.dumps(data), timeout=10)
+    response = api_manager.dart_api.patch(url, data=json.dumps([data]), timeout=10)
     response.raise_for_status()
 
-    try:
-        # tell the remote system to rewrite its configuration
-        send_host_command(fqdn, "rewrite")
-    except Exception:
-        pass
-
 
 def register(data):
     url = "{}/tool/v1/register".format(api_manager.dart_api_url)
     response = api_manager.dart_api.post(url, data=json.dumps(data), timeout=60)
     response.raise_for_status()
     return response.json()
+
+
+def _select_part(url):
+    response = api_manager.get(url, timeout=10)
+
+    # if the host or process doesn't exist we get a 404, don't raise exception
+    if (response.status_code == 404):
+        return
+
+    response.raise_for_status()
+    return response.json()
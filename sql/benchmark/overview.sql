@@ -0,0 +1,195 @@
+-- generates a synthetic fleet of 10,000 hosts running 200,000 processes and
+-- shows the plans and timings for the queries behind the host and process
+-- overviews. everything happens in one transaction that is rolled back at the
+-- end so it is safe to run against a development database but it will hold
+-- locks while it runs so do not run it against production. run it like this:
+--
+--   psql -X -f overview.sql
+
+BEGIN;
+
+SELECT set_config('local.userid', 'benchmark', TRUE);
+
+-- 500 processes with two environments each
+INSERT INTO dart.process (name, environment, type, configuration, schedule)
+SELECT
+    'benchmark-' || lpad(p::TEXT, 4, '0'),
+    e,
+    'program',
+    'command = /bin/true',
+    CASE WHEN p % 5 = 0 THEN '*/5 * * * *' ELSE NULL END
+FROM generate_series(1, 500) p
+CROSS JOIN (VALUES ('production'), ('development')) AS environments (e);
+
+INSERT INTO dart.host (fqdn, booted, kernel, polled)
+SELECT
+    'benchmark-' || lpad(h::TEXT, 5, '0') || '.example.com',
+    now() - interval '30 days',
+    'Linux',
+    now()
+FROM generate_series(1, 10000) h;
+
+-- every host gets 20 processes out of the 500
+INSERT INTO dart.assignment (fqdn, process_name, process_environment, disabled)
+SELECT
+    'benchmark-' || lpad(h::TEXT, 5, '0') || '.example.com',
+    'benchmark-' || lpad((((h * 7) + (i * 23)) % 500 + 1)::TEXT, 4, '0'),
+    'production',
+    (h + i) % 50 = 0
+FROM generate_series(1, 10000) h
+CROSS JOIN generate_series(1, 20) i;
+
+-- and is running every one of them, a few in a bad state
+INSERT INTO dart.active_process (fqdn, name, state, started, stopped, pid, exit_status)
+SELECT
+    fqdn,
+    process_name,
+    CASE
+        WHEN (hashtext(fqdn || process_name) % 97) = 0 THEN 'FATAL'
+        WHEN (hashtext(fqdn || process_name) % 13) = 0 THEN 'EXITED'
+        ELSE 'RUNNING'
+    END,
+    now() - interval '1 day',
+    now() - interval '1 day',
+    1234,
+    0
+FROM dart.assignment
+WHERE fqdn LIKE 'benchmark-%';
+
+-- and about five percent of them have pending changes
+INSERT INTO dart.pending_process (fqdn, name, state)
+SELECT fqdn, process_name, 'changed'
+FROM dart.assignment
+WHERE fqdn LIKE 'benchmark-%'
+  AND (hashtext(fqdn || process_name) % 20) = 0;
+
+ANALYZE dart.host;
+ANALYZE dart.process;
+ANALYZE dart.assignment;
+ANALYZE dart.active_process;
+ANALYZE dart.pending_process;
+ANALYZE dart.host_summary;
+ANALYZE dart.process_summary;
+
+-- these were the queries behind /tool/v1/hosts and /tool/v1/processes before
+-- the summary tables existed. they are still useful for checking that the
+-- summaries are correct.
+EXPLAIN (ANALYZE, BUFFERS)
+WITH active AS (
+    SELECT
+        fqdn,
+        COUNT(*) AS total,
+        COUNT(*) FILTER (WHERE state = 'RUNNING') AS running,
+        COUNT(*) FILTER (WHERE state IN ('STOPPED', 'STOPPING', 'EXITED')) AS stopped,
+        COUNT(*) FILTER (WHERE state IN ('BACKOFF', 'FATAL', 'UNKNOWN')) AS failed
+    FROM dart.active_process
+    GROUP BY fqdn
+), pending AS (
+    SELECT
+        fqdn,
+        COUNT(*) AS pending
+    FROM dart.pending_process
+    GROUP BY fqdn
+), assigned AS (
+    SELECT
+        fqdn,
+        COUNT(*) AS assigned,
+        COUNT(*) FILTER (WHERE disabled IS TRUE) AS disabled
+    FROM dart.assignment
+    GROUP BY fqdn
+)
+SELECT
+    h.fqdn,
+    to_char(h.polled, 'YYYY-MM-DD HH24:MI:SS') AS polled,
+    COALESCE(ap.total, 0) AS total,
+    COALESCE(ap.running, 0) AS running,
+    COALESCE(ap.stopped, 0) AS stopped,
+    COALESCE(ap.failed, 0) AS failed,
+    COALESCE(pp.pending, 0) AS pending,
+    COALESCE(a.assigned, 0) AS assigned,
+    COALESCE(a.disabled, 0) AS disabled
+FROM dart.host h
+LEFT OUTER JOIN active ap  ON ap.fqdn = h.fqdn
+LEFT OUTER JOIN pending pp ON pp.fqdn = h.fqdn
+LEFT OUTER JOIN assigned a ON a.fqdn = h.fqdn
+ORDER BY h.fqdn;
+
+EXPLAIN (ANALYZE, BUFFERS)
+WITH names AS (
+    SELECT name FROM dart.process
+    UNION
+    SELECT name FROM dart.active_process
+    UNION
+    SELECT name FROM dart.pending_process
+), active AS (
+    SELECT
+        name,
+        COUNT(*) AS active,
+        COUNT(*) FILTER (WHERE state IN ('BACKOFF', 'FATAL', 'UNKNOWN')) AS failed,
+        array_agg(DISTINCT fqdn) AS active_hosts
+    FROM dart.active_process
+    GROUP BY name
+), pending AS (
+    SELECT
+        name,
+        COUNT(*) AS pending,
+        array_agg(DISTINCT fqdn) AS pending_hosts
+    FROM dart.pending_process
+    GROUP BY name
+), assigned AS (
+    SELECT
+        process_name AS name,
+        COUNT(*) AS assigned,
+        COUNT(*) FILTER (WHERE disabled IS TRUE) AS disabled,
+        array_agg(DISTINCT fqdn) AS assigned_hosts,
+        array_agg(DISTINCT fqdn) FILTER (WHERE disabled IS TRUE) AS disabled_hosts
+    FROM dart.assignment
+    GROUP BY process_name
+), configured AS (
+    SELECT
+        name,
+        COUNT(*) AS configured
+    FROM dart.process
+    GROUP BY name
+)
+SELECT
+    n.name,
+    COALESCE(ap.active, 0) AS active,
+    COALESCE(ap.failed, 0) AS failed,
+    COALESCE(pp.pending, 0) AS pending,
+    COALESCE(a.assigned, 0) AS assigned,
+    COALESCE(a.disabled, 0) AS disabled,
+    COALESCE(c.configured, 0) AS configured,
+    ap.active_hosts,
+    pp.pending_hosts,
+    a.assigned_hosts,
+    a.disabled_hosts
+FROM names n
+LEFT OUTER JOIN active ap       ON ap.name = n.name
+LEFT OUTER JOIN pending pp      ON pp.name = n.name
+LEFT OUTER JOIN assigned a      ON a.name = n.name
+LEFT OUTER JOIN configured c    ON c.name = n.name
+ORDER BY n.name;
+
+-- these are the queries behind /tool/v1/hosts and /tool/v1/processes
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT
+    h.fqdn,
+    to_char(h.polled, 'YYYY-MM-DD HH24:MI:SS') AS polled,
+    COALESCE(hs.total, 0) AS total,
+    COALESCE(hs.running, 0) AS running,
+    COALESCE(hs.stopped, 0) AS stopped,
+    COALESCE(hs.failed, 0) AS failed,
+    COALESCE(hs.pending, 0) AS pending,
+    COALESCE(hs.assigned, 0) AS assigned,
+    COALESCE(hs.disabled, 0) AS disabled
+FROM dart.host h
+LEFT OUTER JOIN dart.host_summary hs ON hs.fqdn = h.fqdn
+ORDER BY h.fqdn;
+
+EXPLAIN (ANALYZE, BUFFERS)
+SELECT *
+FROM dart.process_summary
+ORDER BY name;
+
+ROLLBACK;
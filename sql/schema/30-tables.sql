@@ -2,12 +2,15 @@ CREATE TABLE dart.host (
     fqdn TEXT NOT NULL,
     booted TIMESTAMP WITH TIME ZONE,
     kernel TEXT,
-    polled TIMESTAMP WITH TIME ZONE
+    polled TIMESTAMP WITH TIME ZONE,
+    reported TIMESTAMP WITH TIME ZONE
 );
 
 COMMENT ON TABLE dart.host IS 'all hosts that are managed by dart, automatically populated, manually removed';
 COMMENT ON COLUMN dart.host.booted IS 'when the host was last rebooted';
 COMMENT ON COLUMN dart.host.kernel IS 'the kernel that the host is running';
+COMMENT ON COLUMN dart.host.polled IS 'when we last received an update from this host, applies to all of its active and pending processes';
+COMMENT ON COLUMN dart.host.reported IS 'when the host took the newest full list of active processes that we have, older lists are ignored';
 ALTER TABLE dart.host ADD PRIMARY KEY (fqdn);
 
 -------------------------------------------------------------------------------
@@ -18,11 +21,13 @@ CREATE TABLE dart.process (
     type TEXT NOT NULL,
     configuration TEXT NOT NULL,
     schedule TEXT,
+    content_hash TEXT,
     modified_at TIMESTAMP WITH TIME ZONE DEFAULT statement_timestamp() NOT NULL,
     modified_by TEXT DEFAULT standard.get_user_id() NOT NULL
 );
 
 COMMENT ON TABLE dart.process IS 'process configurations for supervisord, manually populated, manually removed';
+COMMENT ON COLUMN dart.process.content_hash IS 'a hash of the registration for this process including its monitoring configurations, used to skip registrations that did not change';
 ALTER TABLE dart.process ADD PRIMARY KEY (name, environment);
 ALTER TABLE dart.process ADD CHECK (type = 'program' OR type = 'eventlistener');
 
@@ -39,6 +44,7 @@ CREATE TABLE dart.assignment (
 
 COMMENT ON TABLE dart.assignment IS 'processes assigned to hosts, populated manually by users, manually removed';
 ALTER TABLE dart.assignment ADD PRIMARY KEY (fqdn, process_name);
+CREATE INDEX assignment_process_name_idx ON dart.assignment (process_name);
 ALTER TABLE dart.assignment ADD FOREIGN KEY (fqdn) REFERENCES dart.host (fqdn) ON DELETE RESTRICT;
 ALTER TABLE dart.assignment ADD FOREIGN KEY (process_name, process_environment) REFERENCES dart.process (name, environment) ON DELETE RESTRICT;
 
@@ -55,16 +61,15 @@ CREATE TABLE dart.active_process (
     pid bigint NOT NULL,
     exit_status INTEGER,
     description TEXT,
-    error TEXT,
-    polled TIMESTAMP WITH TIME ZONE NOT NULL
+    error TEXT
 );
 
 COMMENT ON TABLE dart.active_process IS 'processes currently active on hosts, automatically populated, automatically removed';
 COMMENT ON COLUMN dart.active_process.state IS 'corresponds with supervisord "statename"';
 COMMENT ON COLUMN dart.active_process.exit_status IS 'corresponds with supervisord "exitstatus"';
 COMMENT ON COLUMN dart.active_process.error IS 'corresponds with supervisord "spawnerr"';
-COMMENT ON COLUMN dart.active_process.polled IS 'when we last received an update for this process';
 ALTER TABLE dart.active_process ADD PRIMARY KEY (fqdn, name);
+CREATE INDEX active_process_name_idx ON dart.active_process (name);
 ALTER TABLE dart.active_process ADD FOREIGN KEY (fqdn) REFERENCES dart.host (fqdn) ON DELETE CASCADE;
 
 -------------------------------------------------------------------------------
@@ -72,12 +77,12 @@ ALTER TABLE dart.active_process ADD FOREIGN KEY (fqdn) REFERENCES dart.host (fqd
 CREATE TABLE dart.pending_process (
     fqdn TEXT NOT NULL,
     name TEXT NOT NULL,
-    state TEXT NOT NULL,
-    polled TIMESTAMP WITH TIME ZONE NOT NULL
+    state TEXT NOT NULL
 );
 
 COMMENT ON TABLE dart.pending_process IS 'processes currently pending on hosts, automatically populated, automatically removed';
 ALTER TABLE dart.pending_process ADD PRIMARY KEY (fqdn, name);
+CREATE INDEX pending_process_name_idx ON dart.pending_process (name);
 ALTER TABLE dart.pending_process ADD FOREIGN KEY (fqdn) REFERENCES dart.host(fqdn) ON DELETE CASCADE;
 ALTER TABLE dart.pending_process ADD CHECK (state = 'changed' OR state = 'added' OR state = 'removed');
 
@@ -157,3 +162,110 @@ ALTER TABLE dart.process_log_monitor ADD FOREIGN KEY (process_name, process_envi
 ALTER TABLE dart.process_log_monitor ADD CHECK (sort_order >= 0);
 ALTER TABLE dart.process_log_monitor ADD CHECK (stream IN ('stdout', 'stderr'));
 ALTER TABLE dart.process_log_monitor ADD CHECK (severity IN ('OK', '1', '2', '3', '4', '5'));
+
+-------------------------------------------------------------------------------
+
+CREATE TABLE dart.host_summary (
+    fqdn TEXT NOT NULL,
+    total BIGINT DEFAULT 0 NOT NULL,
+    running BIGINT DEFAULT 0 NOT NULL,
+    stopped BIGINT DEFAULT 0 NOT NULL,
+    failed BIGINT DEFAULT 0 NOT NULL,
+    pending BIGINT DEFAULT 0 NOT NULL,
+    assigned BIGINT DEFAULT 0 NOT NULL,
+    disabled BIGINT DEFAULT 0 NOT NULL
+);
+
+COMMENT ON TABLE dart.host_summary IS 'process counts for each host, automatically populated by triggers, automatically removed';
+COMMENT ON COLUMN dart.host_summary.total IS 'the number of processes active on the host';
+COMMENT ON COLUMN dart.host_summary.running IS 'the number of processes that are active and running';
+COMMENT ON COLUMN dart.host_summary.stopped IS 'the number of processes that are not running but not failed';
+COMMENT ON COLUMN dart.host_summary.failed IS 'the number of processes in a failed state';
+COMMENT ON COLUMN dart.host_summary.pending IS 'the number of processes that have pending configuration changes';
+COMMENT ON COLUMN dart.host_summary.assigned IS 'the number of processes that are assigned';
+COMMENT ON COLUMN dart.host_summary.disabled IS 'the number of processes that are disabled';
+ALTER TABLE dart.host_summary ADD PRIMARY KEY (fqdn);
+ALTER TABLE dart.host_summary ADD FOREIGN KEY (fqdn) REFERENCES dart.host (fqdn) ON DELETE CASCADE;
+
+-------------------------------------------------------------------------------
+
+CREATE TABLE dart.host_telemetry (
+    fqdn TEXT NOT NULL,
+    telemetry JSONB NOT NULL,
+    reported TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+COMMENT ON TABLE dart.host_telemetry IS 'the last report from the agent on each host about whether it is keeping up with supervisord, automatically populated, automatically removed, replaced on every report so it has no change triggers';
+COMMENT ON COLUMN dart.host_telemetry.telemetry IS 'how far behind supervisord the agent is, how many events it dropped since its last report, and how much work it has queued';
+COMMENT ON COLUMN dart.host_telemetry.reported IS 'when we received the report';
+ALTER TABLE dart.host_telemetry ADD PRIMARY KEY (fqdn);
+ALTER TABLE dart.host_telemetry ADD FOREIGN KEY (fqdn) REFERENCES dart.host (fqdn) ON DELETE CASCADE;
+
+-------------------------------------------------------------------------------
+
+CREATE TABLE dart.process_summary (
+    name TEXT NOT NULL,
+    active BIGINT DEFAULT 0 NOT NULL,
+    failed BIGINT DEFAULT 0 NOT NULL,
+    pending BIGINT DEFAULT 0 NOT NULL,
+    assigned BIGINT DEFAULT 0 NOT NULL,
+    disabled BIGINT DEFAULT 0 NOT NULL,
+    configured BIGINT DEFAULT 0 NOT NULL,
+    unassigned_active BIGINT DEFAULT 0 NOT NULL,
+    unassigned_pending BIGINT DEFAULT 0 NOT NULL
+);
+
+COMMENT ON TABLE dart.process_summary IS 'host counts for each process name that is configured, active or pending anywhere, automatically populated by triggers, automatically removed';
+COMMENT ON COLUMN dart.process_summary.active IS 'the number of hosts on which this process is active';
+COMMENT ON COLUMN dart.process_summary.failed IS 'the number of hosts on which this process is currently failing';
+COMMENT ON COLUMN dart.process_summary.pending IS 'the number of hosts on which this process has pending configuration changes';
+COMMENT ON COLUMN dart.process_summary.assigned IS 'the number of hosts to which this process is assigned';
+COMMENT ON COLUMN dart.process_summary.disabled IS 'the number of hosts on which this process is disabled';
+COMMENT ON COLUMN dart.process_summary.configured IS 'the number of configurations that this process has';
+COMMENT ON COLUMN dart.process_summary.unassigned_active IS 'the number of hosts on which this process is active but to which it is not assigned';
+COMMENT ON COLUMN dart.process_summary.unassigned_pending IS 'the number of hosts on which this process has pending configuration changes but to which it is not assigned';
+ALTER TABLE dart.process_summary ADD PRIMARY KEY (name);
+
+-------------------------------------------------------------------------------
+
+CREATE TABLE dart.command (
+    id TEXT NOT NULL,
+    fqdn TEXT NOT NULL,
+    action TEXT NOT NULL,
+    process TEXT,
+    version BIGINT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    message TEXT,
+    created TIMESTAMP WITH TIME ZONE NOT NULL,
+    finished TIMESTAMP WITH TIME ZONE,
+    result JSONB
+);
+
+COMMENT ON TABLE dart.command IS 'commands sent to hosts by the DartAPI so that any worker can say what happened to them, automatically populated, automatically removed some time after they finish';
+COMMENT ON COLUMN dart.command.fqdn IS 'the host that the command was sent to, not a foreign key so that commands can be sent to hosts that dart does not know about';
+COMMENT ON COLUMN dart.command.action IS 'what the host was told to do';
+COMMENT ON COLUMN dart.command.process IS 'the process that the host was told to do it to, if any';
+COMMENT ON COLUMN dart.command.version IS 'the configuration version that caused a rewrite command, if any';
+COMMENT ON COLUMN dart.command.status IS 'one of queued, retrying, sent, or failed';
+COMMENT ON COLUMN dart.command.attempts IS 'the number of times that we tried to send the command';
+COMMENT ON COLUMN dart.command.message IS 'why the command failed or why it is being tried again';
+COMMENT ON COLUMN dart.command.finished IS 'when the command was sent or given up on';
+COMMENT ON COLUMN dart.command.result IS 'what the host said about the command';
+ALTER TABLE dart.command ADD PRIMARY KEY (id);
+
+-------------------------------------------------------------------------------
+
+CREATE SEQUENCE dart.change_version_seq;
+
+CREATE TABLE dart.change (
+    scope TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version BIGINT NOT NULL
+);
+
+COMMENT ON TABLE dart.change IS 'a version for each host and process and for the lists of hosts and processes that is replaced whenever anything about them changes and a version for the configuration that each host is assigned, automatically populated by triggers, never removed';
+COMMENT ON COLUMN dart.change.scope IS 'one of host, process, or configuration';
+COMMENT ON COLUMN dart.change.name IS 'the fully qualified domain name of the host or the name of the process or an empty string for the list of all of them';
+COMMENT ON COLUMN dart.change.version IS 'taken from dart.change_version_seq, only meaningful when compared for equality';
+ALTER TABLE dart.change ADD PRIMARY KEY (scope, name);
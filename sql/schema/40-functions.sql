@@ -0,0 +1,548 @@
+CREATE OR REPLACE FUNCTION dart.update_summary(p_fqdn TEXT, p_name TEXT, p_active INTEGER, p_running INTEGER, p_stopped INTEGER, p_failed INTEGER, p_pending INTEGER, p_assigned INTEGER, p_disabled INTEGER, p_configured INTEGER, p_unassigned_active INTEGER DEFAULT 0, p_unassigned_pending INTEGER DEFAULT 0) RETURNS void
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.update_summary(p_fqdn, p_name, p_active, p_running,
+                                      p_stopped, p_failed, p_pending,
+                                      p_assigned, p_disabled, p_configured,
+                                      p_unassigned_active, p_unassigned_pending)
+    Description:  Applies changes in counts to the summary for a host and to
+                  the summary for a process. Each count argument is how much
+                  the count changed, usually -1, 0 or 1. Only counts are kept
+                  for processes because a process that runs on every host is
+                  summarized by every host. The host may be NULL for changes that are not about a host and
+                  the process may be NULL for changes that are not about a
+                  process. Process summaries are removed when the process is
+                  no longer configured, active or pending anywhere. The counts
+                  of hosts to which a process is not assigned are only kept
+                  for processes.
+    Affects:      dart.host_summary, dart.process_summary
+    Arguments:    the host, the process name and the change in each count
+    Returns:      nothing
+*/
+DECLARE
+BEGIN
+    IF (p_fqdn IS NOT NULL AND (p_active != 0 OR p_running != 0 OR p_stopped != 0 OR p_failed != 0 OR p_pending != 0 OR p_assigned != 0 OR p_disabled != 0)) THEN
+        -- this is an update and not an upsert because the summary gets
+        -- created with the host and removed with the host. if the host is in
+        -- the middle of being removed then there is nothing to update.
+        UPDATE dart.host_summary
+        SET total = total + p_active,
+            running = running + p_running,
+            stopped = stopped + p_stopped,
+            failed = failed + p_failed,
+            pending = pending + p_pending,
+            assigned = assigned + p_assigned,
+            disabled = disabled + p_disabled
+        WHERE fqdn = p_fqdn;
+    END IF;
+
+    IF (p_name IS NOT NULL AND (p_active != 0 OR p_failed != 0 OR p_pending != 0 OR p_assigned != 0 OR p_disabled != 0 OR p_configured != 0 OR p_unassigned_active != 0 OR p_unassigned_pending != 0)) THEN
+        INSERT INTO dart.process_summary (name, active, failed, pending, assigned, disabled, configured, unassigned_active, unassigned_pending)
+        VALUES (p_name, p_active, p_failed, p_pending, p_assigned, p_disabled, p_configured, p_unassigned_active, p_unassigned_pending)
+        ON CONFLICT (name) DO UPDATE
+        SET active = process_summary.active + excluded.active,
+            failed = process_summary.failed + excluded.failed,
+            pending = process_summary.pending + excluded.pending,
+            assigned = process_summary.assigned + excluded.assigned,
+            disabled = process_summary.disabled + excluded.disabled,
+            configured = process_summary.configured + excluded.configured,
+            unassigned_active = process_summary.unassigned_active + excluded.unassigned_active,
+            unassigned_pending = process_summary.unassigned_pending + excluded.unassigned_pending;
+
+        DELETE FROM dart.process_summary
+        WHERE name = p_name
+          AND active = 0
+          AND pending = 0
+          AND assigned = 0
+          AND configured = 0;
+    END IF;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.lock_assignments(p_fqdn TEXT) RETURNS void
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.lock_assignments(p_fqdn)
+    Description:  Locks a host until the end of the transaction so that only
+                  one transaction at a time can change whether the processes
+                  that are active or pending on it are assigned to it. The
+                  agent already holds this lock while it writes its processes
+                  because it updates when the host was polled first. Without
+                  it, a process being assigned while it first shows up as
+                  active would be counted by neither transaction.
+    Affects:      nothing
+    Arguments:    the host
+    Returns:      nothing
+*/
+DECLARE
+BEGIN
+    PERFORM 1
+    FROM dart.host
+    WHERE fqdn = p_fqdn
+    FOR NO KEY UPDATE;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.summarize_host() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.summarize_host()
+    Description:  Trigger function that creates an empty summary for a new
+                  host. Apply as an AFTER INSERT trigger on dart.host. The
+                  summary is removed when the host is removed.
+    Affects:      dart.host_summary
+    Arguments:    none
+    Returns:      NULL
+*/
+DECLARE
+BEGIN
+    INSERT INTO dart.host_summary (fqdn)
+    VALUES (NEW.fqdn)
+    ON CONFLICT (fqdn) DO NOTHING;
+
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.summarize_process() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.summarize_process()
+    Description:  Trigger function that counts process configurations. Apply
+                  as an AFTER INSERT OR DELETE trigger on dart.process.
+    Affects:      dart.process_summary
+    Arguments:    none
+    Returns:      NULL
+*/
+DECLARE
+BEGIN
+    IF (TG_OP = 'INSERT') THEN
+        PERFORM dart.update_summary(NULL, NEW.name, 0, 0, 0, 0, 0, 0, 0, 1);
+    ELSIF (TG_OP = 'DELETE') THEN
+        PERFORM dart.update_summary(NULL, OLD.name, 0, 0, 0, 0, 0, 0, 0, -1);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.summarize_assignment() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.summarize_assignment()
+    Description:  Trigger function that counts assigned and disabled
+                  processes. Apply as an AFTER INSERT OR UPDATE OR DELETE
+                  trigger on dart.assignment. Anything that is active or
+                  pending on the host stops or starts being counted as not
+                  assigned.
+    Affects:      dart.host_summary, dart.process_summary
+    Arguments:    none
+    Returns:      NULL
+*/
+DECLARE
+    v_active INTEGER;
+    v_pending INTEGER;
+BEGIN
+    IF (TG_OP = 'UPDATE' AND OLD.fqdn = NEW.fqdn AND OLD.process_name = NEW.process_name) THEN
+        -- this is the common case where only the disabled flag or the
+        -- environment changed and only the disabled flag matters here
+        IF (OLD.disabled IS DISTINCT FROM NEW.disabled) THEN
+            PERFORM dart.update_summary(NEW.fqdn, NEW.process_name, 0, 0, 0, 0, 0, 0, (NEW.disabled IS TRUE)::INTEGER - (OLD.disabled IS TRUE)::INTEGER, 0);
+        END IF;
+
+        RETURN NULL;
+    END IF;
+
+    IF (TG_OP = 'UPDATE' OR TG_OP = 'DELETE') THEN
+        PERFORM dart.lock_assignments(OLD.fqdn);
+        SELECT COUNT(*) INTO v_active FROM dart.active_process WHERE fqdn = OLD.fqdn AND name = OLD.process_name;
+        SELECT COUNT(*) INTO v_pending FROM dart.pending_process WHERE fqdn = OLD.fqdn AND name = OLD.process_name;
+        PERFORM dart.update_summary(OLD.fqdn, OLD.process_name, 0, 0, 0, 0, 0, -1, -(OLD.disabled IS TRUE)::INTEGER, 0, v_active, v_pending);
+    END IF;
+
+    IF (TG_OP = 'UPDATE' OR TG_OP = 'INSERT') THEN
+        PERFORM dart.lock_assignments(NEW.fqdn);
+        SELECT COUNT(*) INTO v_active FROM dart.active_process WHERE fqdn = NEW.fqdn AND name = NEW.process_name;
+        SELECT COUNT(*) INTO v_pending FROM dart.pending_process WHERE fqdn = NEW.fqdn AND name = NEW.process_name;
+        PERFORM dart.update_summary(NEW.fqdn, NEW.process_name, 0, 0, 0, 0, 0, 1, (NEW.disabled IS TRUE)::INTEGER, 0, -v_active, -v_pending);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.summarize_active_process() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.summarize_active_process()
+    Description:  Trigger function that counts active processes by state
+                  and whether they are assigned to the host. Apply as an
+                  AFTER INSERT OR UPDATE OR DELETE trigger on
+                  dart.active_process. The host and name on an active process
+                  may not be changed so updates only ever move a process
+                  from one state to another.
+    Affects:      dart.host_summary, dart.process_summary
+    Arguments:    none
+    Returns:      NULL
+*/
+DECLARE
+    v_fqdn TEXT;
+    v_name TEXT;
+    v_active INTEGER := 0;
+    v_running INTEGER := 0;
+    v_stopped INTEGER := 0;
+    v_failed INTEGER := 0;
+    v_unassigned INTEGER := 0;
+BEGIN
+    IF (TG_OP = 'INSERT' OR TG_OP = 'UPDATE') THEN
+        v_fqdn := NEW.fqdn;
+        v_name := NEW.name;
+        v_active := v_active + 1;
+        v_running := v_running + (NEW.state = 'RUNNING')::INTEGER;
+        v_stopped := v_stopped + (NEW.state IN ('STOPPED', 'STOPPING', 'EXITED'))::INTEGER;
+        v_failed := v_failed + (NEW.state IN ('BACKOFF', 'FATAL', 'UNKNOWN'))::INTEGER;
+    END IF;
+
+    IF (TG_OP = 'UPDATE' OR TG_OP = 'DELETE') THEN
+        v_fqdn := OLD.fqdn;
+        v_name := OLD.name;
+        v_active := v_active - 1;
+        v_running := v_running - (OLD.state = 'RUNNING')::INTEGER;
+        v_stopped := v_stopped - (OLD.state IN ('STOPPED', 'STOPPING', 'EXITED'))::INTEGER;
+        v_failed := v_failed - (OLD.state IN ('BACKOFF', 'FATAL', 'UNKNOWN'))::INTEGER;
+    END IF;
+
+    IF (v_active != 0) THEN
+        PERFORM dart.lock_assignments(v_fqdn);
+        IF (NOT EXISTS (SELECT 1 FROM dart.assignment WHERE fqdn = v_fqdn AND process_name = v_name)) THEN
+            v_unassigned := v_active;
+        END IF;
+    END IF;
+
+    PERFORM dart.update_summary(v_fqdn, v_name, v_active, v_running, v_stopped, v_failed, 0, 0, 0, 0, v_unassigned, 0);
+
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.summarize_pending_process() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.summarize_pending_process()
+    Description:  Trigger function that counts pending processes and
+                  whether they are assigned to the host. Apply as an AFTER
+                  INSERT OR DELETE trigger on dart.pending_process. Updates
+                  only change the kind of pending change which is not
+                  counted.
+    Affects:      dart.host_summary, dart.process_summary
+    Arguments:    none
+    Returns:      NULL
+*/
+DECLARE
+    v_unassigned INTEGER;
+BEGIN
+    IF (TG_OP = 'INSERT') THEN
+        PERFORM dart.lock_assignments(NEW.fqdn);
+        v_unassigned := (NOT EXISTS (SELECT 1 FROM dart.assignment WHERE fqdn = NEW.fqdn AND process_name = NEW.name))::INTEGER;
+        PERFORM dart.update_summary(NEW.fqdn, NEW.name, 0, 0, 0, 0, 1, 0, 0, 0, 0, v_unassigned);
+    ELSIF (TG_OP = 'DELETE') THEN
+        PERFORM dart.lock_assignments(OLD.fqdn);
+        v_unassigned := (NOT EXISTS (SELECT 1 FROM dart.assignment WHERE fqdn = OLD.fqdn AND process_name = OLD.name))::INTEGER;
+        PERFORM dart.update_summary(OLD.fqdn, OLD.name, 0, 0, 0, 0, -1, 0, 0, 0, 0, -v_unassigned);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.rebuild_summaries() RETURNS void
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.rebuild_summaries()
+    Description:  Throws away all host and process summaries and recounts
+                  them from scratch. The triggers keep the summaries up to
+                  date so this only needs to be run to populate summaries on
+                  an existing database or if something has gone wrong. It
+                  locks everything that is summarized while it runs.
+    Affects:      dart.host_summary, dart.process_summary
+    Arguments:    none
+    Returns:      nothing
+*/
+DECLARE
+BEGIN
+    LOCK TABLE dart.host, dart.process, dart.assignment, dart.active_process, dart.pending_process IN SHARE MODE;
+
+    DELETE FROM dart.host_summary;
+    DELETE FROM dart.process_summary;
+
+    INSERT INTO dart.host_summary (fqdn, total, running, stopped, failed, pending, assigned, disabled)
+    SELECT
+        h.fqdn,
+        COALESCE(ap.total, 0),
+        COALESCE(ap.running, 0),
+        COALESCE(ap.stopped, 0),
+        COALESCE(ap.failed, 0),
+        COALESCE(pp.pending, 0),
+        COALESCE(a.assigned, 0),
+        COALESCE(a.disabled, 0)
+    FROM dart.host h
+    LEFT OUTER JOIN (
+        SELECT
+            fqdn,
+            COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE state = 'RUNNING') AS running,
+            COUNT(*) FILTER (WHERE state IN ('STOPPED', 'STOPPING', 'EXITED')) AS stopped,
+            COUNT(*) FILTER (WHERE state IN ('BACKOFF', 'FATAL', 'UNKNOWN')) AS failed
+        FROM dart.active_process
+        GROUP BY fqdn
+    ) ap ON ap.fqdn = h.fqdn
+    LEFT OUTER JOIN (
+        SELECT fqdn, COUNT(*) AS pending
+        FROM dart.pending_process
+        GROUP BY fqdn
+    ) pp ON pp.fqdn = h.fqdn
+    LEFT OUTER JOIN (
+        SELECT fqdn, COUNT(*) AS assigned, COUNT(*) FILTER (WHERE disabled IS TRUE) AS disabled
+        FROM dart.assignment
+        GROUP BY fqdn
+    ) a ON a.fqdn = h.fqdn;
+
+    INSERT INTO dart.process_summary (name, active, failed, pending, assigned, disabled, configured, unassigned_active, unassigned_pending)
+    SELECT
+        n.name,
+        COALESCE(ap.active, 0),
+        COALESCE(ap.failed, 0),
+        COALESCE(pp.pending, 0),
+        COALESCE(a.assigned, 0),
+        COALESCE(a.disabled, 0),
+        COALESCE(c.configured, 0),
+        COALESCE(ap.unassigned, 0),
+        COALESCE(pp.unassigned, 0)
+    FROM (
+        SELECT name FROM dart.process
+        UNION
+        SELECT name FROM dart.active_process
+        UNION
+        SELECT name FROM dart.pending_process
+    ) n
+    LEFT OUTER JOIN (
+        SELECT
+            ap.name,
+            COUNT(*) AS active,
+            COUNT(*) FILTER (WHERE ap.state IN ('BACKOFF', 'FATAL', 'UNKNOWN')) AS failed,
+            COUNT(*) FILTER (WHERE a.fqdn IS NULL) AS unassigned
+        FROM dart.active_process ap
+        LEFT OUTER JOIN dart.assignment a ON a.fqdn = ap.fqdn AND a.process_name = ap.name
+        GROUP BY ap.name
+    ) ap ON ap.name = n.name
+    LEFT OUTER JOIN (
+        SELECT
+            pp.name,
+            COUNT(*) AS pending,
+            COUNT(*) FILTER (WHERE a.fqdn IS NULL) AS unassigned
+        FROM dart.pending_process pp
+        LEFT OUTER JOIN dart.assignment a ON a.fqdn = pp.fqdn AND a.process_name = pp.name
+        GROUP BY pp.name
+    ) pp ON pp.name = n.name
+    LEFT OUTER JOIN (
+        SELECT
+            process_name AS name,
+            COUNT(*) AS assigned,
+            COUNT(*) FILTER (WHERE disabled IS TRUE) AS disabled
+        FROM dart.assignment
+        GROUP BY process_name
+    ) a ON a.name = n.name
+    LEFT OUTER JOIN (
+        SELECT name, COUNT(*) AS configured
+        FROM dart.process
+        GROUP BY name
+    ) c ON c.name = n.name;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.record_change(p_scope TEXT, p_name TEXT) RETURNS void
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.record_change(p_scope, p_name)
+    Description:  Gives a host or a process a new version. Versions come from
+                  a sequence so they are never reused but they are not in
+                  commit order so they should only be compared for equality.
+    Affects:      dart.change
+    Arguments:    either "host" or "process" and the name of the host or
+                  process or an empty string for the list of them
+    Returns:      nothing
+*/
+DECLARE
+BEGIN
+    IF (p_name IS NULL) THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO dart.change (scope, name, version)
+    VALUES (p_scope, p_name, nextval('dart.change_version_seq'))
+    ON CONFLICT (scope, name) DO UPDATE
+    SET version = excluded.version;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.record_row_change() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.record_row_change()
+    Description:  Trigger function that gives the host and the process in
+                  the changed row new versions. Apply as an AFTER INSERT OR
+                  UPDATE OR DELETE trigger. The first argument is the column
+                  that has the fully qualified domain name of the host and the
+                  second argument is the column that has the name of the
+                  process. Either may be an empty string if the table has no
+                  such column. If a third argument is given then it is the
+                  column that has the process environment and every host to
+                  which that process environment is assigned will also get a
+                  new version.
+    Affects:      dart.change
+    Arguments:    host column, process column, optional environment column
+    Returns:      NULL
+*/
+DECLARE
+    v_rows JSONB[];
+    v_row JSONB;
+BEGIN
+    IF (TG_OP = 'INSERT' OR TG_OP = 'UPDATE') THEN
+        v_rows := array_append(v_rows, to_jsonb(NEW));
+    END IF;
+    IF (TG_OP = 'UPDATE' OR TG_OP = 'DELETE') THEN
+        v_rows := array_append(v_rows, to_jsonb(OLD));
+    END IF;
+
+    FOREACH v_row IN ARRAY v_rows LOOP
+        IF (TG_ARGV[0] != '') THEN
+            PERFORM dart.record_change('host', v_row ->> TG_ARGV[0]);
+        END IF;
+
+        IF (TG_ARGV[1] != '') THEN
+            PERFORM dart.record_change('process', v_row ->> TG_ARGV[1]);
+        END IF;
+
+        IF (TG_NARGS > 2) THEN
+            PERFORM dart.record_change('host', a.fqdn)
+            FROM dart.assignment a
+            WHERE a.process_name = v_row ->> TG_ARGV[1]
+              AND a.process_environment = v_row ->> TG_ARGV[2];
+        END IF;
+    END LOOP;
+
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.record_list_change() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.record_list_change()
+    Description:  Trigger function that gives the list of hosts or the list of
+                  processes or both new versions. Apply as an AFTER INSERT OR
+                  UPDATE OR DELETE constraint trigger that is DEFERRABLE
+                  INITIALLY DEFERRED. Every transaction that changes anything
+                  would otherwise wait on the same row for as long as it runs.
+                  Deferred, the row is only locked while committing and it is
+                  only updated once per transaction.
+    Affects:      dart.change
+    Arguments:    any of "host" and "process"
+    Returns:      NULL
+*/
+DECLARE
+    v_scope TEXT;
+BEGIN
+    FOREACH v_scope IN ARRAY TG_ARGV LOOP
+        IF (COALESCE(current_setting('dart.changed_' || v_scope, TRUE), '') != 'true') THEN
+            PERFORM dart.record_change(v_scope, '');
+            PERFORM set_config('dart.changed_' || v_scope, 'true', TRUE);
+        END IF;
+    END LOOP;
+
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION dart.record_configuration_change() RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+/*
+    Function:     dart.record_configuration_change()
+    Description:  Trigger function that gives every host whose configuration
+                  is affected by the changed row a new configuration version
+                  and sends the host and its new version as a notification on
+                  the "dart_configuration" channel. Apply as an AFTER INSERT OR
+                  UPDATE OR DELETE trigger. The first argument is the column
+                  that has the fully qualified domain name of the host. If it
+                  is an empty string then the second and third arguments are
+                  the columns that have the process name and environment and
+                  every host to which that process environment is assigned is
+                  affected. Notifications are only delivered when the
+                  transaction commits.
+    Affects:      dart.change
+    Arguments:    host column, optional process column, optional environment
+                  column
+    Returns:      NULL
+*/
+DECLARE
+    v_rows JSONB[];
+    v_row JSONB;
+    v_fqdn TEXT;
+    v_version BIGINT;
+BEGIN
+    IF (TG_OP = 'INSERT' OR TG_OP = 'UPDATE') THEN
+        v_rows := array_append(v_rows, to_jsonb(NEW));
+    END IF;
+    IF (TG_OP = 'UPDATE' OR TG_OP = 'DELETE') THEN
+        v_rows := array_append(v_rows, to_jsonb(OLD));
+    END IF;
+
+    FOREACH v_row IN ARRAY v_rows LOOP
+        FOR v_fqdn IN
+            SELECT v_row ->> TG_ARGV[0]
+            WHERE TG_ARGV[0] != ''
+            UNION
+            SELECT a.fqdn
+            FROM dart.assignment a
+            WHERE TG_ARGV[0] = ''
+              AND a.process_name = v_row ->> TG_ARGV[1]
+              AND a.process_environment = v_row ->> TG_ARGV[2]
+        LOOP
+            CONTINUE WHEN v_fqdn IS NULL;
+
+            INSERT INTO dart.change (scope, name, version)
+            VALUES ('configuration', v_fqdn, nextval('dart.change_version_seq'))
+            ON CONFLICT (scope, name) DO UPDATE
+            SET version = excluded.version
+            RETURNING version INTO v_version;
+
+            PERFORM pg_notify('dart_configuration', v_fqdn || ' ' || v_version);
+        END LOOP;
+    END LOOP;
+
+    RETURN NULL;
+END;
+$$;
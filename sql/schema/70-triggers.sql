@@ -11,3 +11,34 @@ CREATE TRIGGER t50_distinct_update BEFORE UPDATE ON dart.active_process FOR EACH
 CREATE TRIGGER t11_anchored_column_fqdn BEFORE UPDATE ON dart.pending_process FOR EACH ROW EXECUTE PROCEDURE standard.anchored_column('fqdn');
 CREATE TRIGGER t11_anchored_column_name BEFORE UPDATE ON dart.pending_process FOR EACH ROW EXECUTE PROCEDURE standard.anchored_column('name');
 CREATE TRIGGER t50_distinct_update BEFORE UPDATE ON dart.pending_process FOR EACH ROW EXECUTE PROCEDURE standard.distinct_update();
+
+CREATE TRIGGER t80_summary AFTER INSERT ON dart.host FOR EACH ROW EXECUTE PROCEDURE dart.summarize_host();
+CREATE TRIGGER t80_summary AFTER INSERT OR DELETE ON dart.process FOR EACH ROW EXECUTE PROCEDURE dart.summarize_process();
+CREATE TRIGGER t80_summary AFTER INSERT OR UPDATE OR DELETE ON dart.assignment FOR EACH ROW EXECUTE PROCEDURE dart.summarize_assignment();
+CREATE TRIGGER t80_summary AFTER INSERT OR UPDATE OR DELETE ON dart.active_process FOR EACH ROW EXECUTE PROCEDURE dart.summarize_active_process();
+CREATE TRIGGER t80_summary AFTER INSERT OR DELETE ON dart.pending_process FOR EACH ROW EXECUTE PROCEDURE dart.summarize_pending_process();
+
+CREATE TRIGGER t90_change AFTER INSERT OR DELETE ON dart.host FOR EACH ROW EXECUTE PROCEDURE dart.record_row_change('fqdn', '');
+CREATE TRIGGER t90_change_update AFTER UPDATE ON dart.host FOR EACH ROW WHEN (OLD.booted IS DISTINCT FROM NEW.booted OR OLD.kernel IS DISTINCT FROM NEW.kernel) EXECUTE PROCEDURE dart.record_row_change('fqdn', '');
+CREATE TRIGGER t90_change AFTER INSERT OR UPDATE OR DELETE ON dart.process FOR EACH ROW EXECUTE PROCEDURE dart.record_row_change('', 'name', 'environment');
+CREATE TRIGGER t90_change AFTER INSERT OR UPDATE OR DELETE ON dart.assignment FOR EACH ROW EXECUTE PROCEDURE dart.record_row_change('fqdn', 'process_name');
+CREATE TRIGGER t90_change AFTER INSERT OR UPDATE OR DELETE ON dart.active_process FOR EACH ROW EXECUTE PROCEDURE dart.record_row_change('fqdn', '');
+CREATE TRIGGER t90_change AFTER INSERT OR UPDATE OR DELETE ON dart.pending_process FOR EACH ROW EXECUTE PROCEDURE dart.record_row_change('fqdn', 'name');
+CREATE TRIGGER t90_change AFTER INSERT OR UPDATE OR DELETE ON dart.process_state_monitor FOR EACH ROW EXECUTE PROCEDURE dart.record_row_change('', 'process_name', 'process_environment');
+CREATE TRIGGER t90_change AFTER INSERT OR UPDATE OR DELETE ON dart.process_daemon_monitor FOR EACH ROW EXECUTE PROCEDURE dart.record_row_change('', 'process_name', 'process_environment');
+CREATE TRIGGER t90_change AFTER INSERT OR UPDATE OR DELETE ON dart.process_heartbeat_monitor FOR EACH ROW EXECUTE PROCEDURE dart.record_row_change('', 'process_name', 'process_environment');
+CREATE TRIGGER t90_change AFTER INSERT OR UPDATE OR DELETE ON dart.process_log_monitor FOR EACH ROW EXECUTE PROCEDURE dart.record_row_change('', 'process_name', 'process_environment');
+
+CREATE CONSTRAINT TRIGGER t91_list_change AFTER INSERT OR DELETE ON dart.host DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE dart.record_list_change('host');
+CREATE CONSTRAINT TRIGGER t91_list_change AFTER INSERT OR UPDATE OR DELETE ON dart.process DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE dart.record_list_change('process');
+CREATE CONSTRAINT TRIGGER t91_list_change AFTER INSERT OR UPDATE OR DELETE ON dart.assignment DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE dart.record_list_change('host', 'process');
+CREATE CONSTRAINT TRIGGER t91_list_change AFTER INSERT OR DELETE ON dart.active_process DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE dart.record_list_change('host', 'process');
+CREATE CONSTRAINT TRIGGER t91_list_change_update AFTER UPDATE ON dart.active_process DEFERRABLE INITIALLY DEFERRED FOR EACH ROW WHEN (OLD.state IS DISTINCT FROM NEW.state) EXECUTE PROCEDURE dart.record_list_change('host', 'process');
+CREATE CONSTRAINT TRIGGER t91_list_change AFTER INSERT OR UPDATE OR DELETE ON dart.pending_process DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE dart.record_list_change('host', 'process');
+
+CREATE TRIGGER t92_configuration_change AFTER INSERT OR UPDATE OR DELETE ON dart.process FOR EACH ROW EXECUTE PROCEDURE dart.record_configuration_change('', 'name', 'environment');
+CREATE TRIGGER t92_configuration_change AFTER INSERT OR UPDATE OR DELETE ON dart.assignment FOR EACH ROW EXECUTE PROCEDURE dart.record_configuration_change('fqdn');
+CREATE TRIGGER t92_configuration_change AFTER INSERT OR UPDATE OR DELETE ON dart.process_state_monitor FOR EACH ROW EXECUTE PROCEDURE dart.record_configuration_change('', 'process_name', 'process_environment');
+CREATE TRIGGER t92_configuration_change AFTER INSERT OR UPDATE OR DELETE ON dart.process_daemon_monitor FOR EACH ROW EXECUTE PROCEDURE dart.record_configuration_change('', 'process_name', 'process_environment');
+CREATE TRIGGER t92_configuration_change AFTER INSERT OR UPDATE OR DELETE ON dart.process_heartbeat_monitor FOR EACH ROW EXECUTE PROCEDURE dart.record_configuration_change('', 'process_name', 'process_environment');
+CREATE TRIGGER t92_configuration_change AFTER INSERT OR UPDATE OR DELETE ON dart.process_log_monitor FOR EACH ROW EXECUTE PROCEDURE dart.record_configuration_change('', 'process_name', 'process_environment');
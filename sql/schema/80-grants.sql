@@ -24,3 +24,19 @@ GRANT INSERT,DELETE,UPDATE ON TABLE dart.process_heartbeat_monitor TO dart;
 
 GRANT SELECT ON TABLE dart.process_log_monitor TO PUBLIC;
 GRANT INSERT,DELETE,UPDATE ON TABLE dart.process_log_monitor TO dart;
+
+GRANT SELECT ON TABLE dart.host_summary TO PUBLIC;
+GRANT INSERT,DELETE,UPDATE ON TABLE dart.host_summary TO dart;
+
+GRANT SELECT ON TABLE dart.host_telemetry TO PUBLIC;
+GRANT INSERT,DELETE,UPDATE ON TABLE dart.host_telemetry TO dart;
+
+GRANT SELECT ON TABLE dart.process_summary TO PUBLIC;
+GRANT INSERT,DELETE,UPDATE ON TABLE dart.process_summary TO dart;
+
+GRANT SELECT ON TABLE dart.command TO PUBLIC;
+GRANT INSERT,DELETE,UPDATE ON TABLE dart.command TO dart;
+
+GRANT SELECT ON TABLE dart.change TO PUBLIC;
+GRANT INSERT,DELETE,UPDATE ON TABLE dart.change TO dart;
+GRANT USAGE ON SEQUENCE dart.change_version_seq TO dart;
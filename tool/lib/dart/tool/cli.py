@@ -1,69 +1,85 @@
 """
 This is a tool that controls the dart system. It provides these commands:
 
-* register <file>
-  Registers a dart configuration file.
+* register [--dry-run] <file>
+  Registers a dart configuration file. Only processes whose configurations
+  have changed are written. With --dry-run nothing is written and you are
+  told what would have changed.
 
-* hosts
-  Lists all hosts and brief details about those hosts.
+* hosts [--prefix <prefix>] [--state <state>] [--failed] [--pending] [--by-lag]
+  Lists all hosts and brief details about those hosts. The list can be limited
+  to hosts whose names start with a prefix or that have at least one process
+  in a given state. The "lagging" state lists hosts whose agents are falling
+  behind supervisord and --by-lag lists the ones furthest behind first.
 
 * host <fqdn>
   Lists verbose details about a particular host.
 
-* processes
-  Lists all processes and brief details about each process.
+* processes [--prefix <prefix>] [--state <state>] [--failed] [--pending]
+  Lists all processes and brief details about each process. The list can be
+  limited to processes whose names start with a prefix or that are in a given
+  state on at least one host.
 
 * process <name>
   Lists verbose details about a particular process.
 
-* assign <process> <environment> <fqdn>
-  Assigns a process environment to a host. Only one process environment may be
+* assign <process> <environment> <fqdn> [<fqdn> ...]
+  Assigns a process environment to hosts. Only one process environment may be
   assigned to a host at one time. As soon as the assignment change is pushed to
   the host then the process will be marked on the host as "pending add". You
-  will need to tell the host to "update" the process.
+  will need to tell the host to "update" the process. If any of the hosts can't
+  be assigned the process then none of them will be.
 
-* unassign <process> <fqdn>
-  Unassigns a process from a host. Only one process environment may be assigned
+* unassign <process> <fqdn> [<fqdn> ...]
+  Unassigns a process from hosts. Only one process environment may be assigned
   to a host at one time so you do not need to give the environment name when
   unassigning a process from a host. As soon as the assignment change is pushed
   to the host then the process will be marked on the host as "pending removal".
   You will need to tell the host to "update" the process.
 
-* enable <process> <fqdn>
-  Enables a process on a host. When a process is "disabled" it will no longer
+* enable <process> <fqdn> [<fqdn> ...]
+  Enables a process on hosts. When a process is "disabled" it will no longer
   be scheduled to run on that host and any monitoring events that the process
   generates will be ignored and not forwarded to the event monitoring system.
 
-* disable <process> <fqdn>
-  Disables a process on a host. When a process is "disabled" it will no longer
+* disable <process> <fqdn> [<fqdn> ...]
+  Disables a process on hosts. When a process is "disabled" it will no longer
   be scheduled to run on that host and any monitoring events that the process
   generates will be ignored and not forwarded to the event monitoring system.
 
-* start <process> <fqdn>
-  Starts a process on a host. If the process is not assigned and added to this
-  host or if the process is already started then this command will do nothing.
-
-* stop <process> <fqdn>
-  Stops a process on a host. If the process is not assigned and added to this
-  host or if the process is already stopped then this command will do nothing.
-
-* restart <process> <fqdn>
-  Restarts a process on a host. If the process is not assigned and added to
-  this host then this command will do nothing. If the process is not running it
-  will be started.
-
-* update <process> <fqdn>
-  Updates the configuration for a process on a particular host. Note that this
-  will stop the process and restart it. If you do not want to stop and restart
-  the process at this time then do not run this command.
-
-* reread <fqdn>
-  Tells the host to reread its pending configurations. Normally pending
+* start <process> [<fqdn> ...] [--all] [--parallelism <n>] [--batch <n>]
+  Starts a process on hosts. If the process is not assigned and added to a
+  host or if the process is already started then this command will do nothing
+  on that host.
+
+* stop <process> [<fqdn> ...] [--all] [--parallelism <n>] [--batch <n>]
+  Stops a process on hosts. If the process is not assigned and added to a host
+  or if the process is already stopped then this command will do nothing on
+  that host.
+
+* restart <process> [<fqdn> ...] [--all] [--parallelism <n>] [--batch <n>]
+  Restarts a process on hosts. If the process is not assigned and added to a
+  host then this command will do nothing on that host. If the process is not
+  running it will be started.
+
+* update <process> [<fqdn> ...] [--all] [--parallelism <n>] [--batch <n>]
+  Updates the configuration for a process on hosts. Note that this will stop
+  the process and restart it. If you do not want to stop and restart the
+  process at this time then do not run this command.
+
+  These four commands take either a list of hosts or "--all" to use every host
+  that the process is assigned to. With more than one host the commands are
+  sent to "--parallelism" hosts at a time. With "--batch" the hosts are done in
+  groups of that size and a group doesn't start until the one before it has
+  finished which is useful for rolling restarts.
+
+* reread <fqdn> [<fqdn> ...] [--parallelism <n>] [--batch <n>]
+  Tells hosts to reread their pending configurations. Normally pending
   configurations are updated in the data store once per minute. If you are
   impatient then use this command to get the update faster.
 
-* rewrite <fqdn>
-  Tells the host to rewrite its pending configurations. Normally pending
+* rewrite <fqdn> [<fqdn> ...] [--parallelism <n>] [--batch <n>]
+  Tells hosts to rewrite their pending configurations. Normally pending
   configurations are written to the host once per minute. If you are impatient
   then use this command to get the update faster.
 
@@ -101,11 +117,17 @@ def main():
     # register a dart configuration file
     subparser = subparsers.add_parser("register", help="register a dart configuration file")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
+    subparser.add_argument("--dry-run", dest="dry_run", action="store_true", default=False, help="show what would change without changing anything")
     subparser.add_argument("path", help="path to file to register (use - to read from stdin)")
 
     # options for the "hosts" command
     subparser = subparsers.add_parser("hosts", help="details about all hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
+    subparser.add_argument("--prefix", default=None, help="only show host names starting with this")
+    subparser.add_argument("--state", dest="states", action="append", choices=["running", "stopped", "failed", "pending", "assigned", "disabled", "lagging"], help="only show hosts with processes in this state or whose agents are lagging (may be repeated)")
+    subparser.add_argument("--failed", action="store_true", default=False, help="only show hosts with failed processes")
+    subparser.add_argument("--pending", action="store_true", default=False, help="only show hosts with pending changes")
+    subparser.add_argument("--by-lag", dest="by_lag", action="store_true", default=False, help="show the hosts whose agents are furthest behind first")
 
     # options for the "host" command
     subparser = subparsers.add_parser("host", help="details about a specific host")
@@ -115,6 +137,10 @@ def main():
     # options for the "processes" command
     subparser = subparsers.add_parser("processes", help="details about all processes")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
+    subparser.add_argument("--prefix", default=None, help="only show process names starting with this")
+    subparser.add_argument("--state", dest="states", action="append", choices=["active", "failed", "pending", "assigned", "disabled", "configured"], help="only show processes in this state on at least one host (may be repeated)")
+    subparser.add_argument("--failed", action="store_true", default=False, help="only show processes that have failed on at least one host")
+    subparser.add_argument("--pending", action="store_true", default=False, help="only show processes with pending changes")
 
     # options for the "process" command
     subparser = subparsers.add_parser("process", help="details about a specific process")
@@ -122,63 +148,79 @@ def main():
     subparser.add_argument("name", metavar="process", help="name of process")
 
     # options for the "assign" command
-    subparser = subparsers.add_parser("assign", help="assign a process to a host")
+    subparser = subparsers.add_parser("assign", help="assign a process to hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
     subparser.add_argument("process_name", metavar="process", help="name of process")
     subparser.add_argument("process_environment", metavar="environment", help="name of process environment")
-    subparser.add_argument("fqdn", help="fully qualified domain name")
+    subparser.add_argument("fqdns", metavar="fqdn", nargs="+", help="fully qualified domain names")
 
     # options for the "unassign" command
-    subparser = subparsers.add_parser("unassign", help="unassign a process from a host")
+    subparser = subparsers.add_parser("unassign", help="unassign a process from hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
     subparser.add_argument("process_name", metavar="process", help="name of process")
-    subparser.add_argument("fqdn", help="fully qualified domain name")
+    subparser.add_argument("fqdns", metavar="fqdn", nargs="+", help="fully qualified domain names")
 
     # options for the "enable" command
-    subparser = subparsers.add_parser("enable", help="enable a process on a host")
+    subparser = subparsers.add_parser("enable", help="enable a process on hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
     subparser.add_argument("process_name", metavar="process", help="name of process")
-    subparser.add_argument("fqdn", help="fully qualified domain name")
+    subparser.add_argument("fqdns", metavar="fqdn", nargs="+", help="fully qualified domain names")
 
     # options for the "disable" command
-    subparser = subparsers.add_parser("disable", help="disable a process on a host")
+    subparser = subparsers.add_parser("disable", help="disable a process on hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
     subparser.add_argument("process_name", metavar="process", help="name of process")
-    subparser.add_argument("fqdn", help="fully qualified domain name")
+    subparser.add_argument("fqdns", metavar="fqdn", nargs="+", help="fully qualified domain names")
 
     # options for the "start" command
-    subparser = subparsers.add_parser("start", help="start a process on a host")
+    subparser = subparsers.add_parser("start", help="start a process on hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
     subparser.add_argument("process_name", metavar="process", help="name of process")
-    subparser.add_argument("fqdn", help="fully qualified domain name")
+    subparser.add_argument("fqdns", metavar="fqdn", nargs="*", help="fully qualified domain names")
+    subparser.add_argument("--all", dest="all_hosts", action="store_true", default=False, help="use every host that the process is assigned to")
+    subparser.add_argument("--parallelism", type=int, default=None, help="how many hosts to send to at the same time")
+    subparser.add_argument("--batch", type=int, default=None, help="how many hosts to finish before moving on to the next ones")
 
     # options for the "stop" command
-    subparser = subparsers.add_parser("stop", help="stop a process on a host")
+    subparser = subparsers.add_parser("stop", help="stop a process on hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
     subparser.add_argument("process_name", metavar="process", help="name of process")
-    subparser.add_argument("fqdn", help="fully qualified domain name")
+    subparser.add_argument("fqdns", metavar="fqdn", nargs="*", help="fully qualified domain names")
+    subparser.add_argument("--all", dest="all_hosts", action="store_true", default=False, help="use every host that the process is assigned to")
+    subparser.add_argument("--parallelism", type=int, default=None, help="how many hosts to send to at the same time")
+    subparser.add_argument("--batch", type=int, default=None, help="how many hosts to finish before moving on to the next ones")
 
     # options for the "restart" command
-    subparser = subparsers.add_parser("restart", help="restart a process on a host")
+    subparser = subparsers.add_parser("restart", help="restart a process on hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
     subparser.add_argument("process_name", metavar="process", help="name of process")
-    subparser.add_argument("fqdn", help="fully qualified domain name")
+    subparser.add_argument("fqdns", metavar="fqdn", nargs="*", help="fully qualified domain names")
+    subparser.add_argument("--all", dest="all_hosts", action="store_true", default=False, help="use every host that the process is assigned to")
+    subparser.add_argument("--parallelism", type=int, default=None, help="how many hosts to send to at the same time")
+    subparser.add_argument("--batch", type=int, default=None, help="how many hosts to finish before moving on to the next ones")
 
     # options for the "update" command
-    subparser = subparsers.add_parser("update", help="update a process configuration on a host")
+    subparser = subparsers.add_parser("update", help="update a process configuration on hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
     subparser.add_argument("process_name", metavar="process", help="name of process")
-    subparser.add_argument("fqdn", help="fully qualified domain name")
+    subparser.add_argument("fqdns", metavar="fqdn", nargs="*", help="fully qualified domain names")
+    subparser.add_argument("--all", dest="all_hosts", action="store_true", default=False, help="use every host that the process is assigned to")
+    subparser.add_argument("--parallelism", type=int, default=None, help="how many hosts to send to at the same time")
+    subparser.add_argument("--batch", type=int, default=None, help="how many hosts to finish before moving on to the next ones")
 
     # options for the "reread" command
-    subparser = subparsers.add_parser("reread", help="reread a host's supervisor configuration")
+    subparser = subparsers.add_parser("reread", help="reread the supervisor configuration on hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
-    subparser.add_argument("fqdn", help="fully qualified domain name")
+    subparser.add_argument("fqdns", metavar="fqdn", nargs="+", help="fully qualified domain names")
+    subparser.add_argument("--parallelism", type=int, default=None, help="how many hosts to send to at the same time")
+    subparser.add_argument("--batch", type=int, default=None, help="how many hosts to finish before moving on to the next ones")
 
     # options for the "rewrite" command
-    subparser = subparsers.add_parser("rewrite", help="rewrite a host's supervisor configuration")
+    subparser = subparsers.add_parser("rewrite", help="rewrite the supervisor configuration on hosts")
     subparser.add_argument("-v", "--verbose", dest="verbose", action="store_true", default=False, help="send verbose output to the console")
-    subparser.add_argument("fqdn", help="fully qualified domain name")
+    subparser.add_argument("fqdns", metavar="fqdn", nargs="+", help="fully qualified domain names")
+    subparser.add_argument("--parallelism", type=int, default=None, help="how many hosts to send to at the same time")
+    subparser.add_argument("--batch", type=int, default=None, help="how many hosts to finish before moving on to the next ones")
 
     # options for the "delete-host" command
     subparser = subparsers.add_parser("delete-host", help="delete a host and all its configurations")
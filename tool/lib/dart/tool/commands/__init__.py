@@ -1,9 +1,10 @@
 import logging
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from termcolor import colored
 import urllib.parse
+import json
+import time
 from dart.common.settings import SettingsManager
+import dart.common.http
 
 
 class BaseCommand(object):
@@ -13,31 +14,30 @@ class BaseCommand(object):
         # settings are only needed here, to connect to the api
         settings_manager = SettingsManager()
 
-        # this sets a custom retry policy. we will retry a few times in case we
-        # hit a server that is transitioning into offline state.
-        retries = 3
-        retry = Retry(
-            total=retries,
-            read=retries,
-            connect=retries,
-            backoff_factor=0.3,
-            status_forcelist=(500, 502, 503, 504),
-        )
-
-        # modify the number of retries that we will make. we will also block
-        # until we get a connection to the remote server.
-        self.dart_api = requests.Session()
-        self.dart_api.cert = settings_manager.get("tool.api.dart.key")
-        self.dart_api.verify = settings_manager.get("tool.api.dart.ca")
-        self.dart_api.mount("https://", HTTPAdapter(pool_block=True, max_retries=retry))
+        # we will retry a few times in case we hit a server that is
+        # transitioning into offline state and block until we get a connection
+        # to the remote server. these can be changed in the settings.
+        self.dart_api = dart.common.http.create_session_from_settings(settings_manager, "tool.api.dart", retries=3, backoff=0.3)
         self.dart_api_url = settings_manager.get("tool.api.dart.url")
 
+        # remember responses so that asking for the same thing again only
+        # costs a round trip if it hasn't changed
+        self.dart_api_cache = dart.common.http.ResponseCache()
+
     def run(self, **kwargs):
         raise NotImplementedError("must be implemented in base class")
 
+    def get(self, url, **kwargs):
+        return self.dart_api_cache.get(self.dart_api, url, **kwargs)
+
+    def stream(self, url, params=None):
+        # ask for newline delimited json and hand back each record as soon as
+        # it arrives rather than waiting for the whole list
+        yield from self.dart_api_cache.stream(self.dart_api, url, params=params, timeout=10)
+
     def is_valid_host(self, fqdn):
         url = "{}/tool/v1/hosts/{}".format(self.dart_api_url, urllib.parse.quote(fqdn))
-        response = self.dart_api.get(url, timeout=10)
+        response = self.get(url, timeout=10)
 
         # see if the host is valid
         if (response.status_code == 200):
@@ -50,7 +50,7 @@ class BaseCommand(object):
 
     def is_valid_process(self, name):
         url = "{}/tool/v1/processes/{}".format(self.dart_api_url, urllib.parse.quote(name))
-        response = self.dart_api.get(url, timeout=10)
+        response = self.get(url, timeout=10)
 
         # see if the host is valid
         if (response.status_code == 200):
@@ -63,7 +63,7 @@ class BaseCommand(object):
 
     def is_valid_process_environment(self, name, environment):
         url = "{}/tool/v1/processes/{}/{}".format(self.dart_api_url, urllib.parse.quote(name), urllib.parse.quote(environment))
-        response = self.dart_api.get(url, timeout=10)
+        response = self.get(url, timeout=10)
 
         # see if the host is valid
         if (response.status_code == 200):
@@ -73,3 +73,44 @@ class BaseCommand(object):
 
         # otherwise raise the exception
         response.raise_for_status()
+
+    def change_assignments(self, process_name, operations):
+        # every change goes in one request. the api checks all of them before
+        # making any of them and then tells each host that was changed to
+        # rewrite its configuration. returns None if the changes were made or
+        # the reasons why they were not.
+        url = "{}/tool/v1/processes/{}".format(self.dart_api_url, urllib.parse.quote(process_name))
+        response = self.dart_api.patch(url, data=json.dumps(operations), timeout=60)
+
+        # catch expected errors
+        if (response.status_code in [400, 404]):
+            data = response.json()
+            reasons = ["{}: {}".format(operations[x["index"]]["value"]["fqdn"], x["message"]) for x in data.get("results", []) if (x["code"] != 200)]
+            return "; ".join(reasons) or data.get("message") or "Unknown error."
+
+        # catch any other errors
+        response.raise_for_status()
+
+        # the changes were made even if some of the hosts didn't hear about it
+        for rewrite in response.json()["rewrites"]:
+            rewrite = self.wait_for_command(rewrite)
+            if (rewrite["status"] != "sent"):
+                print("{} Rewrite command to {} was not confirmed: {}".format(colored("WARNING!", "yellow", attrs=["bold"]), rewrite["fqdn"], rewrite["message"] or "Still waiting to be sent."))
+
+    def wait_for_command(self, command, timeout=30):
+        # the api sends commands in the background. this waits until it has
+        # either sent the command or given up on it and returns the command.
+        url = "{}/coordination/v1/commands/{}".format(self.dart_api_url, urllib.parse.quote(command["id"]))
+        deadline = time.time() + timeout
+        while (True):
+            response = self.dart_api.get(url, params={"wait": 10}, timeout=20)
+
+            # commands are only known to the api worker that queued them so
+            # we might not be able to find out what happened
+            if (response.status_code == 404):
+                return dict(command, message="Unable to find out whether it was sent.")
+
+            response.raise_for_status()
+            command = response.json()
+            if (command["status"] in ["sent", "failed"] or time.time() > deadline):
+                return command
@@ -3,6 +3,7 @@ from termcolor import colored
 import urllib.parse
 import dart.common
 import traceback
+import json
 
 
 class CoordinationCommand(BaseCommand):
@@ -25,16 +26,25 @@ class CoordinationCommand(BaseCommand):
         try:
             if (process_name):
                 url = "{}/coordination/v1/{}/{}/{}".format(self.dart_api_url, urllib.parse.quote(action), urllib.parse.quote(fqdn), urllib.parse.quote(process_name))
-                response = self.dart_api.post(url, timeout=10)
-                response.raise_for_status()
-
-                print("{} Message sent to {} to {} {}.".format(colored("SUCCESS!", "green", attrs=["bold"]), fqdn, action, process_name))
+                description = "{} {}".format(action, process_name)
             else:
                 url = "{}/coordination/v1/{}/{}".format(self.dart_api_url, urllib.parse.quote(action), urllib.parse.quote(fqdn))
-                response = self.dart_api.post(url, timeout=10)
-                response.raise_for_status()
-
-                print("{} Message sent to {} to {}.".format(colored("SUCCESS!", "green", attrs=["bold"]), fqdn, action))
+                description = action
+
+            response = self.dart_api.post(url, timeout=10)
+            response.raise_for_status()
+
+            # the api sends the message in the background so find out if it
+            # actually got there
+            command = self.wait_for_command(response.json())
+            if (command["status"] == "failed"):
+                print("{} Could not send message to {} to {}: {}".format(colored("FAILURE!", "red", attrs=["bold"]), fqdn, description, command["message"]))
+                return 1
+            if (command["status"] != "sent"):
+                print("{} Message to {} to {} has not been sent yet: {}".format(colored("WARNING!", "yellow", attrs=["bold"]), fqdn, description, command["message"] or "Still waiting to be sent."))
+                return 0
+
+            print("{} Message sent to {} to {}.".format(colored("SUCCESS!", "green", attrs=["bold"]), fqdn, description))
             return 0
         except Exception as e:
             if (process_name):
@@ -44,32 +54,95 @@ class CoordinationCommand(BaseCommand):
             self.logger.debug(traceback.format_exc())
             return 1
 
+    def send_all(self, action, fqdns, process_name=None, all_hosts=False, parallelism=None, batch=None):
+        # one host on its own works like it always has
+        if (len(fqdns) == 1 and not all_hosts and parallelism is None and batch is None):
+            return self.send(fqdns[0], action, process_name)
+
+        if (not fqdns and not all_hosts):
+            print("{} Give one or more hosts or use --all to use every host the process is assigned to.".format(colored("FAILURE!", "red", attrs=["bold"])))
+            return 1
+        if (fqdns and all_hosts):
+            print("{} Give either a list of hosts or --all but not both.".format(colored("FAILURE!", "red", attrs=["bold"])))
+            return 1
+
+        # we aren't going to let anyone do anything to the dart agent
+        if (process_name is not None and process_name in dart.common.PROCESSES_TO_IGNORE):
+            print("{} No changes may be made to {} using this tool. Please use the host's supervisorctl command.".format(colored("FAILURE!", "red", attrs=["bold"]), process_name))
+            return 1
+
+        data = {}
+        if (fqdns):
+            data["hosts"] = fqdns
+        if (parallelism is not None):
+            data["parallelism"] = parallelism
+        if (batch is not None):
+            data["batch"] = batch
+
+        if (process_name):
+            url = "{}/coordination/v1/processes/{}/{}".format(self.dart_api_url, urllib.parse.quote(process_name), urllib.parse.quote(action))
+            description = "{} {}".format(action, process_name)
+        else:
+            url = "{}/coordination/v1/hosts/{}".format(self.dart_api_url, urllib.parse.quote(action))
+            description = action
+
+        try:
+            # the api sends the commands and tells us about each host as it
+            # finishes. a rolling restart can take a while.
+            response = self.dart_api.post(url, data=json.dumps(data), stream=True, timeout=(10, 300))
+
+            # catch expected errors
+            if (response.status_code in [400, 404]):
+                print("{} Could not send message to {}: {}".format(colored("FAILURE!", "red", attrs=["bold"]), description, response.json().get("message") or "Unknown error."))
+                return 1
+
+            # catch any other errors
+            response.raise_for_status()
+
+            failures = 0
+            for line in response.iter_lines():
+                if (not line):
+                    continue
+
+                command = json.loads(line)
+                if (command["status"] == "sent"):
+                    print("{} Message sent to {} to {}.".format(colored("SUCCESS!", "green", attrs=["bold"]), command["fqdn"], description))
+                else:
+                    failures += 1
+                    print("{} Could not send message to {} to {}: {}".format(colored("FAILURE!", "red", attrs=["bold"]), command["fqdn"], description, command["message"]))
+
+            return (1 if failures else 0)
+        except Exception as e:
+            print("{} Could not send message to {}: {}".format(colored("FAILURE!", "red", attrs=["bold"]), description, e))
+            self.logger.debug(traceback.format_exc())
+            return 1
+
 
 class StartCommand(CoordinationCommand):
-    def run(self, fqdn, process_name, **kwargs):
-        return self.send(fqdn, "start", process_name)
+    def run(self, fqdns, process_name, all_hosts=False, parallelism=None, batch=None, **kwargs):
+        return self.send_all("start", fqdns, process_name, all_hosts, parallelism, batch)
 
 
 class StopCommand(CoordinationCommand):
-    def run(self, fqdn, process_name, **kwargs):
-        return self.send(fqdn, "stop", process_name)
+    def run(self, fqdns, process_name, all_hosts=False, parallelism=None, batch=None, **kwargs):
+        return self.send_all("stop", fqdns, process_name, all_hosts, parallelism, batch)
 
 
 class RestartCommand(CoordinationCommand):
-    def run(self, fqdn, process_name, **kwargs):
-        return self.send(fqdn, "restart", process_name)
+    def run(self, fqdns, process_name, all_hosts=False, parallelism=None, batch=None, **kwargs):
+        return self.send_all("restart", fqdns, process_name, all_hosts, parallelism, batch)
 
 
 class UpdateCommand(CoordinationCommand):
-    def run(self, fqdn, process_name, **kwargs):
-        return self.send(fqdn, "update", process_name)
+    def run(self, fqdns, process_name, all_hosts=False, parallelism=None, batch=None, **kwargs):
+        return self.send_all("update", fqdns, process_name, all_hosts, parallelism, batch)
 
 
 class RereadCommand(CoordinationCommand):
-    def run(self, fqdn, **kwargs):
-        return self.send(fqdn, "reread")
+    def run(self, fqdns, parallelism=None, batch=None, **kwargs):
+        return self.send_all("reread", fqdns, parallelism=parallelism, batch=batch)
 
 
 class RewriteCommand(CoordinationCommand):
-    def run(self, fqdn, **kwargs):
-        return self.send(fqdn, "rewrite")
+    def run(self, fqdns, parallelism=None, batch=None, **kwargs):
+        return self.send_all("rewrite", fqdns, parallelism=parallelism, batch=batch)
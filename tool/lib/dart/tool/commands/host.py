@@ -7,14 +7,13 @@ import traceback
 
 
 class HostsCommand(BaseCommand):
-    def run(self, **kwargs):
+    def run(self, prefix=None, states=None, failed=False, pending=False, by_lag=False, **kwargs):
         try:
             print(colored("{:<80}".format("Hosts"), "grey", "on_white", attrs=["bold"]))
 
             url = "{}/tool/v1/hosts".format(self.dart_api_url)
-            response = self.dart_api.get(url, timeout=10)
-            response.raise_for_status()
-            hosts = response.json()
+            params = {"prefix": prefix, "state": states or [], "failed": "true" if failed else None, "pending": "true" if pending else None, "sort": "lag" if by_lag else None}
+            hosts = list(self.stream(url, params=params))
 
             # consistently tell our user what the current time is
             now = datetime.now()
@@ -42,6 +41,10 @@ class HostsCommand(BaseCommand):
                 if (host["disabled"] > 0):
                     parts.append(colored("{:>2} disabled".format(host["disabled"]), "red", attrs=["bold"]))
 
+                # show how far behind supervisord the agent is if it is lagging
+                if (host.get("lagging")):
+                    parts.append(colored(_describe_lag(host["telemetry"]), "red", attrs=["bold"]))
+
                 # this is when we last polled this host
                 last_polled = host["polled"]
 
@@ -70,7 +73,7 @@ class HostCommand(BaseCommand):
             now = datetime.now()
 
             url = "{}/tool/v1/hosts/{}".format(self.dart_api_url, urllib.parse.quote(fqdn))
-            response = self.dart_api.get(url, timeout=10)
+            response = self.get(url, timeout=10)
 
             # if we get a 404 then give something informative
             if (response.status_code == 404):
@@ -97,6 +100,14 @@ class HostCommand(BaseCommand):
                 print("       Booted: unknown")
 
             print("       Kernel: {}".format(host["kernel"] if host["kernel"] is not None else "unknown"))
+
+            telemetry = host.get("telemetry")
+            if (telemetry):
+                lag = _describe_lag(telemetry)
+                print("          Lag: {}".format(colored(lag, "red", attrs=["bold"]) if host.get("lagging") else lag))
+                print("       Queued: {}".format(", ".join("{} {}".format(v, k) for k, v in sorted((telemetry.get("queued") or {}).items())) or "nothing"))
+            else:
+                print("          Lag: unknown")
             print("")
 
             active = {}
@@ -254,3 +265,14 @@ class HostCommand(BaseCommand):
             print("{} Could not get the host: {}".format(colored("FAILURE!", "red", attrs=["bold"]), e))
             self.logger.debug(traceback.format_exc())
             return 1
+
+
+def _describe_lag(telemetry):
+    parts = []
+    if (telemetry.get("lag") is None):
+        parts.append("lag unknown")
+    else:
+        parts.append("{}s behind".format(round(telemetry["lag"], 1)))
+    if (telemetry.get("dropped")):
+        parts.append("{} dropped".format(telemetry["dropped"]))
+    return ", ".join(parts)
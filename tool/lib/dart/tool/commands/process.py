@@ -7,14 +7,13 @@ import traceback
 
 
 class ProcessesCommand(BaseCommand):
-    def run(self, **kwargs):
+    def run(self, prefix=None, states=None, failed=False, pending=False, **kwargs):
         try:
             print(colored("{:<80}".format("Processes"), "grey", "on_white", attrs=["bold"]))
 
             url = "{}/tool/v1/processes".format(self.dart_api_url)
-            response = self.dart_api.get(url, timeout=10)
-            response.raise_for_status()
-            processes = response.json()
+            params = {"prefix": prefix, "state": states or [], "failed": "true" if failed else None, "pending": "true" if pending else None}
+            processes = list(self.stream(url, params=params))
 
             # get the max process name size
             width = 0
@@ -55,10 +54,10 @@ class ProcessesCommand(BaseCommand):
                     if (process["configured"] == 0):
                         parts.append(colored("active but not configured", "red", attrs=["bold"]))
 
-                    if (len(set(process["active_hosts"]).difference(process["assigned_hosts"]))):
+                    if (process["unassigned_active"] > 0):
                         parts.append(colored("active on hosts not assigned", "red", attrs=["bold"]))
 
-                    if (len(set(process["pending_hosts"]).difference(process["assigned_hosts"]))):
+                    if (process["unassigned_pending"] > 0):
                         parts.append(colored("pending on hosts not assigned", "red", attrs=["bold"]))
 
                 print(", ".join(parts))
@@ -77,7 +76,7 @@ class ProcessCommand(BaseCommand):
             now = datetime.now()
 
             url = "{}/tool/v1/processes/{}".format(self.dart_api_url, urllib.parse.quote(name))
-            response = self.dart_api.get(url, timeout=10)
+            response = self.get(url, timeout=10)
 
             # if we get a 404 then give something informative
             if (response.status_code == 404):
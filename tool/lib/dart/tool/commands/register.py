@@ -7,7 +7,7 @@ import json
 
 
 class RegisterCommand(BaseCommand):
-    def run(self, path, **kwargs):
+    def run(self, path, dry_run=False, **kwargs):
         body = None
 
         try:
@@ -28,7 +28,7 @@ class RegisterCommand(BaseCommand):
         try:
             print("Sending registration request using {}.".format(path))
             url = "{}/tool/v1/register".format(self.dart_api_url)
-            response = self.dart_api.post(url, data=json.dumps(body), timeout=60)
+            response = self.dart_api.post(url, params={"dry_run": "true" if dry_run else None}, data=json.dumps(body), timeout=60)
             data = response.json()
 
             # try to print something helpful
@@ -40,11 +40,17 @@ class RegisterCommand(BaseCommand):
             response.raise_for_status()
 
             # print what we just registered
-            for process in response.json()["registered"]:
-                print("* Registered {} named {} in {}.".format(process["type"], process["name"], process["environment"]))
+            for process in data["registered"]:
+                if (process.get("status") == "unchanged"):
+                    continue
+                print("* {} {} named {} in {}.".format("Would register" if dry_run else "Registered", process["type"], process["name"], process["environment"]))
+            print("{} added, {} changed, {} unchanged.".format(data.get("added", 0), data.get("changed", 0), data.get("unchanged", 0)))
 
             # success
-            print("{} Finished loading {} into dart.".format(colored("SUCCESS!", "green", attrs=["bold"]), path))
+            if (dry_run):
+                print("{} Nothing was loaded from {} because this was a dry run.".format(colored("SUCCESS!", "green", attrs=["bold"]), path))
+            else:
+                print("{} Finished loading {} into dart.".format(colored("SUCCESS!", "green", attrs=["bold"]), path))
             return 0
         except Exception as e:
             print("{} Could not load {}: {}".format(colored("FAILURE!", "red", attrs=["bold"]), path, e))